@@ -1,3 +1,6 @@
+import gzip
+import hashlib
+import hmac
 import time
 from os.path import split
 
@@ -128,19 +131,52 @@ ucon:Policy_AutoDisc a ucon:Authorization ;
     return ttl_template, file_name
 
 
+def open_log(file_name):
+    # Come la piattaforma: per i log .xes.gz hash e prova sono sul contenuto decompresso
+    with open(file_name, "rb") as raw:
+        compressed = raw.read(2) == b"\x1f\x8b"
+    return gzip.open(file_name, "rb") if compressed else open(file_name, "rb")
+
+
+# SHA-256 del log e prova di possesso per il nonce (HMAC-SHA256 con chiave il nonce),
+# calcolati in una sola lettura
+def hash_and_prove(file_name, nonce, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    mac = hmac.new(nonce.encode(), digestmod=hashlib.sha256)
+    with open_log(file_name) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            mac.update(chunk)
+    return digest.hexdigest(), mac.hexdigest()
+
+
 def send_files(server_url, log_file_name, policy_file_name):
     url = f"{server_url}/setup"
-    files = {
-        "log_file": open(log_file_name, "rb"),
-        "policy_file": open(policy_file_name, "rb"),
-    }
 
     try:
-        response = requests.post(url, files=files)
-        for f in files.values():
-            f.close()  # Chiude i file dopo l'invio
-
-        if response.status_code == 200:
+        # Precheck: se il log (stesso SHA-256) è già sulla piattaforma si invia solo il
+        # riferimento, con la prova di possesso per il nonce ricevuto
+        response = None
+        challenge = requests.post(f"{server_url}/logs/challenge")
+        if challenge.status_code == 200:
+            nonce = challenge.json()["nonce"]
+            log_hash, proof = hash_and_prove(log_file_name, nonce)
+            precheck = requests.head(f"{server_url}/logs/{log_hash}", params={"nonce": nonce, "proof": proof})
+            if precheck.status_code == 200:
+                print(f"Log already on the platform ({log_hash}), sending policy only.")
+                with open(policy_file_name, "rb") as policy_file:
+                    response = requests.post(url, files={"policy_file": policy_file},
+                                             data={"log_sha256": log_hash, "log_filename": split(log_file_name)[1],
+                                                   "log_nonce": nonce, "log_proof": proof})
+                if response.status_code in (400, 404):
+                    # Nonce scaduto o log non più disponibile: si ricade sull'upload completo
+                    response = None
+
+        if response is None:
+            with open(log_file_name, "rb") as log_file, open(policy_file_name, "rb") as policy_file:
+                response = requests.post(url, files={"log_file": log_file, "policy_file": policy_file})
+
+        if response.status_code in (200, 201):
             print("Files sent successfully!")
             print("Server response:", response.text)
 
@@ -1,52 +1,163 @@
+import os
+import re
 from flask import Flask, request, jsonify
-from rdflib import Graph
-from policy_utils import parse_policy_turtle, save_policy_instance
+from policy_utils import (load_policy, save_policy_instance, spool_log_upload, discard_spool,
+                          find_proven_log, spool_existing_log, reclaim_blobs, LOG_CHALLENGE_TTL, SPOOL_DIR)
+from registry import issue_log_challenge, log_challenge_valid, consume_log_challenge
+from policy_cache import POLICY_CACHE
+from jobs import submit_job, get_job, recover_orphaned_jobs
 
 app = Flask(__name__)
 
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+MAX_LOOKUP_BATCH = 1000
+
+# Operazioni all'avvio di ogni processo della piattaforma: job asincroni e spool lasciati
+# da un worker terminato, blob rimasti senza riferimenti. Sotto gunicorn la chiama
+# post_worker_init (gunicorn.conf.py) in ogni worker, anche con --preload e dopo un riavvio.
+def start_platform():
+    recover_orphaned_jobs(SPOOL_DIR)
+    reclaim_blobs()
+
 def validate_policy(policy_json):
     print("Validating policy...")
     # Placeholder: aggiungi controlli su structure, valori, vincoli, etc.
     return True
 
-@app.route("/setup", methods=["POST"])
-def setup_policy():
-    if "policy_file" not in request.files or "log_file" not in request.files:
-        return jsonify({"error": "Both policy_file and log_file are required."}), 400
-
-    policy_file = request.files["policy_file"]
-    log_file = request.files["log_file"]
-
-    policy_bytes = policy_file.read()
-    log_bytes = log_file.read()
-
-    # parse RDF dalla stringa di policy
-    g = Graph()
-    g.parse(data=policy_bytes, format="ttl")
-    policy_json = parse_policy_turtle(g)
+# Pipeline di ingestione: parsing della policy, validazione e salvataggio dell'istanza.
+# Lo spool del log viene sempre rimosso (o spostato in data/<id>/) al termine.
+# Ritorna (status HTTP, corpo della risposta).
+def ingest_submission(policy_bytes, log_filename, log_spool_path, log_hash):
+    try:
+        # parse RDF dalla stringa di policy (cache per contenuto, fast-path, fallback su rdflib)
+        g, policy_json, structure_hash = load_policy(policy_bytes)
 
-    # Validazione della policy
-    validate_policy(policy_json)
+        # Validazione della policy
+        validate_policy(policy_json)
 
-    log_file.seek(0)
-    log_bytes = log_file.read()
-
-    # Salvataggio
-    #result = save_policy_instance(g, policy_json, policy_bytes, log_file.filename, log_bytes)
-    result = save_policy_instance(g, policy_json, policy_bytes, log_file.filename, log_bytes)
+        # Salvataggio
+        result = save_policy_instance(g, policy_json, policy_bytes, log_filename, log_spool_path, log_hash,
+                                      structure_hash=structure_hash)
+    finally:
+        discard_spool(log_spool_path)
 
     policy_json["policies"][0]["source_policy"] = str(result["config_path"]) + "/policy.ttl"
 
     if result.get("duplicate"):
-        return jsonify({
+        return 200, {
             "message": "Duplicate detected. Using existing configuration.",
             "details": result
-        }), 200
+        }
     else:
-        return jsonify({
+        return 201, {
             "message": "Policy and log saved successfully.",
             "details": result
-        }), 201
+        }
+
+def run_setup_job(policy_bytes, log_filename, log_spool_path, log_hash):
+    status, body = ingest_submission(policy_bytes, log_filename, log_spool_path, log_hash)
+    return {"http_status": status, **body}
+
+@app.route("/setup", methods=["POST"])
+def setup_policy():
+    # Il log può arrivare come file oppure come riferimento (log_sha256) a un log già sulla
+    # piattaforma, accompagnato dalla prova di possesso (log_nonce, log_proof)
+    log_ref = request.form.get("log_sha256", "").lower()
+    if "policy_file" not in request.files or ("log_file" not in request.files and not log_ref):
+        return jsonify({"error": "Both policy_file and log_file (or log_sha256) are required."}), 400
+    if log_ref and not SHA256_RE.match(log_ref):
+        return jsonify({"error": "log_sha256 must be a hex SHA-256 digest."}), 400
+    if log_ref and "log_file" not in request.files:
+        nonce = request.form.get("log_nonce", "")
+        if not request.form.get("log_proof") or not consume_log_challenge(nonce):
+            return jsonify({"error": "log_sha256 requires log_proof for a valid log_nonce from /logs/challenge."}), 400
+
+    # Modalità asincrona opzionale: ?async=1 oppure campo form async=1
+    async_mode = (request.args.get("async") or request.form.get("async", "")).lower() in ("1", "true", "yes")
+
+    policy_file = request.files["policy_file"]
+    policy_bytes = policy_file.read()
+
+    if "log_file" in request.files:
+        # Il log viene copiato a blocchi in uno spool su disco (hash calcolato in streaming)
+        log_file = request.files["log_file"]
+        try:
+            log_spool_path, log_hash = spool_log_upload(log_file.stream)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        log_filename = log_file.filename
+    else:
+        log_spool_path = spool_existing_log(log_ref, nonce, request.form["log_proof"])
+        if log_spool_path is None:
+            return jsonify({"error": "Unknown log_sha256, upload the log_file instead.",
+                            "sha256": log_ref}), 404
+        log_filename = os.path.basename(request.form.get("log_filename", "")) or f"{log_ref}.xes"
+        log_hash = log_ref
+
+    if not async_mode:
+        status, body = ingest_submission(policy_bytes, log_filename, log_spool_path, log_hash)
+        return jsonify(body), status
+
+    # Il corpo della richiesta è già su disco: il resto della pipeline gira nel pool
+    job_id = submit_job(run_setup_job, policy_bytes, log_filename, log_spool_path, log_hash,
+                        spool_path=log_spool_path)
+    if job_id is None:
+        discard_spool(log_spool_path)
+        return jsonify({"error": "Too many pending setup jobs, retry later."}), 503, {"Retry-After": "5"}
+    status_url = f"/jobs/{job_id}"
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id."}), 404
+    return jsonify(job), 200
+
+# Precheck: il client chiede se un suo log (per SHA-256) è già sulla piattaforma prima di
+# caricarlo. Conoscere lo SHA-256 non basta: il client ottiene un nonce da /logs/challenge e
+# risponde con l'HMAC-SHA256 del contenuto del log (vedi policy_utils.log_proof). Senza
+# prova valida il log risulta assente.
+@app.route("/logs/challenge", methods=["POST"])
+def log_challenge():
+    return jsonify({"nonce": issue_log_challenge(LOG_CHALLENGE_TTL), "expires_in": LOG_CHALLENGE_TTL}), 200
+
+@app.route("/logs/<log_hash>", methods=["GET", "HEAD"])
+def log_exists(log_hash):
+    log_hash = log_hash.lower()
+    nonce = request.args.get("nonce", "")
+    if not SHA256_RE.match(log_hash):
+        return jsonify({"error": "Invalid SHA-256 digest."}), 400
+    if not log_challenge_valid(nonce):
+        return jsonify({"error": "nonce is missing or expired, request one from /logs/challenge."}), 400
+    log_path = find_proven_log(log_hash, nonce, request.args.get("proof", ""))
+    if log_path is None:
+        return jsonify({"sha256": log_hash, "exists": False}), 404
+    return jsonify({"sha256": log_hash, "exists": True, "size": log_path.stat().st_size}), 200
+
+# Variante batch: {"nonce": ..., "proofs": {sha256: proof, ...}}
+@app.route("/logs/lookup", methods=["POST"])
+def log_lookup():
+    body = request.get_json(silent=True) or {}
+    proofs = body.get("proofs")
+    nonce = body.get("nonce")
+    if not isinstance(proofs, dict) or len(proofs) > MAX_LOOKUP_BATCH:
+        return jsonify({"error": f"'proofs' must map at most {MAX_LOOKUP_BATCH} digests to their proofs."}), 400
+    if not isinstance(nonce, str) or not log_challenge_valid(nonce):
+        return jsonify({"error": "'nonce' is missing or expired, request one from /logs/challenge."}), 400
+    present, missing = [], []
+    for log_hash, proof in proofs.items():
+        log_hash = log_hash.lower()
+        if not SHA256_RE.match(log_hash):
+            return jsonify({"error": f"Invalid SHA-256 digest: {log_hash}"}), 400
+        found = isinstance(proof, str) and find_proven_log(log_hash, nonce, proof) is not None
+        (present if found else missing).append(log_hash)
+    return jsonify({"present": present, "missing": missing}), 200
+
+@app.route("/stats/policy_cache", methods=["GET"])
+def policy_cache_stats():
+    return jsonify(POLICY_CACHE.stats()), 200
 
 if __name__ == "__main__":
+    start_platform()
     app.run(debug=True)
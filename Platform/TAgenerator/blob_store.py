@@ -0,0 +1,145 @@
+import os
+import re
+import shutil
+from pathlib import Path
+
+from file_lock import exclusive_lock
+
+# Store globale dei log indirizzato per contenuto: generated_tas/.blobs/<aa>/<sha256>.
+# Ogni data/<id>/<log_filename> è un hard link (o reflink, o in ultima istanza una
+# copia) verso il blob, quindi lo stesso log condiviso da più policy o più TA occupa
+# spazio una volta sola. I riferimenti sono contati nel registro (tabelle blobs e
+# config_blobs) e vengono presi sotto BLOB_LOCK insieme al collegamento: chi, tenendo
+# BLOB_LOCK, trova il contatore a zero sa che nessun setup sta usando il blob, e
+# collect_garbage rimuove così i blob rimasti senza riferimenti.
+# I blob sono in sola lettura: un hard link non deve permettere di alterare il log
+# delle altre configurazioni.
+
+BLOB_ROOT = Path("generated_tas") / ".blobs"
+BLOB_LOCK = BLOB_ROOT / ".lock"
+
+FICLONE = 0x40049409  # ioctl Linux per il reflink (btrfs, xfs)
+GZIP_MAGIC = b"\x1f\x8b"
+BLOB_NAME_RE = re.compile(r"^([0-9a-f]{64})(\.artifacts|\.views)?$")
+
+
+def blob_path(log_hash, root=BLOB_ROOT):
+    return root / log_hash[:2] / log_hash
+
+
+# Artefatti derivati dal log (vedi ingest_artifacts): dipendono solo dal contenuto,
+# quindi vivono accanto al blob e vengono collegati in data/<id>/artifacts/
+def artifact_dir(log_hash, root=BLOB_ROOT):
+    return root / log_hash[:2] / f"{log_hash}.artifacts"
+
+
+def link_artifacts(log_hash, target_dir):
+    return _link_dir(artifact_dir(log_hash), target_dir)
+
+
+# Viste materializzate delle policy (vedi policy_views): dipendono dal log e dall'hash
+# canonico delle regole, vengono collegate in data/<id>/views/<hash regole>/
+def views_dir(log_hash, root=BLOB_ROOT):
+    return root / log_hash[:2] / f"{log_hash}.views"
+
+
+def view_dir(log_hash, rules_hash, root=BLOB_ROOT):
+    return views_dir(log_hash, root) / rules_hash
+
+
+def link_view(log_hash, rules_hash, target_dir):
+    return _link_dir(view_dir(log_hash, rules_hash), target_dir)
+
+
+def _link_dir(source_dir, target_dir):
+    if not source_dir.is_dir():
+        return []
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    linked = []
+    for source in sorted(source_dir.iterdir()):
+        if source.suffix == ".tmp":
+            continue
+        target = target_dir / source.name
+        target.unlink(missing_ok=True)
+        _link_or_copy(source, target)
+        linked.append(source.name)
+    return linked
+
+
+def _reflink(source, target):
+    import fcntl
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        _reflink(source, target)
+        return "reflink"
+    except (OSError, ImportError):
+        Path(target).unlink(missing_ok=True)
+    shutil.copyfile(source, target)
+    return "copy"
+
+
+# Il nome del log in data/<id>/ riflette il contenuto del blob: se è gzip finisce in .gz.
+# Va calcolato sul blob e non sullo spool, che viene scartato se il blob esiste già.
+def stored_name(log_filename, log_hash):
+    with open(blob_path(log_hash), "rb") as f:
+        compressed = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    if compressed and not log_filename.endswith(".gz"):
+        return log_filename + ".gz"
+    if not compressed and log_filename.endswith(".gz"):
+        return log_filename[:-len(".gz")]
+    return log_filename
+
+
+# Sposta lo spool nello store (se il blob non c'è già), lo collega in target_dir e prende
+# il riferimento con add_ref prima di rilasciare il lock.
+# Ritorna il nome del log collegato (vedi stored_name).
+def store_and_link(spool_path, log_hash, target_dir, log_filename, add_ref):
+    blob = blob_path(log_hash)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    with exclusive_lock(BLOB_LOCK):
+        if blob.exists():
+            Path(spool_path).unlink(missing_ok=True)
+        else:
+            os.replace(spool_path, blob)
+            os.chmod(blob, 0o444)
+        log_filename = stored_name(log_filename, log_hash)
+        _link_or_copy(blob, Path(target_dir) / log_filename)
+        add_ref(log_hash)
+        return log_filename
+
+
+# Hash presenti nello store: blob, oppure artefatti e viste rimasti senza blob
+def stored_hashes(root=BLOB_ROOT):
+    hashes = set()
+    for entry in Path(root).glob("*/*"):
+        match = BLOB_NAME_RE.match(entry.name)
+        if match:
+            hashes.add(match.group(1))
+    return sorted(hashes)
+
+
+# Rimuove blob, artefatti e viste degli hash (tutti quelli nello store se log_hashes è
+# None) per cui referenced(hash) è falso. referenced viene valutata sotto BLOB_LOCK, lo
+# stesso lock sotto cui store_and_link collega il blob e prende il riferimento.
+# Ritorna gli hash rimossi.
+def collect_garbage(referenced, log_hashes=None):
+    removed = []
+    with exclusive_lock(BLOB_LOCK):
+        for log_hash in (stored_hashes() if log_hashes is None else log_hashes):
+            if referenced(log_hash):
+                continue
+            blob_path(log_hash).unlink(missing_ok=True)
+            shutil.rmtree(artifact_dir(log_hash), ignore_errors=True)
+            shutil.rmtree(views_dir(log_hash), ignore_errors=True)
+            removed.append(log_hash)
+    return removed
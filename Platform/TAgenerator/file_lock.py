@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Lock esclusivo tra processi (e tra thread: ogni acquisizione apre un nuovo
+# descrittore) basato su flock, con fallback su msvcrt per Windows.
+# Usato per serializzare deduplica, allocazione degli id e scrittura di mapping.json
+# quando app.py gira con più worker (es. gunicorn -w N).
+
+try:
+    import fcntl
+
+    def _acquire(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _release(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+
+    def _acquire(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue  # LK_LOCK rinuncia dopo ~10s: si riprova
+
+    def _release(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def exclusive_lock(lock_path):
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _acquire(fd)
+        try:
+            yield
+        finally:
+            _release(fd)
+    finally:
+        os.close(fd)
+
+
+# Scrittura atomica: file temporaneo nella stessa directory, fsync e rename.
+# Un lettore concorrente vede sempre la versione vecchia o quella nuova, mai metà file.
+def write_json_atomic(path, obj):
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as out:
+            out.write(json.dumps(obj, indent=2))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
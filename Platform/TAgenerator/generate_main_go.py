@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 
@@ -17,19 +18,99 @@ go 1.21
     print(f"[build] go.mod creato in {go_mod_path}")
 
 
+# Regole di logUsageRules e outputRules applicate dal TA generato
+LOG_RULES = ("accessControlRules", "allowedLocations", "logExpiration", "maxAccessCount",
+             "semanticLogConstraints", "allowedTimeRange", "attributeExclusionRules")
+OUTPUT_RULES = ("accessControlRules", "allowedLocations", "outputExpiration", "maxAccessCount")
+
+LOG_RULE_FIELDS = {
+    "accessControlRules": """    AccessControlRules []string `json:"accessControlRules"`
+""",
+    "allowedLocations": """    AllowedLocations   []string `json:"allowedLocations"`
+""",
+    "logExpiration": """    LogExpiration      string   `json:"logExpiration"`
+""",
+    "maxAccessCount": """    MaxAccessCount     *float64 `json:"maxAccessCount"`
+""",
+    "semanticLogConstraints": """
+    SemanticLogConstraints struct {
+        MustInclude []string `json:"mustInclude"`
+        MustExclude []string `json:"mustExclude"`
+    } `json:"semanticLogConstraints"`
+""",
+    "allowedTimeRange": """
+    AllowedTimeRange struct {
+        StartDate string `json:"startDate"`
+        EndDate   string `json:"endDate"`
+    } `json:"allowedTimeRange"`
+""",
+    "attributeExclusionRules": """
+    AttributeExclusionRules struct {
+        ExcludedAttributes attributeKeyRule `json:"excludedAttributes"`
+    } `json:"attributeExclusionRules"`
+""",
+}
+
+OUTPUT_RULE_FIELDS = {
+    "accessControlRules": """    AccessControlRules []string `json:"accessControlRules"`
+""",
+    "allowedLocations": """    AllowedLocations   []string `json:"allowedLocations"`
+""",
+    "outputExpiration": """    OutputExpiration   string   `json:"outputExpiration"`
+""",
+    "maxAccessCount": """    MaxAccessCount     *float64 `json:"maxAccessCount"`
+""",
+}
+
+
+# Regole presenti nella policy da cui viene generato il TA. La struttura (chiavi, tipi e
+# algoritmi, vedi compute_policy_structure_hash) è la stessa per tutte le configurazioni
+# del TA, quindi il codice generato contiene solo i controlli per queste regole.
+# Senza policy si genera il codice completo.
+def policy_features(policy_json=None):
+    if policy_json is None:
+        return {"log": set(LOG_RULES), "output": set(OUTPUT_RULES), "attribute_key": True, "algorithms": None}
+    policy = policy_json["policies"][0]
+    log_rules = policy.get("logUsageRules") or {}
+    output_rules = policy.get("outputRules") or {}
+    exclusion = log_rules.get("attributeExclusionRules")
+    techniques = (policy.get("processingRules") or {}).get("allowedTechniques") or []
+    return {
+        "log": {name for name in LOG_RULES if log_rules.get(name) is not None},
+        "output": {name for name in OUTPUT_RULES if output_rules.get(name) is not None},
+        "attribute_key": isinstance(exclusion, dict) and isinstance(exclusion.get("excludedAttributes"), dict),
+        "algorithms": sorted({tech["algorithm"] for tech in techniques
+                              if isinstance(tech, dict) and isinstance(tech.get("algorithm"), str)}),
+    }
+
+
 def generate_main_header():
     return """package main
 
 import (
+    "bufio"
+    "compress/gzip"
+    "container/list"
+    "context"
+    "crypto/sha256"
+    "encoding/binary"
+    "encoding/hex"
     "encoding/json"
     "encoding/xml"
+    "errors"
+    "flag"
     "fmt"
-    "io/ioutil"
+    "hash/crc32"
+    "io"
+    "math/bits"
     "net/http"
     "os"
+    "os/signal"
     "path/filepath"
-    "strconv"
+    "sort"
     "strings"
+    "sync"
+    "syscall"
     "time"
 )
 
@@ -66,19 +147,48 @@ type AttributeDate struct {
 }
 
 func main() {
+    flag.BoolVar(&auditStrict, "audit-strict", auditStrict, "Risponde solo dopo la fsync della riga di audit")
+    flag.DurationVar(&auditSyncInterval, "audit-sync-interval", auditSyncInterval, "Intervallo massimo tra due fsync di audit.txt")
+    flag.IntVar(&auditSyncBatch, "audit-sync-batch", auditSyncBatch, "Righe di audit scritte prima di una fsync")
+    logCacheMB := flag.Int64("log-cache-mb", logCacheBudget>>20, "Memoria per i log decodificati in cache (MB, entro l'heapSize dell'enclave)")
+    flag.Parse()
+    logCacheBudget = *logCacheMB << 20
+    if auditSyncInterval <= 0 || auditSyncBatch <= 0 {
+        fmt.Println("-audit-sync-interval e -audit-sync-batch devono essere positivi")
+        os.Exit(1)
+    }
+
     http.HandleFunc("/access_log", handleAccessLog)
     http.HandleFunc("/process", handleProcess)
     http.HandleFunc("/get_output", handleGetOutput)
     http.HandleFunc("/policy", handleGetPolicy)
 
+    // Alla chiusura si attendono le richieste in corso e si scrive l'audit ancora in coda
+    server := &http.Server{Addr: ":8080"}
+    stop := make(chan os.Signal, 1)
+    closed := make(chan struct{})
+    signal.Notify(stop, syscall.SIGINT, syscall.SIGTERM)
+    go func() {
+        <-stop
+        server.Shutdown(context.Background())
+        close(closed)
+    }()
+
     fmt.Println("Trusted App started on port 8080")
-    http.ListenAndServe(":8080", nil)
+    if err := server.ListenAndServe(); errors.Is(err, http.ErrServerClosed) {
+        <-closed
+    }
+    flushAuditLogs()
 }
 """
 
 
-def generate_access_log_handler():
-    return """func handleAccessLog(w http.ResponseWriter, r *http.Request) {
+def generate_access_log_handler(features):
+    semantic = "semanticLogConstraints" in features["log"]
+    time_range = "allowedTimeRange" in features["log"]
+    attribute_key = features["attribute_key"]
+
+    code = """func handleAccessLog(w http.ResponseWriter, r *http.Request) {
     if r.Method != "POST" {
         http.Error(w, "Invalid method", http.StatusMethodNotAllowed)
         return
@@ -91,181 +201,253 @@ def generate_access_log_handler():
     }
 
     base := filepath.Join("generated_tas", req.TaHash)
-    policyPath := filepath.Join(base, "configs", req.ConfigID, "policy_config.json")
     dataPath := filepath.Join(base, "data", req.ConfigID)
 
-    policyBytes, err := os.ReadFile(policyPath)
+    policy, err := loadPolicy(base, req.ConfigID)
     if err != nil {
-        http.Error(w, "Policy not found", http.StatusNotFound)
+        policyError(w, err)
         return
     }
 
-    var policy map[string]interface{}
-    if err := json.Unmarshal(policyBytes, &policy); err != nil {
-        http.Error(w, "Failed to parse policy", http.StatusInternalServerError)
+    // Controlli accessControlRules, allowedLocations e logExpiration
+    if status, msg := checkLogUsage(policy, &req); status != 0 {
+        http.Error(w, msg, status)
         return
     }
 
-    pol := policy["policies"].([]interface{})[0].(map[string]interface{})
-    logRules := pol["logUsageRules"].(map[string]interface{})
-
-    // Controllo accessControlRules
-    authorizedUsers := logRules["accessControlRules"].([]interface{})
-    allowed := false
-    for _, u := range authorizedUsers {
-        if u.(string) == req.User {
-            allowed = true
-            break
-        }
+    // Controllo maxAccessCount e incremento del contatore
+""" + generate_counter_increment("access_count.txt", "log" if "maxAccessCount" in features["log"] else None,
+                                 "Max access count exceeded")
+    if not (semantic or time_range or attribute_key):
+        # Nessun filtro nella struttura della policy (e parsePolicy rifiuta configurazioni
+        # con una struttura diversa): il log memorizzato è già la risposta
+        code += """
+    // Nessun filtro sul log: viene inviato il file memorizzato
+    xesPath, err := xesLogPath(dataPath)
+    if err != nil {
+        http.Error(w, "Log file not found", http.StatusNotFound)
+        return
     }
-    if !allowed {
-        http.Error(w, "User not authorized", http.StatusForbidden)
+    f, err := os.Open(xesPath)
+    if err != nil {
+        http.Error(w, "Log file not found", http.StatusNotFound)
         return
     }
-
-    // Controllo allowedLocations
-    if locs, ok := logRules["allowedLocations"]; ok {
-        locationAllowed := false
-        for _, loc := range locs.([]interface{}) {
-            if loc.(string) == req.Location {
-                locationAllowed = true
-                break
-            }
-        }
-        if !locationAllowed {
-            http.Error(w, "Location not authorized", http.StatusForbidden)
-            return
-        }
+    defer f.Close()
+    info, err := f.Stat()
+    if err != nil {
+        http.Error(w, "Log file not found", http.StatusNotFound)
+        return
     }
 
-    // Controllo logExpiration
-    if expRaw, ok := logRules["logExpiration"]; ok {
-        expiration, err := time.Parse(time.RFC3339, expRaw.(string))
-        if err == nil && time.Now().After(expiration) {
-            http.Error(w, "Log expired", http.StatusForbidden)
-            return
+    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "access log", true, req.Location)
+    serveLogFile(w, r, f, info, configLogHash(base, req.ConfigID))
+}"""
+        return code
+
+    code += """
+    // Filtri (preparati una volta sola al caricamento della policy)
+    filters := policy.filters
+
+    // Vista materializzata al setup per queste regole: la risposta è già pronta e viene
+    // inviata con ServeContent (Range, ETag, sendfile)
+    logHash := configLogHash(base, req.ConfigID)
+    if view, err := loadPolicyView(dataPath, logHash, filters.viewKey); err == nil {
+        if f, err := os.Open(filepath.Join(view.dir, "access_log.xml")); err == nil {
+            defer f.Close()
+            if info, err := f.Stat(); err == nil {
+                logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "access log", true, req.Location)
+                w.Header().Set("Content-Type", "application/xml")
+                w.Header().Set("ETag", opaqueETag(logHash, filters.viewKey))
+                http.ServeContent(w, r, "", info.ModTime(), f)
+                return
+            }
         }
     }
-
-    // Controllo maxAccessCount
-    accessCountFile := filepath.Join(dataPath, "access_count.txt")
-    accessCount := 0
-    if bytes, err := os.ReadFile(accessCountFile); err == nil {
-        fmt.Sscanf(string(bytes), "%d", &accessCount)
-    }
-    if maxCountRaw, ok := logRules["maxAccessCount"]; ok {
-        maxCount := int(maxCountRaw.(float64))
-        if accessCount >= maxCount {
-            http.Error(w, "Max access count exceeded", http.StatusForbidden)
-            return
-        }
+"""
+    if semantic:
+        code += """
+    // Tracce selezionate da mustInclude/mustExclude tramite l'indice (nil se non disponibile):
+    // le altre vengono saltate senza decodificarle
+    var selected []uint64
+    if index, err := loadActivityIndex(dataPath, logHash); err == nil {
+        selected = index.selectTraces(filters.required, filters.excluded)
     }
-    accessCount += 1
-    os.WriteFile(accessCountFile, []byte(fmt.Sprintf("%d", accessCount)), 0644)
-
-    // Parsing del log XES
-    xesPath := filepath.Join(dataPath, "log.xes")
-    xesContent, err := os.ReadFile(xesPath)
+"""
+    code += """
+    // Parsing del log XES e risposta in streaming, una traccia alla volta: la memoria
+    // dipende dalla traccia più grande, non dalla dimensione del log
+    xesReader, err := openXesLog(dataPath)
     if err != nil {
         http.Error(w, "Log file not found", http.StatusNotFound)
         return
     }
+    defer xesReader.Close()
+
+    // Le prime tracce restano in bw: se il log risulta non valido prima che si riempia
+    // si risponde ancora con un errore (l'encoder riuserebbe un *bufio.Writer passato
+    // direttamente, svuotandolo a ogni traccia)
+    out := &responseStream{w: w}
+    bw := bufio.NewWriterSize(out, 64*1024)
+    enc := xml.NewEncoder(struct{ io.Writer }{bw})
+    enc.Indent("", "  ")
+    logStart := xml.StartElement{Name: xml.Name{Local: "log"}}
+    traceStart := xml.StartElement{Name: xml.Name{Local: "trace"}}
+    w.Header().Set("Content-Type", "application/xml")
 
-    var logData XES
-    if err := xml.Unmarshal(xesContent, &logData); err != nil {
-        http.Error(w, "Invalid XES format", http.StatusInternalServerError)
-        return
-    }
-
-    // Filtri
-    required := map[string]bool{}
-    excluded := map[string]bool{}
-    if sem, ok := logRules["semanticLogConstraints"].(map[string]interface{}); ok {
-        for _, inc := range sem["mustInclude"].([]interface{}) {
-            required[inc.(string)] = true
+    err = enc.EncodeToken(logStart)
+    if err == nil {
+        err = forEachTrace(xesReader, func(t int, dec *xml.Decoder, start *xml.StartElement) error {
+"""
+    trace_code = ""
+    if semantic:
+        trace_code += """        if !traceSelected(selected, t) {
+            return dec.Skip()
         }
-        for _, exc := range sem["mustExclude"].([]interface{}) {
-            excluded[exc.(string)] = true
+"""
+    trace_code += """        trace, err := readTrace(dec)
+        if err != nil {
+            return err
         }
+"""
+    trace_code += generate_trace_filter(semantic, time_range, attribute_key)
+    trace_code += """        return nil
+"""
+    # Il corpo della callback sta dentro "if err == nil {": un livello di indentazione in più
+    code += "".join("    " + line if line.strip() else line for line in trace_code.splitlines(True))
+    code += """        })
     }
-
-    var startTime, endTime time.Time
-    if trange, ok := logRules["allowedTimeRange"].(map[string]interface{}); ok {
-        startTime, _ = time.Parse(time.RFC3339, trange["startDate"].(string))
-        endTime, _ = time.Parse(time.RFC3339, trange["endDate"].(string))
+    if err == nil {
+        err = enc.EncodeToken(logStart.End())
     }
-
-    excludedAttrs := map[string]bool{}
-    if excl, ok := logRules["attributeExclusionRules"].(map[string]interface{}); ok {
-        if list, ok := excl["excludedAttributes"].(map[string]interface{}); ok {
-            if key, ok := list["attributeKey"].(string); ok {
-                excludedAttrs[key] = true
-            }
+    if err == nil {
+        err = enc.Flush()
+    }
+    if err == nil {
+        err = bw.Flush()
+    }
+    if err != nil {
+        if !out.started && errors.Is(err, errTraceEncode) {
+            http.Error(w, "Failed to serialize filtered log", http.StatusInternalServerError)
+            return
+        } else if !out.started {
+            http.Error(w, "Invalid XES format", http.StatusInternalServerError)
+            return
         }
+        // La risposta è già partita: la connessione viene chiusa senza completarla
+        fmt.Println("Errore nello streaming del log:", err)
+        panic(http.ErrAbortHandler)
     }
 
-    filteredTraces := []Trace{}
-    for _, trace := range logData.Traces {
-        traceHasRequired := len(required) == 0
+    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "access log", true, req.Location)
+}"""
+    return code
+
+
+# Corpo del filtro dal vivo per una traccia, con i soli filtri presenti nella policy;
+# le tracce tenute vengono scritte subito nella risposta
+def generate_trace_filter(semantic, time_range, attribute_key):
+    if not (semantic or time_range or attribute_key):
+        return """
+        if err := enc.EncodeElement(trace, traceStart); err != nil {
+            return fmt.Errorf("%w: %v", errTraceEncode, err)
+        }
+"""
+    code = "\n"
+    if semantic:
+        code += """        traceHasRequired := len(filters.required) == 0
         traceHasExcluded := false
-        newEvents := []Event{}
+"""
+    code += """        newEvents := []Event{}
         for _, event := range trace.Events {
-            newStrs := []AttributeString{}
-            newDates := []AttributeDate{}
-            includeEvent := true
-            conceptName := ""
-
-            for _, s := range event.Strings {
-                if s.Key == "concept:name" {
-                    conceptName = s.Value
-                    if required[s.Value] {
+"""
+    if attribute_key:
+        code += """            newStrs := []AttributeString{}
+"""
+    if semantic or attribute_key:
+        code += """            for _, s := range event.Strings {
+"""
+        if semantic:
+            code += """                if s.Key == "concept:name" {
+                    if filters.required[s.Value] {
                         traceHasRequired = true
                     }
-                    if excluded[s.Value] {
+                    if filters.excluded[s.Value] {
                         traceHasExcluded = true
                     }
                 }
-                if !excludedAttrs[s.Key] {
+"""
+        if attribute_key:
+            code += """                if !filters.excludedAttrs[s.Key] {
                     newStrs = append(newStrs, s)
                 }
-            }
-
+"""
+        code += """            }
+"""
+    if attribute_key:
+        code += """            event.Strings = newStrs
+"""
+    if time_range:
+        code += """
+            includeEvent := true
             for _, d := range event.Dates {
                 if d.Key == "time:timestamp" {
-                    if !startTime.IsZero() && d.Value.Before(startTime) {
+                    if !filters.startTime.IsZero() && d.Value.Before(filters.startTime) {
                         includeEvent = false
                     }
-                    if !endTime.IsZero() && d.Value.After(endTime) {
+                    if !filters.endTime.IsZero() && d.Value.After(filters.endTime) {
                         includeEvent = false
                     }
                 }
-                newDates = append(newDates, d)
             }
-
             if includeEvent {
-                newEvents = append(newEvents, Event{Strings: newStrs, Dates: newDates})
+                newEvents = append(newEvents, event)
             }
-        }
+"""
+    else:
+        code += """            newEvents = append(newEvents, event)
+"""
+    code += """        }
 
-        if traceHasRequired && !traceHasExcluded {
-            filteredTraces = append(filteredTraces, Trace{Events: newEvents})
+"""
+    if semantic:
+        code += """        if traceHasRequired && !traceHasExcluded {
+            if err := enc.EncodeElement(Trace{Events: newEvents}, traceStart); err != nil {
+                return fmt.Errorf("%w: %v", errTraceEncode, err)
+            }
         }
-    }
+"""
+    else:
+        code += """        if err := enc.EncodeElement(Trace{Events: newEvents}, traceStart); err != nil {
+            return fmt.Errorf("%w: %v", errTraceEncode, err)
+        }
+"""
+    return code
 
-    output, err := xml.MarshalIndent(XES{Traces: filteredTraces}, "", "  ")
-    if err != nil {
-        http.Error(w, "Failed to serialize filtered log", http.StatusInternalServerError)
+
+# Verifica di maxAccessCount e incremento del contatore name in un'unica operazione;
+# senza limite nella struttura della policy il contatore viene solo incrementato
+def generate_counter_increment(name, checks, limit_msg):
+    if checks is None:
+        return f"""    if err := incrementCounter(dataPath, "{name}", nil); err != nil {{
+        http.Error(w, "Failed to update access count", http.StatusInternalServerError)
         return
-    }
-    
-    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "access log", "true", req.Location)
-    w.Header().Set("Content-Type", "application/xml")
-    w.Write(output)
-}"""
+    }}
+"""
+    return f"""    if err := incrementCounter(dataPath, "{name}", &policy.checks.{checks}); errors.Is(err, errCounterLimit) {{
+        http.Error(w, "{limit_msg}", http.StatusForbidden)
+        return
+    }} else if err != nil {{
+        http.Error(w, "Failed to update access count", http.StatusInternalServerError)
+        return
+    }}
+"""
 
 
-def generate_process_handler():
-    return """func handleProcess(w http.ResponseWriter, r *http.Request) {
+def generate_process_handler(features):
+    semantic = "semanticLogConstraints" in features["log"]
+
+    code = """func handleProcess(w http.ResponseWriter, r *http.Request) {
     if r.Method != "POST" {
         http.Error(w, "Invalid method", http.StatusMethodNotAllowed)
         return
@@ -278,64 +460,18 @@ def generate_process_handler():
     }
 
     base := filepath.Join("generated_tas", req.TaHash)
-    configPath := filepath.Join(base, "configs", req.ConfigID, "policy_config.json")
     dataPath := filepath.Join(base, "data", req.ConfigID)
     algorithmPath := filepath.Join(base, "algorithms", req.Algorithm + ".go")
 
-    policyBytes, err := os.ReadFile(configPath)
+    policy, err := loadPolicy(base, req.ConfigID)
     if err != nil {
-        http.Error(w, "Policy not found", http.StatusNotFound)
-        return
-    }
-
-    var policy map[string]interface{}
-    if err := json.Unmarshal(policyBytes, &policy); err != nil {
-        http.Error(w, "Failed to parse policy", http.StatusInternalServerError)
-        return
-    }
-
-    pol := policy["policies"].([]interface{})[0].(map[string]interface{})
-    procRules := pol["processingRules"].(map[string]interface{})
-    logRules := pol["logUsageRules"].(map[string]interface{})
-
-    // Verifica accessControlRules
-    authorized := false
-    for _, u := range procRules["accessControlRules"].([]interface{}) {
-        if u.(string) == req.User {
-            authorized = true
-            break
-        }
-    }
-    if !authorized {
-        http.Error(w, "User not authorized for processing", http.StatusForbidden)
+        policyError(w, err)
         return
     }
 
-    // Verifica location
-    if locs, ok := procRules["allowedLocations"]; ok {
-        allowed := false
-        for _, loc := range locs.([]interface{}) {
-            if loc.(string) == req.Location {
-                allowed = true
-                break
-            }
-        }
-        if !allowed {
-            http.Error(w, "Location not authorized", http.StatusForbidden)
-            return
-        }
-    }
-
-    // Verifica algoritmo consentito
-    algoAllowed := false
-    for _, tech := range procRules["allowedTechniques"].([]interface{}) {
-        if tech.(map[string]interface{})["algorithm"].(string) == req.Algorithm {
-            algoAllowed = true
-            break
-        }
-    }
-    if !algoAllowed {
-        http.Error(w, "Algorithm not allowed", http.StatusForbidden)
+    // Verifica accessControlRules, location e algoritmo consentito
+    if status, msg := checkProcessing(policy, &req); status != 0 {
+        http.Error(w, msg, status)
         return
     }
 
@@ -344,92 +480,87 @@ def generate_process_handler():
         http.Error(w, "Algorithm file missing", http.StatusInternalServerError)
         return
     }
-
+"""
+    if "logExpiration" in features["log"]:
+        code += """
     // Log expiration
-    if expRaw, ok := logRules["logExpiration"]; ok {
-        expiration, err := time.Parse(time.RFC3339, expRaw.(string))
-        if err == nil && time.Now().After(expiration) {
-            http.Error(w, "Log expired", http.StatusForbidden)
-            return
-        }
+    if c := &policy.checks.log; c.hasExpiry && time.Now().After(c.expires) {
+        http.Error(w, "Log expired", http.StatusForbidden)
+        return
     }
-
+"""
+    code += """
     // Max access count
-    accessCountFile := filepath.Join(dataPath, "process_access_count.txt")
-    accessCount := 0
-    if bytes, err := os.ReadFile(accessCountFile); err == nil {
-        fmt.Sscanf(string(bytes), "%d", &accessCount)
-    }
-    if maxCountRaw, ok := procRules["maxAccessCount"]; ok {
-        maxCount := int(maxCountRaw.(float64))
-        if accessCount >= maxCount {
-            http.Error(w, "Max processing count exceeded", http.StatusForbidden)
-            return
-        }
+""" + generate_counter_increment("process_access_count.txt", "processing", "Max processing count exceeded") + """
+    // Apply semantic filters
+    filters := policy.filters
+
+    // Il numero di tracce selezionate è nella vista materializzata al setup, oppure si
+    // ottiene dalle bitmap dell'indice attività -> tracce, senza leggere il log
+    logHash := configLogHash(base, req.ConfigID)
+    if view, err := loadPolicyView(dataPath, logHash, filters.viewKey); err == nil {
+        logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "processing", true, req.Location)
+        fmt.Fprintf(w, "Processing with algorithm=%s on %d filtered traces\\n", req.Algorithm, view.Traces)
+        return
     }
-    accessCount += 1
-    os.WriteFile(accessCountFile, []byte(fmt.Sprintf("%d", accessCount)), 0644)
-
-    // Caricamento e filtraggio log.xes
-    xesPath := filepath.Join(dataPath, "log.xes")
-    xesContent, err := os.ReadFile(xesPath)
-    if err != nil {
-        http.Error(w, "Log file not found", http.StatusNotFound)
+    if index, err := loadActivityIndex(dataPath, logHash); err == nil {
+        count := 0
+        for _, word := range index.selectTraces(filters.required, filters.excluded) {
+            count += bits.OnesCount64(word)
+        }
+        logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "processing", true, req.Location)
+        fmt.Fprintf(w, "Processing with algorithm=%s on %d filtered traces\\n", req.Algorithm, count)
         return
     }
 
-    var logData XES
-    if err := xml.Unmarshal(xesContent, &logData); err != nil {
+    // Log decodificato, condiviso tra le richieste (in sola lettura)
+    logData, err := loadParsedLog(dataPath, logHash)
+    if errors.Is(err, errXesFormat) {
         http.Error(w, "Invalid XES format", http.StatusInternalServerError)
         return
+    } else if err != nil {
+        http.Error(w, "Log file not found", http.StatusNotFound)
+        return
     }
-
-    // Apply semantic filters
-    required := map[string]bool{}
-    excluded := map[string]bool{}
-    if sem, ok := logRules["semanticLogConstraints"].(map[string]interface{}); ok {
-        for _, inc := range sem["mustInclude"].([]interface{}) {
-            required[inc.(string)] = true
-        }
-        for _, exc := range sem["mustExclude"].([]interface{}) {
-            excluded[exc.(string)] = true
-        }
-    }
-
+"""
+    if semantic:
+        code += """
     filteredTraces := []Trace{}
     for _, trace := range logData.Traces {
-        traceHasRequired := len(required) == 0
+        traceHasRequired := len(filters.required) == 0
         traceHasExcluded := false
-        newEvents := []Event{}
         for _, event := range trace.Events {
-            keep := true
             for _, s := range event.Strings {
                 if s.Key == "concept:name" {
-                    if required[s.Value] {
+                    if filters.required[s.Value] {
                         traceHasRequired = true
                     }
-                    if excluded[s.Value] {
+                    if filters.excluded[s.Value] {
                         traceHasExcluded = true
                     }
                 }
             }
-            if keep {
-                newEvents = append(newEvents, event)
-            }
         }
         if traceHasRequired && !traceHasExcluded {
-            filteredTraces = append(filteredTraces, Trace{Events: newEvents})
+            filteredTraces = append(filteredTraces, trace)
         }
     }
-    
-    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "processing", "true", req.Location)
+"""
+    else:
+        code += """
+    // Nessun vincolo semantico nella policy: tutte le tracce
+    filteredTraces := logData.Traces
+"""
+    code += """
+    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "processing", true, req.Location)
     fmt.Fprintf(w, "Processing with algorithm=%s on %d filtered traces\\n", req.Algorithm, len(filteredTraces))
 }"""
+    return code
 
 
 
-def generate_get_output_handler():
-    return """func handleGetOutput(w http.ResponseWriter, r *http.Request) {
+def generate_get_output_handler(features):
+    code = """func handleGetOutput(w http.ResponseWriter, r *http.Request) {
     if r.Method != "POST" {
         http.Error(w, "Invalid method", http.StatusMethodNotAllowed)
         return
@@ -442,77 +573,24 @@ def generate_get_output_handler():
     }
 
     base := filepath.Join("generated_tas", req.TaHash)
-    configPath := filepath.Join(base, "configs", req.ConfigID, "policy_config.json")
-    outputPath := filepath.Join(base, "data", req.ConfigID, "output.txt")
+    dataPath := filepath.Join(base, "data", req.ConfigID)
+    outputPath := filepath.Join(dataPath, "output.txt")
 
-    policyBytes, err := os.ReadFile(configPath)
+    policy, err := loadPolicy(base, req.ConfigID)
     if err != nil {
-        http.Error(w, "Policy not found", http.StatusNotFound)
-        return
-    }
-
-    var policy map[string]interface{}
-    if err := json.Unmarshal(policyBytes, &policy); err != nil {
-        http.Error(w, "Failed to parse policy", http.StatusInternalServerError)
+        policyError(w, err)
         return
     }
 
-    pol := policy["policies"].([]interface{})[0].(map[string]interface{})
-    outputRules := pol["outputRules"].(map[string]interface{})
-
-    // Verifica accessControlRules
-    authorized := false
-    for _, u := range outputRules["accessControlRules"].([]interface{}) {
-        if u.(string) == req.User {
-            authorized = true
-            break
-        }
-    }
-    if !authorized {
-        http.Error(w, "User not authorized for output access", http.StatusForbidden)
+    // Verifica accessControlRules, allowedLocations e outputExpiration
+    if status, msg := checkOutput(policy, &req); status != 0 {
+        http.Error(w, msg, status)
         return
     }
 
-    // Verifica allowedLocations
-    if locs, ok := outputRules["allowedLocations"]; ok {
-        allowed := false
-        for _, loc := range locs.([]interface{}) {
-            if loc.(string) == req.Location {
-                allowed = true
-                break
-            }
-        }
-        if !allowed {
-            http.Error(w, "Location not authorized", http.StatusForbidden)
-            return
-        }
-    }
-
-    // Verifica outputExpiration
-    if expRaw, ok := outputRules["outputExpiration"]; ok {
-        expiration, err := time.Parse(time.RFC3339, expRaw.(string))
-        if err == nil && time.Now().After(expiration) {
-            http.Error(w, "Output expired", http.StatusForbidden)
-            return
-        }
-    }
-
     // Output max access
-    outputCountFile := filepath.Join(base, "data", req.ConfigID, "output_access_count.txt")
-    outputCount := 0
-    if bytes, err := os.ReadFile(outputCountFile); err == nil {
-        fmt.Sscanf(string(bytes), "%d", &outputCount)
-    }
-    if maxRaw, ok := outputRules["maxAccessCount"]; ok {
-        maxAllowed := int(maxRaw.(float64))
-        if outputCount >= maxAllowed {
-            http.Error(w, "Max output access count exceeded", http.StatusForbidden)
-            return
-        }
-    }
-    outputCount += 1
-    os.WriteFile(outputCountFile, []byte(fmt.Sprintf("%d", outputCount)), 0644)
-
+""" + generate_counter_increment("output_access_count.txt", "output" if "maxAccessCount" in features["output"] else None,
+                                 "Max output access count exceeded") + """
     // Restituzione output
     outputData, err := os.ReadFile(outputPath)
     if err != nil {
@@ -520,10 +598,11 @@ def generate_get_output_handler():
         return
     }
 
-    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "access output", "true", req.Location)
+    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "access output", true, req.Location)
     w.Header().Set("Content-Type", "text/plain")
     w.Write(outputData)
 }"""
+    return code
 
 
 
@@ -537,51 +616,1314 @@ def generate_policy_handler():
         return
     }
 
-    policyPath := filepath.Join("generated_tas", taHash, "configs", configID, "policy_config.json")
-
-    policyBytes, err := os.ReadFile(policyPath)
-    if err != nil {
+    // Anche qui la policy arriva dalla cache (byte originali del file)
+    policy, err := loadPolicy(filepath.Join("generated_tas", taHash), configID)
+    if err != nil && !errors.Is(err, errPolicyParse) {
         http.Error(w, "Policy not found", http.StatusNotFound)
         return
     }
+    policyBytes := policy.raw
 
-    logAudit(filepath.Join(base, "configs", req.ConfigID), req.User, "get policy", "true", req.Location)
+    logAudit(filepath.Join("generated_tas", taHash, "configs", configID), r.URL.Query().Get("user"), "get policy", true, r.URL.Query().Get("location"))
     w.Header().Set("Content-Type", "application/json")
     w.Write(policyBytes)
 }"""
 
-def generate_audit_logger():
-    return """func logAudit(basePath, user, operation string, allowed bool, location string) {
-    logPath := filepath.Join(basePath, "audit.txt")
-    now := time.Now()
-    line := fmt.Sprintf("%s, %s, %t, %s, %s, %s\\n",
-        user,
-        operation,
-        allowed,
-        now.Format("15:04"),
-        now.Format("02/01/2006"),
-        location,
-    )
-    f, err := os.OpenFile(logPath, os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
+def generate_log_reader():
+    return """// Il log della configurazione è data/<id>/log.xes oppure il file caricato dal data owner
+// (eventualmente .xes.gz). Se è gzip viene decompresso al volo: il decoder XML legge in
+// streaming senza mai avere l'intero file in memoria.
+type xesLogReader struct {
+    io.Reader
+    file *os.File
+    zr   *gzip.Reader
+}
+
+func (r *xesLogReader) Close() error {
+    if r.zr != nil {
+        r.zr.Close()
+    }
+    return r.file.Close()
+}
+
+func xesLogPath(dataPath string) (string, error) {
+    xesPath := filepath.Join(dataPath, "log.xes")
+    if _, err := os.Stat(xesPath); err != nil {
+        matches, _ := filepath.Glob(filepath.Join(dataPath, "*.xes*"))
+        if len(matches) == 0 {
+            return "", err
+        }
+        xesPath = matches[0]
+    }
+    return xesPath, nil
+}
+
+func openXesLog(dataPath string) (io.ReadCloser, error) {
+    xesPath, err := xesLogPath(dataPath)
     if err != nil {
-        fmt.Println("Errore scrittura audit:", err)
+        return nil, err
+    }
+
+    f, err := os.Open(xesPath)
+    if err != nil {
+        return nil, err
+    }
+    br := bufio.NewReaderSize(f, 256*1024)
+    if magic, _ := br.Peek(2); len(magic) == 2 && magic[0] == 0x1f && magic[1] == 0x8b {
+        zr, err := gzip.NewReader(br)
+        if err != nil {
+            f.Close()
+            return nil, err
+        }
+        return &xesLogReader{Reader: zr, file: f, zr: zr}, nil
+    }
+    return &xesLogReader{Reader: br, file: f}, nil
+}
+
+// opaqueETag deriva l'ETag dall'hash del log senza esporlo: lo SHA-256 del log vale come
+// riferimento al log in /setup e non deve arrivare a chi ha accesso alla sola vista
+func opaqueETag(logHash, variant string) string {
+    sum := sha256.Sum256([]byte(logHash + "\\x00" + variant))
+    return `"` + hex.EncodeToString(sum[:]) + `"`
+}
+
+// serveLogFile invia il log memorizzato così com'è con http.ServeContent (Range, ETag e
+// sendfile). Un log gzip va compresso ai client che accettano gzip, agli altri
+// decompresso al volo (senza Range).
+func serveLogFile(w http.ResponseWriter, r *http.Request, f *os.File, info os.FileInfo, logHash string) {
+    var magic [2]byte
+    n, _ := f.ReadAt(magic[:], 0)
+    gzipped := n == 2 && magic[0] == 0x1f && magic[1] == 0x8b
+    w.Header().Set("Content-Type", "application/xml")
+    if !gzipped {
+        if logHash != "" {
+            w.Header().Set("ETag", opaqueETag(logHash, "log"))
+        }
+        http.ServeContent(w, r, "", info.ModTime(), f)
         return
     }
-    defer f.Close()
-    f.WriteString(line)
+
+    w.Header().Add("Vary", "Accept-Encoding")
+    if strings.Contains(r.Header.Get("Accept-Encoding"), "gzip") {
+        if logHash != "" {
+            w.Header().Set("ETag", opaqueETag(logHash, "log-gzip"))
+        }
+        w.Header().Set("Content-Encoding", "gzip")
+        http.ServeContent(w, r, "", info.ModTime(), f)
+        return
+    }
+    zr, err := gzip.NewReader(f)
+    if err != nil {
+        http.Error(w, "Invalid XES format", http.StatusInternalServerError)
+        return
+    }
+    defer zr.Close()
+    io.Copy(w, zr)
+}
+"""
+
+def generate_log_cache():
+    return """// Cache dei log decodificati, condivisa tra le richieste e indicizzata dallo SHA-256 del
+// log (configLogHash): configurazioni con lo stesso log condividono un'unica copia. Le
+// voci escono in ordine LRU quando la dimensione stimata supera logCacheBudget
+// (-log-cache-mb, da tarare sull'heapSize dell'enclave). Più richieste che mancano la
+// stessa voce attendono un unico parsing. I log in cache sono in sola lettura.
+var logCacheBudget int64 = 128 << 20
+
+var errXesFormat = errors.New("formato XES non valido")
+
+type parsedLog struct {
+    XES
+    size int64
+}
+
+type logCacheEntry struct {
+    hash string
+    info os.FileInfo // file da cui è stato letto: se cambia la voce non vale più
+    log  *parsedLog
+}
+
+type logLoad struct {
+    done chan struct{}
+    log  *parsedLog
+    err  error
+}
+
+var (
+    logCacheMu   sync.Mutex
+    logCacheLRU  = list.New() // fronte: usata più di recente
+    logCacheMap  = map[string]*list.Element{}
+    logCacheSize int64
+    logLoads     = map[string]*logLoad{}
+)
+
+// loadParsedLog restituisce il log della configurazione, dalla cache se presente; senza
+// logHash viene decodificato senza passare dalla cache
+func loadParsedLog(dataPath, logHash string) (*parsedLog, error) {
+    xesPath, err := xesLogPath(dataPath)
+    if err != nil {
+        return nil, err
+    }
+    if logHash == "" {
+        return parseXesLog(dataPath)
+    }
+    info, err := os.Stat(xesPath)
+    if err != nil {
+        return nil, err
+    }
+
+    logCacheMu.Lock()
+    if el, ok := logCacheMap[logHash]; ok {
+        entry := el.Value.(*logCacheEntry)
+        if os.SameFile(entry.info, info) && entry.info.ModTime().Equal(info.ModTime()) && entry.info.Size() == info.Size() {
+            logCacheLRU.MoveToFront(el)
+            logCacheMu.Unlock()
+            return entry.log, nil
+        }
+    }
+    if load, ok := logLoads[logHash]; ok {
+        logCacheMu.Unlock()
+        <-load.done
+        return load.log, load.err
+    }
+    load := &logLoad{done: make(chan struct{})}
+    logLoads[logHash] = load
+    logCacheMu.Unlock()
+
+    load.log, load.err = parseXesLog(dataPath)
+
+    logCacheMu.Lock()
+    delete(logLoads, logHash)
+    if load.err == nil {
+        storeParsedLog(&logCacheEntry{hash: logHash, info: info, log: load.log})
+    }
+    logCacheMu.Unlock()
+    close(load.done)
+    return load.log, load.err
+}
+
+// Va chiamata con logCacheMu preso
+func storeParsedLog(entry *logCacheEntry) {
+    if el, ok := logCacheMap[entry.hash]; ok {
+        logCacheSize -= el.Value.(*logCacheEntry).log.size
+        logCacheLRU.Remove(el)
+        delete(logCacheMap, entry.hash)
+    }
+    if entry.log.size > logCacheBudget {
+        // Più grande dell'intera cache: serve solo alle richieste in attesa
+        return
+    }
+    for logCacheSize+entry.log.size > logCacheBudget {
+        oldest := logCacheLRU.Back()
+        old := oldest.Value.(*logCacheEntry)
+        logCacheLRU.Remove(oldest)
+        delete(logCacheMap, old.hash)
+        logCacheSize -= old.log.size
+    }
+    logCacheMap[entry.hash] = logCacheLRU.PushFront(entry)
+    logCacheSize += entry.log.size
+}
+
+func parseXesLog(dataPath string) (*parsedLog, error) {
+    xesReader, err := openXesLog(dataPath)
+    if err != nil {
+        return nil, err
+    }
+    defer xesReader.Close()
+
+    log := &parsedLog{}
+    if err := xml.NewDecoder(xesReader).Decode(&log.XES); err != nil {
+        return nil, fmt.Errorf("%w: %v", errXesFormat, err)
+    }
+    // Stima della memoria: intestazioni di slice e stringhe più il loro contenuto
+    log.size = int64(24 * cap(log.Traces))
+    for _, trace := range log.Traces {
+        log.size += int64(48 * cap(trace.Events))
+        for _, event := range trace.Events {
+            log.size += int64(32*cap(event.Strings) + 40*cap(event.Dates))
+            for _, s := range event.Strings {
+                log.size += int64(len(s.Key) + len(s.Value))
+            }
+            for _, d := range event.Dates {
+                log.size += int64(len(d.Key))
+            }
+        }
+    }
+    return log, nil
+}
+"""
+
+
+def generate_activity_index():
+    return """// Indice attività -> tracce generato dalla piattaforma all'ingestione
+// (data/<id>/artifacts/activity_bitmaps.bin): per ogni concept:name una bitmap con un bit
+// per traccia, così mustInclude/mustExclude diventano OR/ANDNOT su parole da 64 bit.
+type activityIndex struct {
+    numTraces int
+    words     int
+    names     map[string]int
+    bitmaps   []uint64
+}
+
+// SHA-256 del log della configurazione, dalla dedup_key (owner:structhash:loghash) in mapping.json
+func configLogHash(base, configID string) string {
+    raw, err := os.ReadFile(filepath.Join(base, "mapping.json"))
+    if err != nil {
+        return ""
+    }
+    var mapping map[string]struct {
+        DedupKey string `json:"dedup_key"`
+    }
+    if err := json.Unmarshal(raw, &mapping); err != nil {
+        return ""
+    }
+    key := mapping[configID].DedupKey
+    return key[strings.LastIndex(key, ":")+1:]
+}
+
+func loadActivityIndex(dataPath, logHash string) (*activityIndex, error) {
+    data, err := os.ReadFile(filepath.Join(dataPath, "artifacts", "activity_bitmaps.bin"))
+    if err != nil {
+        return nil, err
+    }
+    le := binary.LittleEndian
+    size := uint64(len(data))
+    if size < 104 || string(data[:8]) != "PMBITMAP" || le.Uint32(data[8:]) != 1 || le.Uint64(data[96:]) != size {
+        return nil, fmt.Errorf("indice delle attività non valido")
+    }
+    if logHash == "" || hex.EncodeToString(data[40:72]) != logHash {
+        return nil, fmt.Errorf("indice delle attività non corrispondente al log")
+    }
+    n, traces, words := le.Uint64(data[16:]), le.Uint64(data[24:]), le.Uint64(data[32:])
+    offNames, offData, offBitmaps := le.Uint64(data[72:]), le.Uint64(data[80:]), le.Uint64(data[88:])
+    if words != (traces+63)/64 || n > size/8 || offNames > size || 8*(n+1) > size-offNames || offData > size ||
+        offBitmaps > size || (words > 0 && n > (size-offBitmaps)/(8*words)) {
+        return nil, fmt.Errorf("indice delle attività corrotto")
+    }
+
+    index := &activityIndex{
+        numTraces: int(traces),
+        words:     int(words),
+        names:     make(map[string]int, n),
+        bitmaps:   make([]uint64, n*words),
+    }
+    for i := uint64(0); i < n; i++ {
+        start, end := le.Uint64(data[offNames+8*i:]), le.Uint64(data[offNames+8*(i+1):])
+        if start > end || end > size-offData {
+            return nil, fmt.Errorf("indice delle attività corrotto")
+        }
+        index.names[string(data[offData+start:offData+end])] = int(i)
+    }
+    for k := range index.bitmaps {
+        index.bitmaps[k] = le.Uint64(data[offBitmaps+8*uint64(k):])
+    }
+    return index, nil
+}
+
+// Stessa semantica del filtro traccia per traccia: con mustInclude vuoto tutte le tracce
+// sono ammesse, altrimenti serve almeno un'attività richiesta; poi si tolgono le tracce
+// con almeno un'attività esclusa
+func (x *activityIndex) selectTraces(required, excluded map[string]bool) []uint64 {
+    selected := make([]uint64, x.words)
+    if len(required) == 0 {
+        for w := range selected {
+            selected[w] = ^uint64(0)
+        }
+        if rem := x.numTraces % 64; rem != 0 {
+            selected[x.words-1] = (uint64(1) << uint(rem)) - 1
+        }
+    }
+    for a := range required {
+        if i, ok := x.names[a]; ok {
+            for w := range selected {
+                selected[w] |= x.bitmaps[i*x.words+w]
+            }
+        }
+    }
+    for a := range excluded {
+        if i, ok := x.names[a]; ok {
+            for w := range selected {
+                selected[w] &^= x.bitmaps[i*x.words+w]
+            }
+        }
+    }
+    return selected
+}
+
+// Tracce fuori dall'indice (o senza indice) vanno comunque valutate
+func traceSelected(selected []uint64, t int) bool {
+    return selected == nil || t/64 >= len(selected) || selected[t/64]&(uint64(1)<<uint(t%64)) != 0
+}
+
+// readTrace legge una <trace> token per token (dopo lo start element), tenendo degli
+// eventi solo gli attributi string e date: lo stesso risultato di DecodeElement su Trace
+func readTrace(dec *xml.Decoder) (Trace, error) {
+    var trace Trace
+    for {
+        tok, err := dec.Token()
+        if err != nil {
+            return trace, err
+        }
+        switch el := tok.(type) {
+        case xml.StartElement:
+            if el.Name.Local != "event" {
+                if err := dec.Skip(); err != nil {
+                    return trace, err
+                }
+                continue
+            }
+            event, err := readEvent(dec)
+            if err != nil {
+                return trace, err
+            }
+            trace.Events = append(trace.Events, event)
+        case xml.EndElement:
+            return trace, nil
+        }
+    }
+}
+
+func readEvent(dec *xml.Decoder) (Event, error) {
+    var event Event
+    for {
+        tok, err := dec.Token()
+        if err != nil {
+            return event, err
+        }
+        switch el := tok.(type) {
+        case xml.StartElement:
+            switch el.Name.Local {
+            case "string":
+                var s AttributeString
+                for _, a := range el.Attr {
+                    switch a.Name.Local {
+                    case "key":
+                        s.Key = a.Value
+                    case "value":
+                        s.Value = a.Value
+                    }
+                }
+                event.Strings = append(event.Strings, s)
+            case "date":
+                var d AttributeDate
+                for _, a := range el.Attr {
+                    switch a.Name.Local {
+                    case "key":
+                        d.Key = a.Value
+                    case "value":
+                        if err := d.Value.UnmarshalText([]byte(a.Value)); err != nil {
+                            return event, err
+                        }
+                    }
+                }
+                event.Dates = append(event.Dates, d)
+            }
+            if err := dec.Skip(); err != nil {
+                return event, err
+            }
+        case xml.EndElement:
+            return event, nil
+        }
+    }
+}
+
+var errTraceEncode = errors.New("serializzazione della traccia non riuscita")
+
+// responseStream ricorda se qualcosa è già stato inviato al client
+type responseStream struct {
+    w       http.ResponseWriter
+    started bool
+}
+
+func (s *responseStream) Write(p []byte) (int, error) {
+    s.started = true
+    return s.w.Write(p)
+}
+
+// forEachTrace legge il log in streaming e passa ogni <trace> figlia di <log> con il suo
+// indice: fn la legge (readTrace) oppure la salta con dec.Skip
+func forEachTrace(r io.Reader, fn func(t int, dec *xml.Decoder, start *xml.StartElement) error) error {
+    dec := xml.NewDecoder(r)
+    depth, t := 0, 0
+    for {
+        tok, err := dec.Token()
+        if err == io.EOF && depth > 0 {
+            return io.ErrUnexpectedEOF
+        }
+        if err != nil {
+            return err
+        }
+        switch el := tok.(type) {
+        case xml.StartElement:
+            if depth == 0 && el.Name.Local != "log" {
+                return fmt.Errorf("expected element type <log> but have <%s>", el.Name.Local)
+            }
+            if depth == 1 {
+                if el.Name.Local == "trace" {
+                    if err := fn(t, dec, &el); err != nil {
+                        return err
+                    }
+                    t++
+                } else if err := dec.Skip(); err != nil {
+                    return err
+                }
+                continue
+            }
+            depth++
+        case xml.EndElement:
+            depth--
+            if depth == 0 {
+                return nil
+            }
+        }
+    }
+}
+"""
+
+def generate_policy_view():
+    return """// Vista della policy materializzata dalla piattaforma al setup
+// (data/<id>/views/<hash regole>/): access_log.xml è la risposta di /access_log già
+// filtrata, view.json riporta il log e le regole da cui è stata calcolata. Se la policy
+// cambia l'hash delle regole non corrisponde più e si torna al filtro dal vivo.
+type policyView struct {
+    Version      int    `json:"version"`
+    SourceSHA256 string `json:"source_sha256"`
+    RulesSHA256  string `json:"rules_sha256"`
+    Traces       int    `json:"traces"`
+    dir          string
+}
+
+func sortedKeys(set map[string]bool) []string {
+    keys := make([]string, 0, len(set))
+    for k := range set {
+        keys = append(keys, k)
+    }
+    sort.Strings(keys)
+    return keys
+}
+
+// policyViewKey calcola l'hash canonico dei filtri (come policy_views.rules_hash)
+func policyViewKey(f *logFilters) string {
+    h := sha256.New()
+    io.WriteString(h, "promise-view-v1\\n")
+    for _, set := range []map[string]bool{f.required, f.excluded, f.excludedAttrs} {
+        fmt.Fprintf(h, "%d\\n", len(set))
+        for _, k := range sortedKeys(set) {
+            fmt.Fprintf(h, "%d:%s\\n", len(k), k)
+        }
+    }
+    for _, t := range []time.Time{f.startTime, f.endTime} {
+        s := ""
+        if !t.IsZero() {
+            s = t.Format(time.RFC3339Nano)
+        }
+        fmt.Fprintf(h, "%d:%s\\n", len(s), s)
+    }
+    return hex.EncodeToString(h.Sum(nil))
+}
+
+func loadPolicyView(dataPath, logHash, rulesHash string) (*policyView, error) {
+    if rulesHash == "" || logHash == "" {
+        return nil, fmt.Errorf("vista non applicabile")
+    }
+    dir := filepath.Join(dataPath, "views", rulesHash)
+    raw, err := os.ReadFile(filepath.Join(dir, "view.json"))
+    if err != nil {
+        return nil, err
+    }
+    var view policyView
+    if err := json.Unmarshal(raw, &view); err != nil {
+        return nil, err
+    }
+    if view.Version != 1 || view.SourceSHA256 != logHash || view.RulesSHA256 != rulesHash {
+        return nil, fmt.Errorf("vista non corrispondente al log o alla policy")
+    }
+    view.dir = dir
+    return &view, nil
+}
+"""
+
+
+def generate_policy_cache(features):
+    log_rules, output_rules = features["log"], features["output"]
+    algorithms = features["algorithms"]
+
+    code = """// Cache delle policy: policy_config.json viene decodificato una volta sola in strutture
+// tipizzate (con i filtri del log già pronti) e riletto solo quando il file cambia.
+// La piattaforma riscrive la policy con un rename atomico, quindi ogni versione è un
+// file nuovo: inode, mtime e dimensione bastano a riconoscerla senza rileggerla.
+type Policy struct {
+    LogUsageRules   LogUsageRules   `json:"logUsageRules"`
+    ProcessingRules ProcessingRules `json:"processingRules"`
+    OutputRules     OutputRules     `json:"outputRules"`
+
+    raw     []byte
+    filters *logFilters
+    checks  policyChecks
+}
+
+// Le strutture contengono solo le regole presenti nella struttura della policy di
+// questo TA (la stessa per tutte le sue configurazioni)
+type LogUsageRules struct {
+""" + "".join(LOG_RULE_FIELDS[name] for name in LOG_RULES if name in log_rules) + """}
+
+type ProcessingRules struct {
+    AccessControlRules []string `json:"accessControlRules"`
+    AllowedLocations   []string `json:"allowedLocations"`
+    MaxAccessCount     *float64 `json:"maxAccessCount"`
+    AllowedTechniques  []struct {
+        Algorithm     string `json:"algorithm"`
+        TechniqueType string `json:"techniqueType"`
+    } `json:"allowedTechniques"`
+}
+
+type OutputRules struct {
+""" + "".join(OUTPUT_RULE_FIELDS[name] for name in OUTPUT_RULES if name in output_rules) + """}
+"""
+    if "attributeExclusionRules" in log_rules:
+        code += """
+// excludedAttributes è usato solo nella forma {"attributeKey": "..."}: le altre forme
+// (ad esempio la lista scritta dall'editor) vengono ignorate come prima
+type attributeKeyRule struct {
+    AttributeKey string
+    set          bool
+}
+
+func (a *attributeKeyRule) UnmarshalJSON(data []byte) error {
+    var v interface{}
+    if err := json.Unmarshal(data, &v); err != nil {
+        return err
+    }
+    if m, ok := v.(map[string]interface{}); ok {
+        if key, ok := m["attributeKey"].(string); ok {
+            a.AttributeKey, a.set = key, true
+        }
+    }
+    return nil
+}
+"""
+    code += """
+type logFilters struct {
+    required      map[string]bool
+    excluded      map[string]bool
+    excludedAttrs map[string]bool
+    startTime     time.Time
+    endTime       time.Time
+    viewKey       string
+}
+
+func newLogFilters(rules *LogUsageRules) *logFilters {
+    f := &logFilters{required: map[string]bool{}, excluded: map[string]bool{}, excludedAttrs: map[string]bool{}}
+"""
+    if "semanticLogConstraints" in log_rules:
+        code += """    for _, inc := range rules.SemanticLogConstraints.MustInclude {
+        f.required[inc] = true
+    }
+    for _, exc := range rules.SemanticLogConstraints.MustExclude {
+        f.excluded[exc] = true
+    }
+"""
+    if "allowedTimeRange" in log_rules:
+        code += """    f.startTime, _ = time.Parse(time.RFC3339, rules.AllowedTimeRange.StartDate)
+    f.endTime, _ = time.Parse(time.RFC3339, rules.AllowedTimeRange.EndDate)
+"""
+    if features["attribute_key"]:
+        code += """    if excl := rules.AttributeExclusionRules.ExcludedAttributes; excl.set {
+        f.excludedAttrs[excl.AttributeKey] = true
+    }
+"""
+    code += """    f.viewKey = policyViewKey(f)
+    return f
+}
+
+// Allow-list e limiti di una sezione della policy, precalcolati al caricamento:
+// per richiesta restano solo lookup in mappe e confronti
+type ruleChecks struct {
+    users     map[string]bool
+    locations map[string]bool // nil: nessun vincolo sulla location
+    expires   time.Time
+    hasExpiry bool
+    maxCount  int
+    hasMax    bool
+}
+
+type policyChecks struct {
+    log, processing, output ruleChecks
+    algorithms              map[string]bool
+}
+
+func newRuleChecks(users, locations []string, expiration string, maxCount *float64) ruleChecks {
+    c := ruleChecks{users: toSet(users)}
+    if locations != nil {
+        c.locations = toSet(locations)
+    }
+    if t, err := time.Parse(time.RFC3339, expiration); err == nil {
+        c.expires, c.hasExpiry = t, true
+    }
+    if maxCount != nil {
+        c.maxCount, c.hasMax = int(*maxCount), true
+    }
+    return c
+}
+
+func newPolicyChecks(p *Policy) policyChecks {
+    proc := &p.ProcessingRules
+    c := policyChecks{
+        log:        newRuleChecks(""" + _rule_check_args("LogUsageRules", log_rules) + """),
+        processing: newRuleChecks(proc.AccessControlRules, proc.AllowedLocations, "", proc.MaxAccessCount),
+        output:     newRuleChecks(""" + _rule_check_args("OutputRules", output_rules) + """),
+        algorithms: map[string]bool{},
+    }
+""" + ("" if algorithms is not None else """    for _, tech := range proc.AllowedTechniques {
+        c.algorithms[tech.Algorithm] = true
+    }
+""") + """    return c
+}
+
+func toSet(values []string) map[string]bool {
+    set := make(map[string]bool, len(values))
+    for _, v := range values {
+        set[v] = true
+    }
+    return set
+}
+"""
+    code += generate_policy_checks(features)
+    code += """
+type cachedPolicy struct {
+    info   os.FileInfo
+    policy *Policy
+    err    error
+}
+
+var (
+    errPolicyParse = errors.New("policy non valida")
+
+    policyCacheMu sync.RWMutex
+    policyCache   = map[string]*cachedPolicy{}
+)
+
+// loadPolicy restituisce la policy della configurazione, condivisa e in sola lettura.
+// Con errPolicyParse la policy contiene comunque i byte originali (per /policy).
+func loadPolicy(base, configID string) (*Policy, error) {
+    path := filepath.Join(base, "configs", configID, "policy_config.json")
+    // Stat prima della lettura: se il file cambia nel mezzo la voce risulta già vecchia
+    info, err := os.Stat(path)
+    if err != nil {
+        return nil, err
+    }
+
+    policyCacheMu.RLock()
+    entry := policyCache[path]
+    policyCacheMu.RUnlock()
+    if entry != nil && os.SameFile(entry.info, info) && entry.info.ModTime().Equal(info.ModTime()) && entry.info.Size() == info.Size() {
+        return entry.policy, entry.err
+    }
+
+    raw, err := os.ReadFile(path)
+    if err != nil {
+        return nil, err
+    }
+    entry = &cachedPolicy{info: info, policy: parsePolicy(raw)}
+    if entry.policy.filters == nil {
+        entry.err = errPolicyParse
+    }
+
+    policyCacheMu.Lock()
+    policyCache[path] = entry
+    policyCacheMu.Unlock()
+    return entry.policy, entry.err
+}
+
+func parsePolicy(raw []byte) *Policy {
+    var doc struct {
+        Policies []Policy `json:"policies"`
+    }
+    if err := json.Unmarshal(raw, &doc); err != nil || len(doc.Policies) == 0 {
+        return &Policy{raw: raw}
+    }
+    policy := &doc.Policies[0]
+    if !matchesStructure(policy, raw) {
+        fmt.Println("[policy] struttura diversa da quella del TA, policy rifiutata")
+        return &Policy{raw: raw}
+    }
+    policy.raw = raw
+    policy.checks = newPolicyChecks(policy)
+    policy.filters = newLogFilters(&policy.LogUsageRules)
+    return policy
+}
+
+func policyError(w http.ResponseWriter, err error) {
+    if errors.Is(err, errPolicyParse) {
+        http.Error(w, "Failed to parse policy", http.StatusInternalServerError)
+        return
+    }
+    http.Error(w, "Policy not found", http.StatusNotFound)
+}
+"""
+    return code
+
+
+def _rule_check_args(section, present):
+    expiration = "LogExpiration" if section == "LogUsageRules" else "OutputExpiration"
+    args = [
+        f"p.{section}.AccessControlRules" if "accessControlRules" in present else "nil",
+        f"p.{section}.AllowedLocations" if "allowedLocations" in present else "nil",
+        f"p.{section}.{expiration}" if expiration[0].lower() + expiration[1:] in present else '""',
+        f"p.{section}.MaxAccessCount" if "maxAccessCount" in present else "nil",
+    ]
+    return ", ".join(args)
+
+
+# Controlli per richiesta: solo le regole presenti nella struttura, senza rami per le
+# altre. accessControlRules assente equivale a nessun utente autorizzato.
+def generate_policy_checks(features):
+    algorithms = features["algorithms"]
+
+    def section(name, rules, present, users_msg, expiration, expired_msg):
+        if "accessControlRules" not in present:
+            return f"""func {name}(p *Policy, req *Request) (int, string) {{
+    return http.StatusForbidden, "{users_msg}"
+}}
+"""
+        code = f"""func {name}(p *Policy, req *Request) (int, string) {{
+    c := &p.checks.{rules}
+    if !c.users[req.User] {{
+        return http.StatusForbidden, "{users_msg}"
+    }}
+"""
+        if "allowedLocations" in present:
+            code += """    if c.locations != nil && !c.locations[req.Location] {
+        return http.StatusForbidden, "Location not authorized"
+    }
+"""
+        if expiration in present:
+            code += f"""    if c.hasExpiry && time.Now().After(c.expires) {{
+        return http.StatusForbidden, "{expired_msg}"
+    }}
+"""
+        return code + """    return 0, ""
+}
+"""
+
+    code = "\n"
+    if algorithms is not None:
+        code += """// Algoritmi consentiti: fanno parte della struttura della policy, quindi sono gli
+// stessi per tutte le configurazioni di questo TA
+var allowedAlgorithms = map[string]bool{
+""" + "".join(f"    {json.dumps(name)}: true,\n" for name in algorithms) + """}
+
+"""
+    code += section("checkLogUsage", "log", features["log"], "User not authorized", "logExpiration", "Log expired")
+    code += "\n" + section("checkOutput", "output", features["output"], "User not authorized for output access",
+                           "outputExpiration", "Output expired")
+    code += """
+func checkProcessing(p *Policy, req *Request) (int, string) {
+    c := &p.checks.processing
+    if !c.users[req.User] {
+        return http.StatusForbidden, "User not authorized for processing"
+    }
+    if c.locations != nil && !c.locations[req.Location] {
+        return http.StatusForbidden, "Location not authorized"
+    }
+"""
+    if algorithms is not None:
+        code += """    if !allowedAlgorithms[req.Algorithm] {
+"""
+    else:
+        code += """    if !p.checks.algorithms[req.Algorithm] {
+"""
+    code += """        return http.StatusForbidden, "Algorithm not allowed"
+    }
+    return 0, ""
+}
+"""
+    code += generate_structure_check(features)
+    return code
+
+
+# Una configurazione con regole per cui il TA non ha codice non deve passare senza
+# controlli: viene rifiutata come policy non valida
+def generate_structure_check(features):
+    missing = {
+        "logUsageRules": [name for name in LOG_RULES if name not in features["log"]],
+        "outputRules": [name for name in OUTPUT_RULES if name not in features["output"]],
+    }
+    checks = ""
+    if missing["logUsageRules"] or missing["outputRules"]:
+        checks += """    if hasUncompiledRules(raw) {
+        return false
+    }
+"""
+    if "attributeExclusionRules" in features["log"] and not features["attribute_key"]:
+        checks += """    if p.LogUsageRules.AttributeExclusionRules.ExcludedAttributes.set {
+        return false
+    }
+"""
+    if features["algorithms"] is not None:
+        checks += """    seen := map[string]bool{}
+    for _, tech := range p.ProcessingRules.AllowedTechniques {
+        if !allowedAlgorithms[tech.Algorithm] {
+            return false
+        }
+        seen[tech.Algorithm] = true
+    }
+    if len(seen) != len(allowedAlgorithms) {
+        return false
+    }
+"""
+    code = """
+// La configurazione deve avere la struttura per cui questo TA è stato generato
+func matchesStructure(p *Policy, raw []byte) bool {
+""" + checks + """    return true
+}
+"""
+    if missing["logUsageRules"] or missing["outputRules"]:
+        code += """
+// Regole assenti dalla struttura della policy, per cui non è stato generato alcun controllo
+var uncompiledRules = map[string][]string{
+""" + "".join(
+            f"    {json.dumps(section)}: {{{', '.join(json.dumps(name) for name in names)}}},\n"
+            for section, names in missing.items() if names
+        ) + """}
+
+func hasUncompiledRules(raw []byte) bool {
+    var doc struct {
+        Policies []map[string]json.RawMessage `json:"policies"`
+    }
+    if json.Unmarshal(raw, &doc) != nil || len(doc.Policies) == 0 {
+        return true
+    }
+    for name, value := range doc.Policies[0] {
+        for section, rules := range uncompiledRules {
+            if !strings.EqualFold(name, section) {
+                continue
+            }
+            var fields map[string]json.RawMessage
+            json.Unmarshal(value, &fields)
+            for key, v := range fields {
+                for _, rule := range rules {
+                    if strings.EqualFold(key, rule) && string(v) != "null" {
+                        return true
+                    }
+                }
+            }
+        }
+    }
+    return false
+}
+"""
+    return code
+
+
+
+def generate_counters():
+    return """// Contatori degli accessi (access_count.txt, process_access_count.txt,
+// output_access_count.txt) tenuti in memoria, uno stato per configurazione con il proprio
+// lock: configurazioni diverse non si contendono nulla. Ogni incremento viene accodato a
+// data/<id>/counters.wal e la richiesta prosegue solo quando il record è su disco; le
+// richieste concorrenti sulla stessa configurazione condividono write e fsync (group
+// commit). I file .txt restano lo snapshot: vengono riscritti ogni counterSnapshotEvery
+// record o dopo counterSnapshotInterval, poi il WAL viene troncato. I record contengono
+// il valore assoluto, quindi al caricamento vale il massimo tra snapshot e WAL.
+const (
+    counterSnapshotEvery    = 1000
+    counterSnapshotInterval = 30 * time.Second
+)
+
+var errCounterLimit = errors.New("limite di accessi raggiunto")
+
+type configCounters struct {
+    once    sync.Once
+    loadErr error
+
+    mu       sync.Mutex
+    cond     *sync.Cond
+    dataPath string
+    counts   map[string]int
+    dirty    map[string]bool // contatori cambiati dall'ultimo snapshot
+    wal      *os.File
+    buf      []byte // record accodati e non ancora scritti
+    seq      uint64 // ultimo record accodato
+    durable  uint64 // ultimo record scritto e sincronizzato
+    flushing bool
+    err      error // errore di scrittura: da qui in poi gli incrementi falliscono
+
+    records    int
+    snapshotAt time.Time
+}
+
+var counterStore sync.Map // dataPath -> *configCounters
+
+func getCounters(dataPath string) (*configCounters, error) {
+    v, _ := counterStore.LoadOrStore(dataPath, &configCounters{dataPath: dataPath})
+    cc := v.(*configCounters)
+    cc.once.Do(func() { cc.loadErr = cc.load() })
+    if cc.loadErr != nil {
+        counterStore.CompareAndDelete(dataPath, cc)
+        return nil, cc.loadErr
+    }
+    return cc, nil
+}
+
+func (cc *configCounters) load() error {
+    cc.counts = map[string]int{}
+    cc.dirty = map[string]bool{}
+    for _, name := range []string{"access_count.txt", "process_access_count.txt", "output_access_count.txt"} {
+        count := 0
+        if bytes, err := os.ReadFile(filepath.Join(cc.dataPath, name)); err == nil {
+            fmt.Sscanf(string(bytes), "%d", &count)
+        }
+        cc.counts[name] = count
+    }
+
+    walPath := filepath.Join(cc.dataPath, "counters.wal")
+    valid := int64(0)
+    if f, err := os.Open(walPath); err == nil {
+        reader := bufio.NewReader(f)
+        for {
+            line, err := reader.ReadString('\\n')
+            if err != nil {
+                break
+            }
+            var name string
+            var value int
+            var sum uint32
+            if n, _ := fmt.Sscanf(line, "%s %d %x", &name, &value, &sum); n != 3 || sum != crc32.ChecksumIEEE([]byte(fmt.Sprintf("%s %d", name, value))) {
+                break
+            }
+            if value > cc.counts[name] {
+                cc.counts[name] = value
+            }
+            cc.dirty[name] = true
+            cc.records++
+            valid += int64(len(line))
+        }
+        f.Close()
+    }
+    wal, err := os.OpenFile(walPath, os.O_WRONLY|os.O_APPEND|os.O_CREATE, 0644)
+    if err != nil {
+        return err
+    }
+    // Una coda troncata (scrittura interrotta) viene scartata prima di accodare
+    if err := wal.Truncate(valid); err != nil {
+        wal.Close()
+        return err
+    }
+    cc.wal = wal
+    cc.cond = sync.NewCond(&cc.mu)
+    cc.snapshotAt = time.Now()
+    return nil
+}
+
+// incrementCounter incrementa il contatore name se è sotto il maxAccessCount di limit
+// (nil: nessun limite); errCounterLimit se il limite è già raggiunto
+func incrementCounter(dataPath, name string, limit *ruleChecks) error {
+    cc, err := getCounters(dataPath)
+    if err != nil {
+        return err
+    }
+    cc.mu.Lock()
+    defer cc.mu.Unlock()
+    if cc.err != nil {
+        return cc.err
+    }
+    if limit != nil && limit.hasMax && cc.counts[name] >= limit.maxCount {
+        return errCounterLimit
+    }
+    cc.counts[name]++
+    cc.dirty[name] = true
+    record := fmt.Sprintf("%s %d", name, cc.counts[name])
+    cc.buf = append(cc.buf, fmt.Sprintf("%s %08x\\n", record, crc32.ChecksumIEEE([]byte(record)))...)
+    cc.seq++
+    return cc.commit(cc.seq)
+}
+
+// commit attende che il record seq sia su disco: il primo in attesa scrive anche i record
+// accodati dagli altri nel frattempo, con una sola fsync. Va chiamata con cc.mu preso.
+func (cc *configCounters) commit(seq uint64) error {
+    for cc.durable < seq {
+        if cc.err != nil {
+            return cc.err
+        }
+        if cc.flushing {
+            cc.cond.Wait()
+            continue
+        }
+        cc.flushing = true
+        buf, upto := cc.buf, cc.seq
+        cc.buf = nil
+        cc.mu.Unlock()
+        _, err := cc.wal.Write(buf)
+        if err == nil {
+            err = cc.wal.Sync()
+        }
+        cc.mu.Lock()
+        if err != nil {
+            cc.err = err
+        } else {
+            cc.records += int(upto - cc.durable)
+            cc.durable = upto
+        }
+        cc.cond.Broadcast()
+
+        if err == nil && (cc.records >= counterSnapshotEvery || time.Since(cc.snapshotAt) >= counterSnapshotInterval) {
+            cc.snapshot()
+        }
+        cc.flushing = false
+        cc.cond.Broadcast()
+    }
+    return nil
+}
+
+// snapshot riscrive i file .txt cambiati e tronca il WAL. Chiamata dal flush in corso
+// (nessun altro scrive il WAL) con cc.mu preso, rilasciato durante la scrittura.
+func (cc *configCounters) snapshot() {
+    counts := map[string]int{}
+    for name := range cc.dirty {
+        counts[name] = cc.counts[name]
+    }
+    cc.mu.Unlock()
+    var err error
+    for name, count := range counts {
+        if err = writeFileSync(filepath.Join(cc.dataPath, name), []byte(fmt.Sprintf("%d", count))); err != nil {
+            break
+        }
+    }
+    if err == nil {
+        err = cc.wal.Truncate(0)
+    }
+    cc.mu.Lock()
+    if err != nil {
+        // Il WAL resta valido: si riprova al prossimo flush
+        fmt.Println("Errore snapshot contatori:", err)
+        return
+    }
+    for name, count := range counts {
+        if cc.counts[name] == count {
+            delete(cc.dirty, name)
+        }
+    }
+    cc.records = 0
+    cc.snapshotAt = time.Now()
+}
+
+// writeFileSync sostituisce path con un rename atomico dopo fsync del contenuto
+func writeFileSync(path string, data []byte) error {
+    tmp := path + ".tmp"
+    f, err := os.OpenFile(tmp, os.O_WRONLY|os.O_CREATE|os.O_TRUNC, 0644)
+    if err != nil {
+        return err
+    }
+    if _, err := f.Write(data); err != nil {
+        f.Close()
+        return err
+    }
+    if err := f.Sync(); err != nil {
+        f.Close()
+        return err
+    }
+    if err := f.Close(); err != nil {
+        return err
+    }
+    return os.Rename(tmp, path)
+}
+"""
+
+
+def generate_audit_logger():
+    return """// Le righe di audit passano da un canale per configurazione a un writer in background,
+// che tiene aperto audit.txt, scrive a blocchi e fa fsync ogni auditSyncInterval o ogni
+// auditSyncBatch righe. Con auditStrict (-audit-strict) logAudit ritorna solo quando la
+// riga è su disco. flushAuditLogs, alla chiusura, scrive tutto ciò che è in coda.
+var (
+    auditStrict       = false
+    auditSyncInterval = time.Second
+    auditSyncBatch    = 256
+)
+
+type auditEntry struct {
+    line []byte
+    done chan error // nil se nessuno attende la fsync
+}
+
+type auditWriter struct {
+    logPath string
+    entries chan auditEntry
+}
+
+var (
+    auditMu      sync.RWMutex // le scritture lo prendono in lettura, la chiusura in scrittura
+    auditClosed  bool
+    auditWriters = map[string]*auditWriter{}
+    auditWG      sync.WaitGroup
+)
+
+func logAudit(basePath, user, operation string, allowed bool, location string) {
+    logPath := filepath.Join(basePath, "audit.txt")
+    now := time.Now()
+    line := fmt.Sprintf("%s, %s, %t, %s, %s, %s\\n",
+        user,
+        operation,
+        allowed,
+        now.Format("15:04"),
+        now.Format("02/01/2006"),
+        location,
+    )
+    entry := auditEntry{line: []byte(line)}
+    if auditStrict {
+        entry.done = make(chan error, 1)
+    }
+
+    auditMu.RLock()
+    aw := auditWriters[logPath]
+    if aw == nil && !auditClosed {
+        auditMu.RUnlock()
+        startAuditWriter(logPath)
+        auditMu.RLock()
+        aw = auditWriters[logPath]
+    }
+    if auditClosed {
+        auditMu.RUnlock()
+        appendAudit(logPath, entry.line)
+        return
+    }
+    aw.entries <- entry
+    auditMu.RUnlock()
+    if entry.done != nil {
+        <-entry.done
+    }
+}
+
+func startAuditWriter(logPath string) {
+    auditMu.Lock()
+    defer auditMu.Unlock()
+    if auditWriters[logPath] != nil || auditClosed {
+        return
+    }
+    aw := &auditWriter{logPath: logPath, entries: make(chan auditEntry, auditSyncBatch)}
+    auditWriters[logPath] = aw
+    auditWG.Add(1)
+    go aw.run()
+}
+
+// flushAuditLogs chiude tutti i writer dopo averne scritto le code; le righe successive
+// vengono scritte direttamente sul file
+func flushAuditLogs() {
+    auditMu.Lock()
+    if !auditClosed {
+        auditClosed = true
+        for _, aw := range auditWriters {
+            close(aw.entries)
+        }
+    }
+    auditMu.Unlock()
+    auditWG.Wait()
+}
+
+func appendAudit(logPath string, line []byte) {
+    f, err := os.OpenFile(logPath, os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
+    if err != nil {
+        fmt.Println("Errore scrittura audit:", err)
+        return
+    }
+    defer f.Close()
+    f.Write(line)
+}
+
+func (aw *auditWriter) run() {
+    defer auditWG.Done()
+    ticker := time.NewTicker(auditSyncInterval)
+    defer ticker.Stop()
+
+    var f *os.File
+    var buf []byte
+    var waiting []chan error
+    unsynced := 0 // righe scritte dall'ultima fsync
+    defer func() {
+        if f != nil {
+            f.Close()
+        }
+    }()
+
+    // write scrive le righe in buf e fa fsync se richiesto o dopo auditSyncBatch righe
+    write := func(lines int, flush bool) {
+        var err error
+        if len(buf) > 0 {
+            if f == nil {
+                if f, err = os.OpenFile(aw.logPath, os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644); err != nil {
+                    f = nil
+                }
+            }
+            if err == nil {
+                _, err = f.Write(buf)
+            }
+            buf = buf[:0]
+            unsynced += lines
+        }
+        if err == nil && unsynced > 0 && (flush || unsynced >= auditSyncBatch) {
+            err = f.Sync()
+            unsynced = 0
+        }
+        if err != nil {
+            fmt.Println("Errore scrittura audit:", err)
+        }
+        for _, done := range waiting {
+            done <- err
+        }
+        waiting = waiting[:0]
+    }
+
+    for {
+        select {
+        case entry, ok := <-aw.entries:
+            if !ok {
+                write(0, true)
+                return
+            }
+            // Le righe già in coda vanno nello stesso blocco
+            lines, flush := 0, false
+            for ok {
+                buf = append(buf, entry.line...)
+                lines++
+                if entry.done != nil {
+                    flush = true
+                    waiting = append(waiting, entry.done)
+                }
+                if lines >= auditSyncBatch {
+                    break
+                }
+                select {
+                case entry, ok = <-aw.entries:
+                default:
+                    ok = false
+                }
+            }
+            write(lines, flush)
+        case <-ticker.C:
+            write(0, true)
+        }
+    }
 }
 """
 
 
-def generate_main_go(ta_hash):
+def generate_main_go(ta_hash, policy_json=None):
     base_dir = Path("generated_tas") / ta_hash
     main_go_path = base_dir / "main.go"
+    features = policy_features(policy_json)
 
     content = generate_main_header() + "\n\n\n"
     content += generate_audit_logger() + "\n\n\n"
-    content += generate_access_log_handler() + "\n\n\n"
-    content += generate_process_handler() + "\n\n\n"
-    content += generate_get_output_handler() + "\n\n\n"
+    content += generate_log_reader() + "\n\n\n"
+    content += generate_log_cache() + "\n\n\n"
+    content += generate_activity_index() + "\n\n\n"
+    content += generate_policy_view() + "\n\n\n"
+    content += generate_policy_cache(features) + "\n\n\n"
+    content += generate_counters() + "\n\n\n"
+    content += generate_access_log_handler(features) + "\n\n\n"
+    content += generate_process_handler(features) + "\n\n\n"
+    content += generate_get_output_handler(features) + "\n\n\n"
     content += generate_policy_handler() + "\n\n\n"
 
     main_go_path.write_text(content)
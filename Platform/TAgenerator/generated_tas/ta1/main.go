@@ -1,12 +1,16 @@
 package main
 
 import (
+	"context"
+	"errors"
 	"flag"
 	"fmt"
 	"log"
 	"net/http"
 	"os"
+	"os/signal"
 	"strconv"
+	"syscall"
 	"ta1/taPackage/config"
 	"ta1/taPackage/rpc"
 	"ta1/taPackage/test"
@@ -14,15 +18,76 @@ import (
 
 func main() {
 	teeStr := flag.String("tee", "true", "Execution mode: true or false")
+	auditStrict := flag.Bool("audit-strict", false, "Risponde solo dopo la fsync della riga di audit")
+	flag.DurationVar(&config.AuditSyncInterval, "audit-sync-interval", config.AuditSyncInterval, "Intervallo massimo tra due fsync di audit.txt")
+	flag.IntVar(&config.AuditSyncBatch, "audit-sync-batch", config.AuditSyncBatch, "Righe di audit scritte prima di una fsync")
+	logCacheMB := flag.Int64("log-cache-mb", config.LogCacheBudget>>20, "Memoria per i log decodificati in cache (MB, entro l'heapSize dell'enclave)")
+	// Default anche da env (es. "env" di enclave.json)
+	flag.IntVar(&rpc.ProcessWorkers, "process-workers", envInt("PROCESS_WORKERS", rpc.ProcessWorkers), "Worker che eseguono il mining di /process")
+	flag.IntVar(&rpc.ProcessQueueSize, "process-queue", envInt("PROCESS_QUEUE", rpc.ProcessQueueSize), "Richieste /process in attesa oltre le quali si risponde 429")
+	flag.BoolVar(&test.CLEANMEMORY, "clean-memory", false, "GC e pausa di 3s prima di ogni /process (misure di RAM)")
 	flag.Parse()
+	config.LogCacheBudget = *logCacheMB << 20
 
 	// Converte la stringa in booleano
-	parsedTEE, errFlag := strconv.ParseBool(*teeStr)\n\tif errFlag != nil {\n\t\tfmt.Println(\"Errore: il valore di --tee deve essere 'true' o 'false'\")\n\t\tos.Exit(1)\n\t}\n\ttest.TEE = parsedTEE\n\n\tfmt.Println(\"TEE mode:\", test.TEE)\n\n\terr := config.LoadMappings(\"mapping.json\")\n\tif err != nil {\n\t\tlog.Fatal(\"Errore mapping:\", err)\n\t}\n\n\thttp.HandleFunc(\"/log\", rpc.HandleLogAccess)\n\thttp.HandleFunc(\"/process\", rpc.HandleProcessing)\n\thttp.HandleFunc(\"/output\", rpc.HandleOutputAccess)\n\thttp.HandleFunc(\"/policy\", rpc.HandlePolicyInfo)\n\thttp.HandleFunc(\"/monitoring\", rpc.HandleMonitoring)\n\n\tlog.Println(\"Server in ascolto sulla porta 8080...")
-		errList := http.ListenAndServe(":8080", nil)
-		if errList != nil{
+	parsedTEE, errFlag := strconv.ParseBool(*teeStr)
+	if errFlag != nil {
+		fmt.Println("Errore: il valore di --tee deve essere 'true' o 'false'")
+		os.Exit(1)
+	}
+	test.TEE = parsedTEE
+	config.AuditStrict = *auditStrict
+	if config.AuditSyncInterval <= 0 || config.AuditSyncBatch <= 0 {
+		fmt.Println("Errore: --audit-sync-interval e --audit-sync-batch devono essere positivi")
+		os.Exit(1)
+	}
+	if rpc.ProcessWorkers <= 0 || rpc.ProcessQueueSize < 0 {
+		fmt.Println("Errore: --process-workers deve essere positivo e --process-queue non negativo")
+		os.Exit(1)
+	}
+
+	fmt.Println("TEE mode:", test.TEE)
+
+	err := config.LoadMappings("mapping.json")
+	if err != nil {
+		log.Fatal("Errore mapping:", err)
+	}
+
+	http.HandleFunc("/log", rpc.HandleLogAccess)
+	http.HandleFunc("/process", rpc.HandleProcessing)
+	http.HandleFunc("/output", rpc.HandleOutputAccess)
+	http.HandleFunc("/policy", rpc.HandlePolicyInfo)
+	http.HandleFunc("/monitoring", rpc.HandleMonitoring)
+	http.HandleFunc("/monitoring/process", rpc.HandleProcessQueue)
+
+	// Alla chiusura si attendono le richieste in corso e si scrive l'audit ancora in coda
+	server := &http.Server{Addr: ":8080"}
+	stop := make(chan os.Signal, 1)
+	closed := make(chan struct{})
+	signal.Notify(stop, syscall.SIGINT, syscall.SIGTERM)
+	go func() {
+		<-stop
+		server.Shutdown(context.Background())
+		close(closed)
+	}()
+
+	log.Println("Server in ascolto sulla porta 8080...")
+	errList := server.ListenAndServe()
+	if errors.Is(errList, http.ErrServerClosed) {
+		<-closed
+	}
+	config.FlushAuditLogs()
+	if errList != nil && !errors.Is(errList, http.ErrServerClosed) {
 		log.Fatalf("Errore nell'avvio del server: %v", errList)
 	}
+}
+
+func envInt(name string, def int) int {
+	if v, err := strconv.Atoi(os.Getenv(name)); err == nil {
+		return v
 	}
+	return def
+}
 
-	// quando inizo la call go test.PrintRamUsage
-	//
+// quando inizo la call go test.PrintRamUsage
+//
@@ -4,6 +4,8 @@ import (
 	"fmt"
 	//"github.com/robertkrimen/otto/xes"
 	"os"
+
+	"ta1/taPackage/config"
 )
 
 type EventLog [][]string
@@ -51,6 +53,29 @@ func (am *AlphaMinerStruct) ComputeRelations() {
 	}
 }
 
+// ComputeFootprint ricava le relazioni dalle matrici precalcolate invece di scorrere
+// il log: a > b se a è seguita direttamente da b; a -> b (Causal) se a > b e non b > a,
+// oppure se a e b formano un loop di lunghezza 2 (a b a / b a b); a || b se a > b e b > a.
+func (am *AlphaMinerStruct) ComputeFootprint(fm *config.FollowsMatrices) {
+	df, l2 := fm.DirectlyFollows, fm.Length2Loops
+	for i, a := range fm.Activities {
+		if _, exists := am.relations[a]; !exists {
+			am.relations[a] = make(map[string]Relation)
+		}
+		for j, b := range fm.Activities {
+			if df.At(i, j) == 0 {
+				continue
+			}
+			loop := i != j && (l2.At(i, j) > 0 || l2.At(j, i) > 0)
+			if df.At(j, i) > 0 && !loop {
+				am.relations[a][b] = Parallel
+			} else {
+				am.relations[a][b] = Causal
+			}
+		}
+	}
+}
+
 func (am *AlphaMinerStruct) PrintRelations() {
 	for a, relMap := range am.relations {
 		for b, rel := range relMap {
@@ -102,7 +127,12 @@ func alphaMinerExecution(inputPath string, outputPath string) error {
 	return nil
 }
 
-func AlphaMiner(inputPath string, outputPath string) error {
-	fmt.Println("AlphaMiner called with inputPath:", inputPath, "outputPath:", outputPath)
+func AlphaMiner(fm *config.FollowsMatrices, inputPath string, outputPath string) error {
+	fmt.Println("AlphaMiner called with inputPath:", inputPath, "outputPath:", outputPath, "activities:", len(fm.Activities))
+	miner := NewAlphaMiner(nil)
+	miner.ComputeFootprint(fm)
+	if DEBUG {
+		miner.PrintRelations()
+	}
 	return nil
 }
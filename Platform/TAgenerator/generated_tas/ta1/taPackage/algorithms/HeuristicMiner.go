@@ -13,6 +13,8 @@ import (
 	"sort"
 	"strconv"
 	"strings"
+
+	"ta1/taPackage/config"
 )
 
 // var occurrencyThreshold = 1
@@ -20,7 +22,7 @@ var occurrencyThreshold = 10
 var dependencyThreshold = 0.3
 var andThreshold = 0.1
 var longDepencency2Threshold = 0.99 //Usually it's high (almost 1)
-var longDistance = 2
+var longDistance = config.LongDistance
 var DEBUG = false
 var depLongDist = false
 var outputPrefixPath = "outputs/"
@@ -128,11 +130,39 @@ func calculateDependencyMatrix(dependencyMatrix [][]dependencyMeasure, event []s
 	for i := range event {
 		if i+n < len(event) {
 			dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].occurrence++
-			if event[i] != event[i+n] {
-				dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].dep = float32(dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].occurrence-dependencyMatrix[eventMap[event[i+n]]][eventMap[event[i]]].occurrence) / float32(dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].occurrence+dependencyMatrix[eventMap[event[i+n]]][eventMap[event[i]]].occurrence+1)
-				dependencyMatrix[eventMap[event[i+n]]][eventMap[event[i]]].dep = float32(dependencyMatrix[eventMap[event[i+n]]][eventMap[event[i]]].occurrence-dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].occurrence) / float32(dependencyMatrix[eventMap[event[i+n]]][eventMap[event[i]]].occurrence+dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].occurrence+1)
-			} else {
-				dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].dep = float32(dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].occurrence) / float32(dependencyMatrix[eventMap[event[i]]][eventMap[event[i+n]]].occurrence+1)
+			updateDependency(dependencyMatrix, eventMap[event[i]], eventMap[event[i+n]])
+		}
+	}
+}
+
+func updateDependency(dependencyMatrix [][]dependencyMeasure, a int, b int) {
+	if a != b {
+		dependencyMatrix[a][b].dep = float32(dependencyMatrix[a][b].occurrence-dependencyMatrix[b][a].occurrence) / float32(dependencyMatrix[a][b].occurrence+dependencyMatrix[b][a].occurrence+1)
+		dependencyMatrix[b][a].dep = float32(dependencyMatrix[b][a].occurrence-dependencyMatrix[a][b].occurrence) / float32(dependencyMatrix[b][a].occurrence+dependencyMatrix[a][b].occurrence+1)
+	} else {
+		dependencyMatrix[a][b].dep = float32(dependencyMatrix[a][b].occurrence) / float32(dependencyMatrix[a][b].occurrence+1)
+	}
+}
+
+// addCountMatrix somma i conteggi precalcolati (indicizzati come activities) alla matrice
+// di dipendenza e ricalcola dep delle coppie toccate. Equivale a chiamare
+// calculateDependencyMatrix su ogni traccia: dep dipende solo dalle occorrenze finali.
+func addCountMatrix(dependencyMatrix [][]dependencyMeasure, activities []string, counts *config.CountMatrix, eventMap map[string]int) {
+	idx := make([]int, len(activities))
+	for i, a := range activities {
+		idx[i] = eventMap[a]
+	}
+	for i := range activities {
+		for j := range activities {
+			if c := counts.At(i, j); c != 0 {
+				dependencyMatrix[idx[i]][idx[j]].occurrence += int(c)
+			}
+		}
+	}
+	for i := range activities {
+		for j := range activities {
+			if counts.At(i, j) != 0 {
+				updateDependency(dependencyMatrix, idx[i], idx[j])
 			}
 		}
 	}
@@ -632,11 +662,11 @@ func searchNewDependecyLongDistance2(dependencyMatrix2 [][]dependencyMeasure, ev
 	return n, true
 }
 
-func scanEvent(events [][]string, eventMap map[string]int, processName string) {
-	for _, ele := range events {
-		for _, el := range ele {
-			addEventToMap(eventMap, el)
-		}
+// Le attività arrivano nell'ordine di prima occorrenza nel log, quindi la numerazione
+// coincide con quella ottenuta scorrendo le tracce
+func scanEvent(activities []string, eventMap map[string]int, processName string) {
+	for _, el := range activities {
+		addEventToMap(eventMap, el)
 	}
 	//er := SaveMapToJSON(eventMap, "/data/miningMetadata/"+processName+"/map.json")
 	er := SaveMapToJSON(eventMap, "configs/"+processName+"/heuristicMinerMetadata/map.json")
@@ -645,7 +675,7 @@ func scanEvent(events [][]string, eventMap map[string]int, processName string) {
 	}
 }
 
-func heuristicMinerExecution(ev [][]string, processName string) {
+func heuristicMinerExecution(fm *config.FollowsMatrices, processName string) {
 	//fmt.Println("-------------------------------\n", ev)
 	var d1, d2 int
 	var dependencyMatrix [][]dependencyMeasure
@@ -659,10 +689,10 @@ func heuristicMinerExecution(ev [][]string, processName string) {
 
 	if d1 == 0 {
 		eventMap = make(map[string]int)
-		scanEvent(ev, eventMap, processName)
+		scanEvent(fm.Activities, eventMap, processName)
 		dependencyMatrix = createDependencyMatrix(getMaxValue(eventMap) + 1)
 	} else {
-		scanEvent(ev, eventMap, processName)
+		scanEvent(fm.Activities, eventMap, processName)
 		d2 = len(eventMap)
 
 		// Read the data from the JSON file
@@ -676,9 +706,7 @@ func heuristicMinerExecution(ev [][]string, processName string) {
 			dependencyMatrix = expandDependencyMatrix(dependencyMatrix, d1, eventMap)
 		}
 	}
-	for _, e := range ev {
-		calculateDependencyMatrix(dependencyMatrix, e, eventMap, 1)
-	}
+	addCountMatrix(dependencyMatrix, fm.Activities, fm.DirectlyFollows, eventMap)
 	// Save the dependencyMatrix to a JSON file
 	e = saveToJSON(dependencyMatrix, "configs/"+processName+"/heuristicMinerMetadata/dependencyMatrix.json")
 	if e != nil {
@@ -707,7 +735,7 @@ func heuristicMinerExecution(ev [][]string, processName string) {
 		if d1 == 0 {
 			dependencyMatrix2 = createDependencyMatrix(getMaxValue(eventMap) + 1)
 		} else {
-			scanEvent(ev, eventMap, processName)
+			scanEvent(fm.Activities, eventMap, processName)
 			d2 = len(eventMap)
 
 			dpm2, e := readFromJSON("configs/" + processName + "/heuristicMinerMetadata/dependencyMatrix" + strconv.Itoa(longDistance) + "len" + ".json")
@@ -723,9 +751,7 @@ func heuristicMinerExecution(ev [][]string, processName string) {
 				dependencyMatrix2 = expandDependencyMatrix(dependencyMatrix2, d1, eventMap)
 			}
 		}
-		for _, e := range ev {
-			calculateDependencyMatrix(dependencyMatrix2, e, eventMap, longDistance)
-		}
+		addCountMatrix(dependencyMatrix2, fm.Activities, fm.LongDistance, eventMap)
 		e = saveToJSON(dependencyMatrix2, "configs/"+processName+"/heuristicMinerMetadata/dependencyMatrix"+strconv.Itoa(longDistance)+"len"+".json")
 		if e != nil {
 			log.Fatal(e)
@@ -741,11 +767,14 @@ func heuristicMinerExecution(ev [][]string, processName string) {
 	}
 }
 
-func HeuristicMiner(eventMatrix [][]string, configID string) error {
-	fmt.Println("HeuristicMiner called with", len(eventMatrix), "traces.")
+func HeuristicMiner(fm *config.FollowsMatrices, configID string) error {
+	fmt.Println("HeuristicMiner called with", len(fm.Activities), "activities.")
+	if depLongDist && fm.Distance != longDistance {
+		return fmt.Errorf("matrice delle dipendenze lunghe a distanza %d, attesa %d", fm.Distance, longDistance)
+	}
 
 	// Esegui l'algoritmo vero
-	heuristicMinerExecution(eventMatrix, configID)
+	heuristicMinerExecution(fm, configID)
 
 	// Qui potresti voler salvare l'output finale nel file `outputPath`, se non già fatto
 	// Es. ioutil.WriteFile(outputPath, outputData, 0644)
@@ -2,26 +2,35 @@ package algorithms
 
 import (
 	"fmt"
+
+	"ta1/taPackage/config"
 )
 
-// Tipo comune per tutte le funzioni di processamento
-type ProcessingFunc func(inputPath string, outputPath string) error
+// Tipo comune per tutte le funzioni di processamento: il log arriva già ridotto alle
+// matrici di conteggio (directly-follows, loop di lunghezza 2, distanza lunga)
+type ProcessingFunc func(fm *config.FollowsMatrices, inputPath string, outputPath string) error
 
 // Mappa degli algoritmi disponibili
 var AlgorithmMap = map[string]ProcessingFunc{
 	"AlphaMiner": AlphaMiner,
 }
 
+// IsSupported indica se l'algoritmo è eseguibile da RunAlgorithm
+func IsSupported(name string) bool {
+	_, exists := AlgorithmMap[name]
+	return exists || name == "HeuristicMiner"
+}
+
 // RunAlgorithm esegue l'algoritmo specificato, se presente nella mappa
-func RunAlgorithm(name string, inputPath string, outputPath string, eventMatrix [][]string, configID string) (string, error) {
+func RunAlgorithm(name string, inputPath string, outputPath string, fm *config.FollowsMatrices, configID string) (string, error) {
 	switch name {
 	case "HeuristicMiner":
-		return "heuristicMiner_output.pnml", HeuristicMiner(eventMatrix, configID)
+		return "heuristicMiner_output.pnml", HeuristicMiner(fm, configID)
 	default:
 		algo, exists := AlgorithmMap[name]
 		if !exists {
 			return "", fmt.Errorf("algoritmo non supportato: %s", name)
 		}
-		return "alphaminerMiner_output.pnml", algo(inputPath, outputPath)
+		return "alphaminerMiner_output.pnml", algo(fm, inputPath, outputPath)
 	}
 }
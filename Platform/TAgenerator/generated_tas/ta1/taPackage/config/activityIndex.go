@@ -0,0 +1,171 @@
+package config
+
+import (
+	"bytes"
+	"encoding/hex"
+	"errors"
+	"fmt"
+	"math/bits"
+	"path/filepath"
+	"strings"
+)
+
+// Indice invertito attività -> tracce prodotto dalla piattaforma all'ingestione
+// (data/<id>/artifacts/activity_bitmaps.bin): per ogni attività una bitmap con un bit
+// per traccia. La selezione delle tracce di semanticLogConstraints diventa un OR/ANDNOT
+// su parole da 64 bit, proporzionale al numero di tracce / 64 e non al numero di eventi.
+
+const (
+	ActivityIndexFileName = "activity_bitmaps.bin"
+	activityIndexMagic    = "PMBITMAP"
+	activityIndexVersion  = 1
+	activityIndexHeader   = 104
+	activityIndexFlagAmb  = 1
+)
+
+// Bitmap di tracce: bit t della parola t/64
+type Bitmap []uint64
+
+func NewBitmap(numTraces int) Bitmap {
+	return make(Bitmap, (numTraces+63)/64)
+}
+
+func (b Bitmap) Contains(t int) bool {
+	return t/64 < len(b) && b[t/64]&(1<<(uint(t)%64)) != 0
+}
+
+func (b Bitmap) Count() int {
+	n := 0
+	for _, w := range b {
+		n += bits.OnesCount64(w)
+	}
+	return n
+}
+
+type ActivityIndex struct {
+	data    []byte
+	release func() error
+
+	NumTraces  int
+	SourceHash string
+	// Ambiguous: almeno un evento ha più concept:name (o chiavi con maiuscole diverse),
+	// quindi l'indice non riflette GetAttributeValue
+	Ambiguous bool
+
+	words      int
+	offBitmaps uint64
+	names      map[string]int
+}
+
+func OpenActivityIndex(path string, expectedHash string) (*ActivityIndex, error) {
+	data, release, err := mapFile(path)
+	if err != nil {
+		return nil, err
+	}
+	x, err := parseActivityIndex(data, release)
+	if err != nil {
+		release()
+		return nil, fmt.Errorf("indice delle attività non valido %s: %w", path, err)
+	}
+	if expectedHash != "" && x.SourceHash != expectedHash {
+		x.Close()
+		return nil, fmt.Errorf("indice delle attività %s non corrisponde al log (%s)", path, expectedHash)
+	}
+	return x, nil
+}
+
+func parseActivityIndex(data []byte, release func() error) (*ActivityIndex, error) {
+	if len(data) < activityIndexHeader || !bytes.Equal(data[:8], []byte(activityIndexMagic)) {
+		return nil, errors.New("magic errato")
+	}
+	if le.Uint32(data[8:]) != activityIndexVersion {
+		return nil, errors.New("versione non supportata")
+	}
+	size := uint64(len(data))
+	if le.Uint64(data[96:]) != size {
+		return nil, errors.New("dimensione del file inattesa")
+	}
+	numActivities := le.Uint64(data[16:])
+	numTraces := le.Uint64(data[24:])
+	words := le.Uint64(data[32:])
+	offNameOffsets := le.Uint64(data[72:])
+	offNameData := le.Uint64(data[80:])
+	offBitmaps := le.Uint64(data[88:])
+	if words != (numTraces+63)/64 || numActivities > size/8 {
+		return nil, errors.New("dimensioni incoerenti")
+	}
+	if offNameOffsets > size || 8*(numActivities+1) > size-offNameOffsets || offNameData > size {
+		return nil, errors.New("sezione dei nomi fuori dai limiti")
+	}
+	if offBitmaps > size || (words > 0 && numActivities > (size-offBitmaps)/(8*words)) {
+		return nil, errors.New("sezione delle bitmap fuori dai limiti")
+	}
+
+	x := &ActivityIndex{
+		data:       data,
+		release:    release,
+		NumTraces:  int(numTraces),
+		SourceHash: hex.EncodeToString(data[40:72]),
+		Ambiguous:  le.Uint32(data[12:])&activityIndexFlagAmb != 0,
+		words:      int(words),
+		offBitmaps: offBitmaps,
+		names:      make(map[string]int, numActivities),
+	}
+	for i := uint64(0); i < numActivities; i++ {
+		start := le.Uint64(data[offNameOffsets+8*i:])
+		end := le.Uint64(data[offNameOffsets+8*(i+1):])
+		if start > end || end > size-offNameData {
+			return nil, errors.New("nomi delle attività corrotti")
+		}
+		x.names[string(data[offNameData+start:offNameData+end])] = int(i)
+	}
+	return x, nil
+}
+
+func (x *ActivityIndex) Close() error {
+	x.data = nil
+	if x.release != nil {
+		return x.release()
+	}
+	return nil
+}
+
+func (x *ActivityIndex) word(activity int, w int) uint64 {
+	return le.Uint64(x.data[x.offBitmaps+8*uint64(activity*x.words+w):])
+}
+
+// Union restituisce le tracce che contengono almeno una delle attività
+func (x *ActivityIndex) Union(activities []string) Bitmap {
+	result := NewBitmap(x.NumTraces)
+	for _, a := range activities {
+		if i, ok := x.names[a]; ok {
+			for w := range result {
+				result[w] |= x.word(i, w)
+			}
+		}
+	}
+	return result
+}
+
+// LoadTraceCandidates restituisce le tracce che possono superare mustInclude di
+// LoadAndFilterXesLog: quelle con almeno un evento la cui attività è in MustInclude.
+// È un sovrainsieme esatto (il filtro temporale e le esclusioni agiscono prima del
+// controllo e possono solo togliere tracce), quindi le altre tracce si possono saltare
+// senza decodificarle. mustExclude resta valutato traccia per traccia per lo stesso motivo.
+// ok=false se l'indice manca o non è applicabile alle regole.
+func LoadTraceCandidates(dataPath string, logHash string, rules LogUsageRules) (Bitmap, bool) {
+	if strings.ToLower(rules.AttributeExclusionRules.EventAttribute) != "concept:name" ||
+		stringInSlice("", rules.SemanticLogConstraints.MustInclude) {
+		return nil, false
+	}
+	x, err := OpenActivityIndex(filepath.Join(dataPath, "artifacts", ActivityIndexFileName), logHash)
+	if err != nil {
+		fmt.Println("[DEBUG] LoadTraceCandidates -> indice non disponibile:", err)
+		return nil, false
+	}
+	defer x.Close()
+	if x.Ambiguous {
+		return nil, false
+	}
+	return x.Union(rules.SemanticLogConstraints.MustInclude), true
+}
@@ -5,29 +5,46 @@ import (
 	"net/http"
 	"os"
 	"path/filepath"
+	"sync"
 	"time"
 )
 
+// Le righe di audit passano da un canale per config a un writer in background, che tiene
+// aperto audit.txt, scrive a blocchi e fa fsync ogni AuditSyncInterval o ogni
+// AuditSyncBatch righe. Con AuditStrict la chiamata ritorna solo quando la sua riga è su
+// disco. FlushAuditLogs (alla chiusura) scrive tutto ciò che è in coda.
+var (
+	AuditStrict       = false
+	AuditSyncInterval = time.Second
+	AuditSyncBatch    = 256
+)
+
+type auditEntry struct {
+	line  []byte
+	flush bool       // richiesta di fsync immediato (strict o FlushAuditLog)
+	done  chan error // nil se nessuno attende
+}
+
+type auditWriter struct {
+	configID string
+	entries  chan auditEntry
+}
+
+var (
+	auditMu      sync.RWMutex // le scritture lo prendono in lettura, la chiusura in scrittura
+	auditClosed  bool
+	auditWriters = map[string]*auditWriter{}
+	auditWG      sync.WaitGroup
+)
+
 func getAuditPath(configID string) string {
 	return filepath.Join("configs", configID, "audit.txt")
 }
 
 func WriteAuditLog(configID string, message string) error {
-	path := getAuditPath(configID)
-	f, err := os.OpenFile(path, os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
-	if err != nil {
-		return fmt.Errorf("errore apertura audit log: %w", err)
-	}
-	defer f.Close()
-
 	timestamp := time.Now().Format("2006-01-02 15:04:05")
 	entry := fmt.Sprintf("[%s] %s\n", timestamp, message)
-
-	if _, err := f.WriteString(entry); err != nil {
-		return fmt.Errorf("errore scrittura audit log: %w", err)
-	}
-
-	return nil
+	return writeAudit(configID, entry)
 }
 
 func WriteAuditLogFromRequest(configID string, r *http.Request, result string) error {
@@ -36,17 +53,163 @@ func WriteAuditLogFromRequest(configID string, r *http.Request, result string) e
 	endpoint := r.URL.Path
 	ip := r.RemoteAddr
 	message := fmt.Sprintf("[%s] %s %s - IP: %s - Esito: %s\n", timestamp, method, endpoint, ip, result)
+	return writeAudit(configID, message)
+}
+
+// FlushAuditLog attende che le righe già accodate per la config siano su disco
+func FlushAuditLog(configID string) error {
+	return sendAudit(configID, auditEntry{flush: true, done: make(chan error, 1)})
+}
 
-	auditPath := filepath.Join("configs", configID, "audit.txt")
-	f, err := os.OpenFile(auditPath, os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
+// FlushAuditLogs chiude tutti i writer dopo averne scritto le code; le righe successive
+// vengono scritte direttamente sul file
+func FlushAuditLogs() {
+	auditMu.Lock()
+	if !auditClosed {
+		auditClosed = true
+		for _, aw := range auditWriters {
+			close(aw.entries)
+		}
+	}
+	auditMu.Unlock()
+	auditWG.Wait()
+}
+
+func writeAudit(configID string, line string) error {
+	entry := auditEntry{line: []byte(line)}
+	if AuditStrict {
+		entry.flush, entry.done = true, make(chan error, 1)
+	}
+	return sendAudit(configID, entry)
+}
+
+func sendAudit(configID string, entry auditEntry) error {
+	auditMu.RLock()
+	aw := auditWriters[configID]
+	if aw == nil && !auditClosed {
+		auditMu.RUnlock()
+		startAuditWriter(configID)
+		auditMu.RLock()
+		aw = auditWriters[configID]
+	}
+	if auditClosed {
+		auditMu.RUnlock()
+		return appendAudit(configID, entry.line)
+	}
+	aw.entries <- entry
+	auditMu.RUnlock()
+	if entry.done == nil {
+		return nil
+	}
+	return <-entry.done
+}
+
+func startAuditWriter(configID string) {
+	auditMu.Lock()
+	defer auditMu.Unlock()
+	if auditWriters[configID] != nil || auditClosed {
+		return
+	}
+	aw := &auditWriter{configID: configID, entries: make(chan auditEntry, AuditSyncBatch)}
+	auditWriters[configID] = aw
+	auditWG.Add(1)
+	go aw.run()
+}
+
+func appendAudit(configID string, line []byte) error {
+	if line == nil {
+		return nil
+	}
+	f, err := os.OpenFile(getAuditPath(configID), os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
 	if err != nil {
-		return fmt.Errorf("errore apertura audit file: %w", err)
+		return fmt.Errorf("errore apertura audit log: %w", err)
 	}
 	defer f.Close()
+	if _, err := f.Write(line); err != nil {
+		return fmt.Errorf("errore scrittura audit log: %w", err)
+	}
+	return nil
+}
+
+func (aw *auditWriter) run() {
+	defer auditWG.Done()
+	ticker := time.NewTicker(AuditSyncInterval)
+	defer ticker.Stop()
+
+	var f *os.File
+	var buf []byte
+	var waiting []chan error
+	unsynced := 0 // righe scritte dall'ultima fsync
+	defer func() {
+		if f != nil {
+			f.Close()
+		}
+	}()
 
-	if _, err := f.WriteString(message); err != nil {
-		return fmt.Errorf("errore scrittura audit file: %w", err)
+	// write scrive le righe in buf e fa fsync se richiesto o dopo AuditSyncBatch righe;
+	// l'esito va a chi attende
+	write := func(lines int, flush bool) {
+		var err error
+		if len(buf) > 0 {
+			if f == nil {
+				if f, err = os.OpenFile(getAuditPath(aw.configID), os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644); err != nil {
+					f = nil
+					err = fmt.Errorf("errore apertura audit log: %w", err)
+				}
+			}
+			if err == nil {
+				if _, err = f.Write(buf); err != nil {
+					err = fmt.Errorf("errore scrittura audit log: %w", err)
+				}
+			}
+			buf = buf[:0]
+			unsynced += lines
+		}
+		if err == nil && unsynced > 0 && (flush || unsynced >= AuditSyncBatch) {
+			if err = f.Sync(); err != nil {
+				err = fmt.Errorf("errore sync audit log: %w", err)
+			}
+			unsynced = 0
+		}
+		if err != nil {
+			fmt.Println("[DEBUG] audit", aw.configID+":", err)
+		}
+		for _, done := range waiting {
+			done <- err
+		}
+		waiting = waiting[:0]
 	}
 
-	return nil
+	for {
+		select {
+		case entry, ok := <-aw.entries:
+			if !ok {
+				write(0, true)
+				return
+			}
+			// Le righe già in coda vanno nello stesso blocco
+			lines, flush := 0, false
+			for ok {
+				if entry.line != nil {
+					buf = append(buf, entry.line...)
+					lines++
+				}
+				flush = flush || entry.flush
+				if entry.done != nil {
+					waiting = append(waiting, entry.done)
+				}
+				if lines >= AuditSyncBatch {
+					break
+				}
+				select {
+				case entry, ok = <-aw.entries:
+				default:
+					ok = false
+				}
+			}
+			write(lines, flush)
+		case <-ticker.C:
+			write(0, true)
+		}
+	}
 }
@@ -0,0 +1,209 @@
+package config
+
+import (
+	"bytes"
+	"encoding/binary"
+	"encoding/hex"
+	"errors"
+	"fmt"
+	"math"
+	"path/filepath"
+	"strings"
+)
+
+// Log in formato colonnare prodotto dalla piattaforma all'ingestione
+// (ingest_artifacts.py, data/<id>/artifacts/events.pcol): dizionario di stringhe,
+// offset delle tracce, colonna attività (id nel dizionario) e timestamp int64 in ns.
+// Il file viene mappato in memoria (con fallback su ReadFile) e letto direttamente,
+// senza parsing XML.
+
+const (
+	ColumnarFileName  = "events.pcol"
+	columnarMagic     = "PMCOLUMN"
+	columnarVersion   = 1
+	columnarHeaderLen = 128
+	NoneID            = math.MaxUint32
+	MissingTimestamp  = math.MinInt64
+)
+
+var le = binary.LittleEndian
+
+// Un ColumnarLog non va condiviso tra goroutine: il dizionario è decodificato in modo pigro.
+type ColumnarLog struct {
+	data    []byte
+	release func() error
+
+	NumTraces  int
+	NumEvents  int
+	NumStrings int
+	SourceHash string
+
+	offStringOffsets uint64
+	offStringData    uint64
+	offTraceOffsets  uint64
+	offActivity      uint64
+	offTimestamps    uint64
+
+	strings []string
+	decoded []bool
+}
+
+// OpenColumnarLog apre l'artefatto e ne verifica header, dimensioni e hash del log
+// sorgente (se expectedHash non è vuoto).
+func OpenColumnarLog(path string, expectedHash string) (*ColumnarLog, error) {
+	data, release, err := mapFile(path)
+	if err != nil {
+		return nil, err
+	}
+	c, err := parseColumnar(data, release)
+	if err != nil {
+		release()
+		return nil, fmt.Errorf("artefatto colonnare non valido %s: %w", path, err)
+	}
+	if expectedHash != "" && c.SourceHash != expectedHash {
+		c.Close()
+		return nil, fmt.Errorf("artefatto colonnare %s non corrisponde al log (%s)", path, expectedHash)
+	}
+	return c, nil
+}
+
+func parseColumnar(data []byte, release func() error) (*ColumnarLog, error) {
+	if len(data) < columnarHeaderLen || !bytes.Equal(data[:8], []byte(columnarMagic)) {
+		return nil, errors.New("magic errato")
+	}
+	if le.Uint32(data[8:]) != columnarVersion {
+		return nil, errors.New("versione non supportata")
+	}
+	c := &ColumnarLog{
+		data:             data,
+		release:          release,
+		NumTraces:        int(le.Uint64(data[16:])),
+		NumEvents:        int(le.Uint64(data[24:])),
+		NumStrings:       int(le.Uint64(data[32:])),
+		SourceHash:       hex.EncodeToString(data[40:72]),
+		offStringOffsets: le.Uint64(data[72:]),
+		offStringData:    le.Uint64(data[80:]),
+		offTraceOffsets:  le.Uint64(data[88:]),
+		offActivity:      le.Uint64(data[96:]),
+		offTimestamps:    le.Uint64(data[104:]),
+	}
+	size := uint64(len(data))
+	if le.Uint64(data[120:]) != size {
+		return nil, errors.New("dimensione del file inattesa")
+	}
+	checks := []struct{ off, length uint64 }{
+		{c.offStringOffsets, 8 * uint64(c.NumStrings+1)},
+		{c.offTraceOffsets, 8 * uint64(c.NumTraces+1)},
+		{c.offActivity, 4 * uint64(c.NumEvents)},
+		{c.offTimestamps, 8 * uint64(c.NumEvents)},
+	}
+	for _, chk := range checks {
+		if chk.off > size || chk.length > size-chk.off {
+			return nil, errors.New("sezione fuori dai limiti")
+		}
+	}
+	// Offset monotoni: da qui in poi gli accessi per indice non escono dal file
+	for i := 0; i < c.NumStrings; i++ {
+		if c.stringOffset(i) > c.stringOffset(i+1) {
+			return nil, errors.New("dizionario corrotto")
+		}
+	}
+	if end := c.offStringData + c.stringOffset(c.NumStrings); c.offStringData > size || end > size {
+		return nil, errors.New("dizionario fuori dai limiti")
+	}
+	for t := 0; t < c.NumTraces; t++ {
+		if c.traceOffset(t) > c.traceOffset(t+1) {
+			return nil, errors.New("offset delle tracce corrotti")
+		}
+	}
+	if c.traceOffset(0) != 0 || c.traceOffset(c.NumTraces) != uint64(c.NumEvents) {
+		return nil, errors.New("offset delle tracce incoerenti")
+	}
+	c.strings = make([]string, c.NumStrings)
+	c.decoded = make([]bool, c.NumStrings)
+	return c, nil
+}
+
+func (c *ColumnarLog) Close() error {
+	c.data = nil
+	if c.release != nil {
+		return c.release()
+	}
+	return nil
+}
+
+func (c *ColumnarLog) stringOffset(i int) uint64 {
+	return le.Uint64(c.data[c.offStringOffsets+8*uint64(i):])
+}
+
+func (c *ColumnarLog) traceOffset(i int) uint64 {
+	return le.Uint64(c.data[c.offTraceOffsets+8*uint64(i):])
+}
+
+// String restituisce la stringa del dizionario (copiata una sola volta, poi riusata)
+func (c *ColumnarLog) String(id uint32) string {
+	if id == NoneID || int(id) >= c.NumStrings {
+		return ""
+	}
+	if !c.decoded[id] {
+		start, end := c.stringOffset(int(id)), c.stringOffset(int(id)+1)
+		c.strings[id] = string(c.data[c.offStringData+start : c.offStringData+end])
+		c.decoded[id] = true
+	}
+	return c.strings[id]
+}
+
+// TraceBounds restituisce l'intervallo [start, end) degli eventi della traccia t
+func (c *ColumnarLog) TraceBounds(t int) (int, int) {
+	return int(c.traceOffset(t)), int(c.traceOffset(t + 1))
+}
+
+func (c *ColumnarLog) ActivityID(e int) uint32 {
+	return le.Uint32(c.data[c.offActivity+4*uint64(e):])
+}
+
+// Timestamp restituisce time:timestamp in ns Unix; false se assente o non RFC3339
+func (c *ColumnarLog) Timestamp(e int) (int64, bool) {
+	ts := int64(le.Uint64(c.data[c.offTimestamps+8*uint64(e):]))
+	return ts, ts != MissingTimestamp
+}
+
+// EventMatrix costruisce la sequenza di attività per traccia, con la stessa semantica
+// del ciclo su LoadFullXesLog in HandleProcessing (eventi senza concept:name e tracce
+// vuote esclusi).
+func (c *ColumnarLog) EventMatrix() [][]string {
+	matrix := make([][]string, 0, c.NumTraces)
+	for t := 0; t < c.NumTraces; t++ {
+		start, end := c.TraceBounds(t)
+		var eventSeq []string
+		for e := start; e < end; e++ {
+			if name := c.String(c.ActivityID(e)); name != "" {
+				eventSeq = append(eventSeq, name)
+			}
+		}
+		if len(eventSeq) > 0 {
+			matrix = append(matrix, eventSeq)
+		}
+	}
+	return matrix
+}
+
+// LogHashFromDedupKey estrae lo SHA-256 del log dalla dedup_key (owner:structhash:loghash)
+func LogHashFromDedupKey(dedupKey string) string {
+	if i := strings.LastIndex(dedupKey, ":"); i >= 0 {
+		return dedupKey[i+1:]
+	}
+	return ""
+}
+
+// LoadEventMatrix legge la matrice eventi dall'artefatto colonnare della configurazione.
+// ok=false se l'artefatto manca o non è valido: il chiamante ripiega sul parsing dell'XES.
+func LoadEventMatrix(dataPath string, logHash string) ([][]string, bool) {
+	c, err := OpenColumnarLog(filepath.Join(dataPath, "artifacts", ColumnarFileName), logHash)
+	if err != nil {
+		fmt.Println("[DEBUG] LoadEventMatrix -> fallback su XES:", err)
+		return nil, false
+	}
+	defer c.Close()
+	return c.EventMatrix(), true
+}
@@ -3,11 +3,17 @@
 package config
 
 import (
+	"bufio"
 	"encoding/json"
+	"errors"
 	"fmt"
+	"hash/crc32"
 	"os"
 	"path/filepath"
+	"strconv"
+	"strings"
 	"sync"
+	"time"
 )
 
 type Counters struct {
@@ -15,151 +21,326 @@ type Counters struct {
 	OutputAccessCount int `json:"outputAccessCount"`
 }
 
-var (
-	countersMap  = make(map[string]*Counters)
-	counterMutex sync.RWMutex
+// I contatori vivono in memoria, uno stato per config con il proprio lock: config diverse
+// non si contendono mai nulla. Ogni incremento viene accodato al WAL della config
+// (configs/<id>/counters.wal) e l'accesso viene concesso solo quando il record è su disco.
+// Le richieste concorrenti sulla stessa config condividono write e fsync (group commit).
+// counters.json resta lo snapshot: viene riscritto ogni counterSnapshotEvery record o
+// dopo counterSnapshotInterval, e a quel punto il WAL viene troncato.
+//
+// I record del WAL contengono il valore assoluto del contatore, quindi il replay è
+// idempotente: al caricamento vale il massimo tra snapshot e WAL.
+
+const (
+	counterSnapshotEvery    = 1000
+	counterSnapshotInterval = 30 * time.Second
 )
 
+var ErrAccessLimit = errors.New("access limit reached")
+
+type configCounters struct {
+	once    sync.Once
+	loadErr error
+
+	mu       sync.Mutex
+	cond     *sync.Cond
+	configID string
+	c        Counters
+	wal      *os.File
+	buf      []byte // record accodati e non ancora scritti
+	seq      uint64 // ultimo record accodato
+	durable  uint64 // ultimo record scritto e sincronizzato
+	flushing bool
+	err      error // errore di scrittura: da qui in poi gli incrementi falliscono
+
+	records    int // record nel WAL dall'ultimo snapshot
+	snapshotAt time.Time
+}
+
+var counterStore sync.Map // configID -> *configCounters
+
 // Percorso del file counters per una determinata config
 func getCounterPath(configID string) string {
 	return filepath.Join("configs", configID, "counters.json")
 }
 
-// Carica i counters da file
-func LoadCounters(configID string) (*Counters, error) {
-	path := getCounterPath(configID)
-	file, err := os.ReadFile(path)
-	if err != nil {
-		return nil, fmt.Errorf("failed to read counters for %s: %w", configID, err)
+func getCounterWALPath(configID string) string {
+	return filepath.Join("configs", configID, "counters.wal")
+}
+
+func getCounters(configID string) (*configCounters, error) {
+	v, _ := counterStore.LoadOrStore(configID, &configCounters{configID: configID})
+	cc := v.(*configCounters)
+	cc.once.Do(func() { cc.loadErr = cc.load() })
+	if cc.loadErr != nil {
+		// Nessuno stato in cache: la prossima richiesta riprova il caricamento
+		counterStore.CompareAndDelete(configID, cc)
+		return nil, cc.loadErr
 	}
+	return cc, nil
+}
 
+func readCountersSnapshot(configID string) (Counters, error) {
 	var c Counters
-	err = json.Unmarshal(file, &c)
+	file, err := os.ReadFile(getCounterPath(configID))
 	if err != nil {
-		return nil, fmt.Errorf("failed to parse counters for %s: %w", configID, err)
+		return c, fmt.Errorf("failed to read counters for %s: %w", configID, err)
 	}
-
-	counterMutex.Lock()
-	countersMap[configID] = &c
-	counterMutex.Unlock()
-
-	return &c, nil
+	if err := json.Unmarshal(file, &c); err != nil {
+		return c, fmt.Errorf("failed to parse counters for %s: %w", configID, err)
+	}
+	return c, nil
 }
 
-// SaveCounters salva un oggetto Counters già protetto da lock
-func SaveCounters(configID string, c *Counters) error {
-	data, err := json.MarshalIndent(c, "", "  ")
+func (cc *configCounters) load() error {
+	c, err := readCountersSnapshot(cc.configID)
 	if err != nil {
 		return err
 	}
-	path := getCounterPath(configID)
-	return os.WriteFile(path, data, 0644)
+	records, valid, err := replayCounterWAL(getCounterWALPath(cc.configID), &c)
+	if err != nil {
+		return fmt.Errorf("failed to read counters WAL for %s: %w", cc.configID, err)
+	}
+	wal, err := os.OpenFile(getCounterWALPath(cc.configID), os.O_WRONLY|os.O_APPEND|os.O_CREATE, 0644)
+	if err != nil {
+		return fmt.Errorf("failed to open counters WAL for %s: %w", cc.configID, err)
+	}
+	// I nuovi record non devono finire dopo una coda corrotta
+	if err := wal.Truncate(valid); err != nil {
+		wal.Close()
+		return fmt.Errorf("failed to open counters WAL for %s: %w", cc.configID, err)
+	}
+	cc.cond = sync.NewCond(&cc.mu)
+	cc.c = c
+	cc.wal = wal
+	cc.records = records
+	cc.snapshotAt = time.Now()
+	return nil
 }
 
-func IncrementLogAccess(configID string) error {
-	counterMutex.Lock()
-	defer counterMutex.Unlock()
+// replayCounterWAL applica i record validi del WAL e ritorna quanti sono e dove finiscono.
+// Una coda troncata o corrotta (scrittura interrotta) viene ignorata.
+func replayCounterWAL(path string, c *Counters) (int, int64, error) {
+	f, err := os.Open(path)
+	if os.IsNotExist(err) {
+		return 0, 0, nil
+	}
+	if err != nil {
+		return 0, 0, err
+	}
+	defer f.Close()
 
-	c, ok := countersMap[configID]
-	if !ok {
-		loaded, err := LoadCounters(configID)
+	records := 0
+	var valid int64
+	reader := bufio.NewReader(f)
+	for {
+		line, err := reader.ReadString('\n')
 		if err != nil {
-			return err
+			break
 		}
-		c = loaded
-		countersMap[configID] = c
-	}
-
-	c.LogAccessCount++
-	err := SaveCounters(configID, c)
-	if err != nil {
-		return err
+		fields := strings.Fields(line)
+		if len(fields) != 3 {
+			break
+		}
+		sum, err := strconv.ParseUint(fields[2], 16, 32)
+		if err != nil || uint32(sum) != crc32.ChecksumIEEE([]byte(fields[0]+" "+fields[1])) {
+			break
+		}
+		value, err := strconv.Atoi(fields[1])
+		if err != nil {
+			break
+		}
+		switch fields[0] {
+		case "log":
+			c.LogAccessCount = max(c.LogAccessCount, value)
+		case "output":
+			c.OutputAccessCount = max(c.OutputAccessCount, value)
+		}
+		records++
+		valid += int64(len(line))
 	}
+	return records, valid, nil
+}
 
-	return WriteAuditLog(configID, fmt.Sprintf("Increment LogAccessCount: %d", c.LogAccessCount))
+func counterRecord(kind string, value int) []byte {
+	body := kind + " " + strconv.Itoa(value)
+	return []byte(fmt.Sprintf("%s %08x\n", body, crc32.ChecksumIEEE([]byte(body))))
 }
 
-func IncrementOutputAccess(configID string) error {
-	counterMutex.Lock()
-	defer counterMutex.Unlock()
+// increment incrementa il contatore scelto da field se è sotto limit (limit < 0: nessun
+// limite) e ritorna il nuovo valore quando il record è su disco
+func (cc *configCounters) increment(kind string, field func(*Counters) *int, limit int) (int, error) {
+	cc.mu.Lock()
+	defer cc.mu.Unlock()
+	if cc.err != nil {
+		return 0, cc.err
+	}
+	counter := field(&cc.c)
+	if limit >= 0 && *counter >= limit {
+		return *counter, ErrAccessLimit
+	}
+	*counter++
+	value := *counter
+	cc.buf = append(cc.buf, counterRecord(kind, value)...)
+	cc.seq++
+	if err := cc.commit(cc.seq); err != nil {
+		return 0, err
+	}
+	return value, nil
+}
 
-	c, ok := countersMap[configID]
-	if !ok {
-		loaded, err := LoadCounters(configID)
+// commit attende che il record seq sia su disco. Il primo in attesa scrive anche i
+// record accodati dagli altri nel frattempo (una sola fsync per tutti). Va chiamata con
+// cc.mu preso.
+func (cc *configCounters) commit(seq uint64) error {
+	for cc.durable < seq {
+		if cc.err != nil {
+			return cc.err
+		}
+		if cc.flushing {
+			cc.cond.Wait()
+			continue
+		}
+		cc.flushing = true
+		buf, upto := cc.buf, cc.seq
+		cc.buf = nil
+		cc.mu.Unlock()
+		_, err := cc.wal.Write(buf)
+		if err == nil {
+			err = cc.wal.Sync()
+		}
+		cc.mu.Lock()
 		if err != nil {
-			return err
+			cc.err = fmt.Errorf("failed to write counters WAL for %s: %w", cc.configID, err)
+		} else {
+			cc.records += int(upto - cc.durable)
+			cc.durable = upto
+		}
+		cc.cond.Broadcast()
+
+		if err == nil && (cc.records >= counterSnapshotEvery || time.Since(cc.snapshotAt) >= counterSnapshotInterval) {
+			cc.snapshot()
 		}
-		c = loaded
-		countersMap[configID] = c
+		cc.flushing = false
+		cc.cond.Broadcast()
+	}
+	return nil
+}
+
+// snapshot riscrive counters.json e tronca il WAL. Chiamata dal flush in corso (nessun
+// altro scrive il WAL) con cc.mu preso, che viene rilasciato durante la scrittura.
+func (cc *configCounters) snapshot() {
+	c := cc.c
+	cc.mu.Unlock()
+	err := SaveCounters(cc.configID, &c)
+	if err == nil {
+		err = cc.wal.Truncate(0)
+	}
+	cc.mu.Lock()
+	if err != nil {
+		// Il WAL resta valido: si riprova al prossimo flush
+		fmt.Println("[DEBUG] snapshot contatori fallito:", err)
+		return
+	}
+	cc.records = 0
+	cc.snapshotAt = time.Now()
+}
+
+// Carica i counters (snapshot più WAL) e ne restituisce una copia
+func LoadCounters(configID string) (*Counters, error) {
+	cc, err := getCounters(configID)
+	if err != nil {
+		return nil, err
 	}
+	cc.mu.Lock()
+	c := cc.c
+	cc.mu.Unlock()
+	return &c, nil
+}
 
-	c.OutputAccessCount++
-	err := SaveCounters(configID, c)
+// SaveCounters scrive lo snapshot dei counters (file temporaneo, fsync e rename)
+func SaveCounters(configID string, c *Counters) error {
+	data, err := json.MarshalIndent(c, "", "  ")
 	if err != nil {
 		return err
 	}
+	return writeFileAtomic(getCounterPath(configID), data)
+}
+
+func logAccessCounter(c *Counters) *int    { return &c.LogAccessCount }
+func outputAccessCounter(c *Counters) *int { return &c.OutputAccessCount }
 
-	return WriteAuditLog(configID, fmt.Sprintf("Increment OutputAccessCount: %d", c.OutputAccessCount))
+// TryIncrementLogAccess verifica maxAccessCount e incrementa in un'unica operazione:
+// ErrAccessLimit se il limite è già raggiunto (come CheckLogAccessLimit, un massimo
+// negativo non consente accessi)
+func TryIncrementLogAccess(configID string, max int) error {
+	return tryIncrement(configID, "log", logAccessCounter, clampLimit(max), "LogAccessCount")
 }
 
-/*
-	func CheckLogAccessLimit(configID string, max int) bool {
-		counterMutex.RLock()
-		defer counterMutex.RUnlock()
-		c, ok := countersMap[configID]
-		if !ok {
-			return false
-		}
-		return c.LogAccessCount < max
+func TryIncrementOutputAccess(configID string, max int) error {
+	return tryIncrement(configID, "output", outputAccessCounter, clampLimit(max), "OutputAccessCount")
+}
+
+func clampLimit(max int) int {
+	if max < 0 {
+		return 0
 	}
+	return max
+}
 
-	func CheckOutputAccessLimit(configID string, max int) bool {
-		counterMutex.RLock()
-		defer counterMutex.RUnlock()
-		c, ok := countersMap[configID]
-		if !ok {
-			return false
-		}
-		return c.OutputAccessCount < max
+func IncrementLogAccess(configID string) error {
+	return tryIncrement(configID, "log", logAccessCounter, -1, "LogAccessCount")
+}
+
+func IncrementOutputAccess(configID string) error {
+	return tryIncrement(configID, "output", outputAccessCounter, -1, "OutputAccessCount")
+}
+
+func tryIncrement(configID, kind string, field func(*Counters) *int, limit int, name string) error {
+	cc, err := getCounters(configID)
+	if err != nil {
+		return err
 	}
-*/
-func ReloadCounters(configID string) error {
-	path := getCounterPath(configID)
-	file, err := os.ReadFile(path)
+	value, err := cc.increment(kind, field, limit)
 	if err != nil {
-		return fmt.Errorf("failed to read counters for %s: %w", configID, err)
+		return err
 	}
+	return WriteAuditLog(configID, fmt.Sprintf("Increment %s: %d", name, value))
+}
 
-	var c Counters
-	err = json.Unmarshal(file, &c)
+// ReloadCounters rilegge snapshot e WAL da disco, sostituendo lo stato in memoria
+func ReloadCounters(configID string) error {
+	cc, err := getCounters(configID)
 	if err != nil {
-		return fmt.Errorf("failed to parse counters for %s: %w", configID, err)
+		return err
 	}
-
-	counterMutex.Lock()
-	countersMap[configID] = &c
-	counterMutex.Unlock()
-
+	cc.mu.Lock()
+	defer cc.mu.Unlock()
+	for cc.flushing {
+		cc.cond.Wait()
+	}
+	c, err := readCountersSnapshot(configID)
+	if err != nil {
+		return err
+	}
+	if _, _, err := replayCounterWAL(getCounterWALPath(configID), &c); err != nil {
+		return err
+	}
+	cc.c = c
 	return nil
 }
 
 func CheckLogAccessLimit(configID string, max int) bool {
-	_ = ReloadCounters(configID) // ricarica da file sempre
-	counterMutex.RLock()
-	defer counterMutex.RUnlock()
-	c, ok := countersMap[configID]
-	if !ok {
+	c, err := LoadCounters(configID)
+	if err != nil {
 		return false
 	}
 	return c.LogAccessCount < max
 }
 
 func CheckOutputAccessLimit(configID string, max int) bool {
-	_ = ReloadCounters(configID) // ricarica da file sempre
-	counterMutex.RLock()
-	defer counterMutex.RUnlock()
-	c, ok := countersMap[configID]
-	if !ok {
+	c, err := LoadCounters(configID)
+	if err != nil {
 		return false
 	}
 	return c.OutputAccessCount < max
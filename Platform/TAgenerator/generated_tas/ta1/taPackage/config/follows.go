@@ -0,0 +1,205 @@
+package config
+
+import (
+	"bytes"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"os"
+	"path/filepath"
+	"strconv"
+	"strings"
+)
+
+// Matrici di conteggio calcolate dalla piattaforma all'ingestione
+// (data/<id>/artifacts/follows.npy + follows.json): directly-follows, loop di
+// lunghezza 2 (a b a) e dipendenze a distanza LongDistance, indicizzate come
+// l'elenco Activities. Gli algoritmi partono da queste invece di scorrere il log,
+// quindi una /process costa O(attività²) e non O(eventi).
+
+const (
+	FollowsMatrixFileName = "follows.npy"
+	FollowsIndexFileName  = "follows.json"
+	LongDistance          = 2 // distanza delle dipendenze lunghe (longDistance di HeuristicMiner)
+)
+
+// Matrice quadrata di conteggi, memorizzata per righe
+type CountMatrix struct {
+	N    int
+	Data []int64
+}
+
+func NewCountMatrix(n int) *CountMatrix {
+	return &CountMatrix{N: n, Data: make([]int64, n*n)}
+}
+
+func (m *CountMatrix) At(i, j int) int64 {
+	return m.Data[i*m.N+j]
+}
+
+func (m *CountMatrix) Add(i, j int, v int64) {
+	m.Data[i*m.N+j] += v
+}
+
+type FollowsMatrices struct {
+	Activities      []string
+	DirectlyFollows *CountMatrix
+	Length2Loops    *CountMatrix
+	LongDistance    *CountMatrix
+	Distance        int
+}
+
+type followsIndex struct {
+	Version      int      `json:"version"`
+	SourceSHA256 string   `json:"source_sha256"`
+	Activities   []string `json:"activities"`
+	Layers       []string `json:"layers"`
+	LongDistance int      `json:"long_distance"`
+}
+
+// LoadFollowsMatrices legge le matrici della configurazione. ok=false se mancano, non
+// sono valide o sono state calcolate da un altro log: il chiamante le ricalcola.
+func LoadFollowsMatrices(dataPath string, logHash string) (*FollowsMatrices, bool) {
+	m, err := loadFollowsMatrices(filepath.Join(dataPath, "artifacts"), logHash)
+	if err != nil {
+		fmt.Println("[DEBUG] LoadFollowsMatrices -> artefatto non disponibile:", err)
+		return nil, false
+	}
+	return m, true
+}
+
+func loadFollowsMatrices(dir string, logHash string) (*FollowsMatrices, error) {
+	raw, err := os.ReadFile(filepath.Join(dir, FollowsIndexFileName))
+	if err != nil {
+		return nil, err
+	}
+	var idx followsIndex
+	if err := json.Unmarshal(raw, &idx); err != nil {
+		return nil, err
+	}
+	if idx.Version != 1 || len(idx.Layers) != 3 {
+		return nil, errors.New("versione dell'indice non supportata")
+	}
+	if logHash != "" && idx.SourceSHA256 != logHash {
+		return nil, fmt.Errorf("indice calcolato da un altro log (%s)", idx.SourceSHA256)
+	}
+
+	n := len(idx.Activities)
+	shape, data, err := readNpyInt64(filepath.Join(dir, FollowsMatrixFileName))
+	if err != nil {
+		return nil, err
+	}
+	if len(shape) != 3 || shape[0] != 3 || shape[1] != n || shape[2] != n {
+		return nil, fmt.Errorf("forma %v incoerente con %d attività", shape, n)
+	}
+	layer := func(k int) *CountMatrix {
+		return &CountMatrix{N: n, Data: data[k*n*n : (k+1)*n*n]}
+	}
+	return &FollowsMatrices{
+		Activities:      idx.Activities,
+		DirectlyFollows: layer(0),
+		Length2Loops:    layer(1),
+		LongDistance:    layer(2),
+		Distance:        idx.LongDistance,
+	}, nil
+}
+
+// readNpyInt64 legge un array .npy int64 little-endian in ordine C
+func readNpyInt64(path string) ([]int, []int64, error) {
+	raw, err := os.ReadFile(path)
+	if err != nil {
+		return nil, nil, err
+	}
+	if len(raw) < 10 || !bytes.Equal(raw[:6], []byte("\x93NUMPY")) {
+		return nil, nil, errors.New("file .npy non valido")
+	}
+	var headerLen, start int
+	switch raw[6] {
+	case 1:
+		headerLen, start = int(le.Uint16(raw[8:])), 10
+	case 2, 3:
+		if len(raw) < 12 {
+			return nil, nil, errors.New("file .npy troncato")
+		}
+		headerLen, start = int(le.Uint32(raw[8:])), 12
+	default:
+		return nil, nil, fmt.Errorf("versione .npy %d non supportata", raw[6])
+	}
+	if start+headerLen > len(raw) {
+		return nil, nil, errors.New("header .npy troncato")
+	}
+	header := string(raw[start : start+headerLen])
+	if !strings.Contains(header, "'descr': '<i8'") || !strings.Contains(header, "'fortran_order': False") {
+		return nil, nil, fmt.Errorf("tipo .npy non supportato: %s", strings.TrimSpace(header))
+	}
+	i := strings.Index(header, "'shape': (")
+	if i < 0 {
+		return nil, nil, errors.New("shape .npy mancante")
+	}
+	dims := header[i+len("'shape': ("):]
+	j := strings.Index(dims, ")")
+	if j < 0 {
+		return nil, nil, errors.New("shape .npy mancante")
+	}
+	var shape []int
+	count := 1
+	for _, dim := range strings.Split(dims[:j], ",") {
+		if dim = strings.TrimSpace(dim); dim == "" {
+			continue
+		}
+		v, err := strconv.Atoi(dim)
+		if err != nil || v < 0 {
+			return nil, nil, fmt.Errorf("shape .npy non valida: %s", header)
+		}
+		shape = append(shape, v)
+		count *= v
+	}
+	body := raw[start+headerLen:]
+	if len(body) != 8*count {
+		return nil, nil, errors.New("dimensione dei dati .npy inattesa")
+	}
+	data := make([]int64, count)
+	for k := range data {
+		data[k] = int64(le.Uint64(body[8*k:]))
+	}
+	return shape, data, nil
+}
+
+// BuildFollowsMatrices calcola le stesse matrici a partire dalle varianti, quando
+// l'artefatto non è disponibile
+func BuildFollowsMatrices(variants []TraceVariant, distance int) *FollowsMatrices {
+	index := make(map[string]int)
+	var activities []string
+	for _, v := range variants {
+		for _, a := range v.Activities {
+			if _, ok := index[a]; !ok {
+				index[a] = len(activities)
+				activities = append(activities, a)
+			}
+		}
+	}
+	n := len(activities)
+	m := &FollowsMatrices{
+		Activities:      activities,
+		DirectlyFollows: NewCountMatrix(n),
+		Length2Loops:    NewCountMatrix(n),
+		LongDistance:    NewCountMatrix(n),
+		Distance:        distance,
+	}
+	for _, v := range variants {
+		w := int64(v.Count)
+		for i := range v.Activities {
+			a := index[v.Activities[i]]
+			if i+1 < len(v.Activities) {
+				m.DirectlyFollows.Add(a, index[v.Activities[i+1]], w)
+			}
+			if i+2 < len(v.Activities) && v.Activities[i] == v.Activities[i+2] {
+				m.Length2Loops.Add(a, index[v.Activities[i+1]], w)
+			}
+			if i+distance < len(v.Activities) {
+				m.LongDistance.Add(a, index[v.Activities[i+distance]], w)
+			}
+		}
+	}
+	return m
+}
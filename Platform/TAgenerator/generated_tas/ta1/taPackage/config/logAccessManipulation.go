@@ -1,8 +1,11 @@
 package config
 
 import (
+	"bufio"
+	"compress/gzip"
 	"encoding/xml"
 	"fmt"
+	"io"
 	"os"
 	"strings"
 	"time"
@@ -44,74 +47,200 @@ type FilteredLog struct {
 	Traces []FilteredTrace `json:"Traces"`
 }
 
-// Funzione principale
-func LoadAndFilterXesLog(filePath string, rules LogUsageRules) (*FilteredLog, error) {
-	fmt.Println("[DEBUG] LoadAndFilterXesLog -> ENTRATO con filePath:", filePath)
+// xesLogReader legge il log in streaming, decomprimendolo al volo se è gzip
+type xesLogReader struct {
+	io.Reader
+	file *os.File
+	zr   *gzip.Reader
+}
+
+func (r *xesLogReader) Close() error {
+	if r.zr != nil {
+		r.zr.Close()
+	}
+	return r.file.Close()
+}
+
+// OpenXesLog apre il log indicato (o, se assente, la sua versione .gz memorizzata
+// dalla piattaforma) e riconosce il formato dal magic number gzip.
+func OpenXesLog(filePath string) (io.ReadCloser, error) {
 	file, err := os.Open(filePath)
+	if os.IsNotExist(err) && !strings.HasSuffix(filePath, ".gz") {
+		if gzFile, gzErr := os.Open(filePath + ".gz"); gzErr == nil {
+			file, err = gzFile, nil
+		}
+	}
 	if err != nil {
-		return nil, fmt.Errorf("failed to open xes file: %w", err)
+		return nil, err
 	}
-	defer file.Close()
 
-	var log XesLog
-	decoder := xml.NewDecoder(file)
-	if err := decoder.Decode(&log); err != nil {
-		return nil, fmt.Errorf("failed to parse xes xml: %w", err)
+	br := bufio.NewReaderSize(file, 256*1024)
+	if magic, _ := br.Peek(2); len(magic) == 2 && magic[0] == 0x1f && magic[1] == 0x8b {
+		zr, err := gzip.NewReader(br)
+		if err != nil {
+			file.Close()
+			return nil, err
+		}
+		return &xesLogReader{Reader: zr, file: file, zr: zr}, nil
+	}
+	return &xesLogReader{Reader: br, file: file}, nil
+}
+
+// forEachXesTrace scorre in streaming le tracce figlie dirette della radice (come
+// Decode su XesLog) passando il loro indice: fn decodifica la traccia con
+// dec.DecodeElement oppure la salta con dec.Skip.
+func forEachXesTrace(r io.Reader, fn func(t int, dec *xml.Decoder, start *xml.StartElement) error) error {
+	dec := xml.NewDecoder(r)
+	depth, t := 0, 0
+	for {
+		tok, err := dec.Token()
+		if err == io.EOF && depth > 0 {
+			return io.ErrUnexpectedEOF
+		}
+		if err != nil {
+			return err
+		}
+		switch el := tok.(type) {
+		case xml.StartElement:
+			if depth == 1 {
+				if el.Name.Local == "trace" {
+					if err := fn(t, dec, &el); err != nil {
+						return err
+					}
+					t++
+				} else if err := dec.Skip(); err != nil {
+					return err
+				}
+				continue
+			}
+			depth++
+		case xml.EndElement:
+			depth--
+			if depth == 0 {
+				return nil
+			}
+		}
+	}
+}
+
+// Funzione principale
+func LoadAndFilterXesLog(filePath string, rules LogUsageRules) (*FilteredLog, error) {
+	return loadAndFilterXesLog(filePath, "", rules, nil, nil)
+}
+
+// LoadAndFilterXesLogWithIndex prende il log dalla cache dei log decodificati e usa gli
+// indici generati all'ingestione: quello attività -> tracce per scartare le tracce che
+// non contengono attività di mustInclude, quello temporale per scartare le tracce
+// interamente fuori da allowedTimeRange e per non rileggere i timestamp delle altre.
+// Il risultato è identico a LoadAndFilterXesLog.
+func LoadAndFilterXesLogWithIndex(filePath string, rules LogUsageRules, dataPath string, logHash string) (*FilteredLog, error) {
+	candidates, ok := LoadTraceCandidates(dataPath, logHash, rules)
+	if !ok {
+		candidates = nil
+	}
+	times := LoadTimeIndex(dataPath, logHash, rules)
+	if times != nil {
+		defer times.Close()
+	}
+	return loadAndFilterXesLog(filePath, logHash, rules, candidates, times)
+}
+
+func loadAndFilterXesLog(filePath string, logHash string, rules LogUsageRules, candidates Bitmap, times *TimeIndex) (*FilteredLog, error) {
+	fmt.Println("[DEBUG] LoadAndFilterXesLog -> ENTRATO con filePath:", filePath)
+	parsed, err := LoadParsedLog(filePath, logHash)
+	if err != nil {
+		return nil, err
 	}
 
 	filteredLog := &FilteredLog{}
+	window := NewTimeWindow(rules.AllowedTimeRange)
 
-	for _, trace := range log.Traces {
-		filteredTrace := FilteredTrace{
-			Attributes: trace.Attributes,
-			Events:     []FilteredEvent{},
+	for t := range parsed.Traces {
+		if candidates != nil && !candidates.Contains(t) {
+			continue
+		}
+		timeClass := TraceTimeUnknown
+		if times != nil {
+			timeClass = times.Classify(t, window)
+		}
+		if timeClass == TraceTimeOutside {
+			continue
 		}
+		trace := &parsed.Traces[t]
+		// dropped[i]: evento i fuori da allowedTimeRange; nil = valutare con time.Parse
+		var dropped []bool
+		switch timeClass {
+		case TraceTimeInside:
+			dropped = make([]bool, len(trace.Events))
+		case TraceTimePartial:
+			dropped, _ = times.DroppedEvents(t, len(trace.Events), window)
+		}
+		if filteredTrace, keep := filterXesTrace(trace, rules, dropped); keep {
+			filteredLog.Traces = append(filteredLog.Traces, filteredTrace)
+		}
+	}
 
-		containsMustInclude := false
-		containsMustExclude := false
+	return filteredLog, nil
+}
 
-		for _, event := range trace.Events {
-			// Unifica string e date
-			allAttrs := append(event.Strings, event.Dates...)
+// eventAttributes unisce string e date in una slice nuova: gli eventi arrivano dalla
+// cache condivisa e non vanno modificati
+func eventAttributes(event *XesEvent) []XesAttribute {
+	attrs := make([]XesAttribute, 0, len(event.Strings)+len(event.Dates))
+	attrs = append(attrs, event.Strings...)
+	return append(attrs, event.Dates...)
+}
 
-			conceptName := GetAttributeValue(allAttrs, rules.AttributeExclusionRules.EventAttribute)
+func filterXesTrace(trace *XesTrace, rules LogUsageRules, dropped []bool) (FilteredTrace, bool) {
+	filteredTrace := FilteredTrace{
+		Attributes: trace.Attributes,
+		Events:     []FilteredEvent{},
+	}
 
-			// AttributeExclusionRules
-			if stringInSlice(conceptName, rules.AttributeExclusionRules.ExcludedAttributes) {
-				continue
-			}
+	containsMustInclude := false
+	containsMustExclude := false
 
-			// allowedTimeRange
-			timeValStr := GetAttributeValue(allAttrs, rules.AllowedTimeRange.EventAttribute)
-			if timeValStr != "" {
-				tm, err := time.Parse(time.RFC3339, timeValStr)
-				if err == nil {
-					if tm.Before(rules.AllowedTimeRange.StartDate) || tm.After(rules.AllowedTimeRange.EndDate) {
-						continue
-					}
-				}
-			}
+	for i := range trace.Events {
+		// Unifica string e date
+		allAttrs := eventAttributes(&trace.Events[i])
+
+		conceptName := GetAttributeValue(allAttrs, rules.AttributeExclusionRules.EventAttribute)
 
-			// Semantic constraints
-			if stringInSlice(conceptName, rules.SemanticLogConstraints.MustInclude) {
-				containsMustInclude = true
+		// AttributeExclusionRules
+		if stringInSlice(conceptName, rules.AttributeExclusionRules.ExcludedAttributes) {
+			continue
+		}
+
+		// allowedTimeRange
+		timeValStr := GetAttributeValue(allAttrs, rules.AllowedTimeRange.EventAttribute)
+		if dropped != nil {
+			if dropped[i] {
+				continue
 			}
-			if stringInSlice(conceptName, rules.SemanticLogConstraints.MustExclude) {
-				containsMustExclude = true
+		} else if timeValStr != "" {
+			tm, err := time.Parse(time.RFC3339, timeValStr)
+			if err == nil {
+				if tm.Before(rules.AllowedTimeRange.StartDate) || tm.After(rules.AllowedTimeRange.EndDate) {
+					continue
+				}
 			}
-
-			filteredTrace.Events = append(filteredTrace.Events, FilteredEvent{
-				Attributes: allAttrs,
-				Date:       timeValStr,
-			})
 		}
 
-		if containsMustInclude && !containsMustExclude && len(filteredTrace.Events) > 0 {
-			filteredLog.Traces = append(filteredLog.Traces, filteredTrace)
+		// Semantic constraints
+		if stringInSlice(conceptName, rules.SemanticLogConstraints.MustInclude) {
+			containsMustInclude = true
 		}
+		if stringInSlice(conceptName, rules.SemanticLogConstraints.MustExclude) {
+			containsMustExclude = true
+		}
+
+		filteredTrace.Events = append(filteredTrace.Events, FilteredEvent{
+			Attributes: allAttrs,
+			Date:       timeValStr,
+		})
 	}
 
-	return filteredLog, nil
+	return filteredTrace, containsMustInclude && !containsMustExclude && len(filteredTrace.Events) > 0
 }
 
 func GetAttributeValue(attrs []XesAttribute, key string) string {
@@ -132,30 +261,25 @@ func stringInSlice(s string, list []string) bool {
 	return false
 }
 
-func LoadFullXesLog(filePath string) (*FilteredLog, error) {
+func LoadFullXesLog(filePath string, logHash string) (*FilteredLog, error) {
 	fmt.Println("[DEBUG] LoadFullXesLog -> ENTRATO con filePath:", filePath)
-	file, err := os.Open(filePath)
+	parsed, err := LoadParsedLog(filePath, logHash)
 	if err != nil {
-		return nil, fmt.Errorf("failed to open xes file: %w", err)
-	}
-	defer file.Close()
-
-	var log XesLog
-	decoder := xml.NewDecoder(file)
-	if err := decoder.Decode(&log); err != nil {
-		return nil, fmt.Errorf("failed to parse xes xml: %w", err)
+		return nil, err
 	}
 
 	filteredLog := &FilteredLog{}
 
-	for _, trace := range log.Traces {
+	for t := range parsed.Traces {
+		trace := &parsed.Traces[t]
 		filteredTrace := FilteredTrace{
 			Attributes: trace.Attributes,
 			Events:     []FilteredEvent{},
 		}
 
-		for _, event := range trace.Events {
-			allAttrs := append(event.Strings, event.Dates...)
+		for i := range trace.Events {
+			event := &trace.Events[i]
+			allAttrs := eventAttributes(event)
 
 			// Trova un eventuale timestamp (opzionale, non essenziale)
 			var eventDate string
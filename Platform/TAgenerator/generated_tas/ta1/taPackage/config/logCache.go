@@ -0,0 +1,158 @@
+package config
+
+import (
+	"container/list"
+	"encoding/xml"
+	"fmt"
+	"os"
+	"strings"
+	"sync"
+)
+
+// Cache dei log XES già decodificati, condivisa tra le richieste e indicizzata dallo
+// SHA-256 del log (dalla dedup_key): config che usano lo stesso log condividono un'unica
+// copia. Le voci escono in ordine LRU quando la dimensione stimata supera LogCacheBudget
+// (da tarare sull'heapSize dell'enclave). Più richieste che mancano la stessa voce
+// attendono un unico parsing. I log in cache sono in sola lettura.
+var LogCacheBudget int64 = 128 << 20
+
+type ParsedLog struct {
+	Traces []XesTrace
+	size   int64
+}
+
+type logCacheEntry struct {
+	hash string
+	info os.FileInfo // file da cui è stato letto: se cambia la voce non vale più
+	log  *ParsedLog
+}
+
+type logLoad struct {
+	done chan struct{}
+	log  *ParsedLog
+	err  error
+}
+
+var (
+	logCacheMu   sync.Mutex
+	logCacheLRU  = list.New() // fronte: usata più di recente
+	logCacheMap  = map[string]*list.Element{}
+	logCacheSize int64
+	logLoads     = map[string]*logLoad{}
+)
+
+// LoadParsedLog restituisce il log di filePath, dalla cache se presente. Senza logHash il
+// log viene decodificato senza passare dalla cache.
+func LoadParsedLog(filePath string, logHash string) (*ParsedLog, error) {
+	if logHash == "" {
+		return parseXesLog(filePath)
+	}
+	info, err := statXesLog(filePath)
+	if err != nil {
+		return nil, fmt.Errorf("failed to open xes file: %w", err)
+	}
+
+	logCacheMu.Lock()
+	if el, ok := logCacheMap[logHash]; ok {
+		entry := el.Value.(*logCacheEntry)
+		if os.SameFile(entry.info, info) && entry.info.ModTime().Equal(info.ModTime()) && entry.info.Size() == info.Size() {
+			logCacheLRU.MoveToFront(el)
+			logCacheMu.Unlock()
+			return entry.log, nil
+		}
+	}
+	if load, ok := logLoads[logHash]; ok {
+		logCacheMu.Unlock()
+		<-load.done
+		return load.log, load.err
+	}
+	load := &logLoad{done: make(chan struct{})}
+	logLoads[logHash] = load
+	logCacheMu.Unlock()
+
+	load.log, load.err = parseXesLog(filePath)
+
+	logCacheMu.Lock()
+	delete(logLoads, logHash)
+	if load.err == nil {
+		storeParsedLog(&logCacheEntry{hash: logHash, info: info, log: load.log})
+	}
+	logCacheMu.Unlock()
+	close(load.done)
+	return load.log, load.err
+}
+
+// Va chiamata con logCacheMu preso
+func storeParsedLog(entry *logCacheEntry) {
+	if el, ok := logCacheMap[entry.hash]; ok {
+		logCacheSize -= el.Value.(*logCacheEntry).log.size
+		logCacheLRU.Remove(el)
+		delete(logCacheMap, entry.hash)
+	}
+	if entry.log.size > LogCacheBudget {
+		// Più grande dell'intera cache: serve solo alle richieste in attesa
+		return
+	}
+	for logCacheSize+entry.log.size > LogCacheBudget {
+		oldest := logCacheLRU.Back()
+		old := oldest.Value.(*logCacheEntry)
+		logCacheLRU.Remove(oldest)
+		delete(logCacheMap, old.hash)
+		logCacheSize -= old.log.size
+	}
+	logCacheMap[entry.hash] = logCacheLRU.PushFront(entry)
+	logCacheSize += entry.log.size
+}
+
+// statXesLog segue la stessa scelta di OpenXesLog tra il log e la sua versione .gz
+func statXesLog(filePath string) (os.FileInfo, error) {
+	info, err := os.Stat(filePath)
+	if os.IsNotExist(err) && !strings.HasSuffix(filePath, ".gz") {
+		if gzInfo, gzErr := os.Stat(filePath + ".gz"); gzErr == nil {
+			return gzInfo, nil
+		}
+	}
+	return info, err
+}
+
+func parseXesLog(filePath string) (*ParsedLog, error) {
+	fmt.Println("[DEBUG] parsing del log:", filePath)
+	file, err := OpenXesLog(filePath)
+	if err != nil {
+		return nil, fmt.Errorf("failed to open xes file: %w", err)
+	}
+	defer file.Close()
+
+	log := &ParsedLog{}
+	err = forEachXesTrace(file, func(t int, dec *xml.Decoder, start *xml.StartElement) error {
+		var trace XesTrace
+		if err := dec.DecodeElement(&trace, start); err != nil {
+			return err
+		}
+		log.size += traceSize(&trace)
+		log.Traces = append(log.Traces, trace)
+		return nil
+	})
+	if err != nil {
+		return nil, fmt.Errorf("failed to parse xes xml: %w", err)
+	}
+	return log, nil
+}
+
+// Stima della memoria occupata da una traccia decodificata (intestazioni e contenuto
+// delle stringhe, slice di eventi e attributi)
+func traceSize(trace *XesTrace) int64 {
+	size := int64(48) + attributesSize(trace.Attributes)
+	for i := range trace.Events {
+		size += 48 + attributesSize(trace.Events[i].Strings) + attributesSize(trace.Events[i].Dates)
+	}
+	return size
+}
+
+func attributesSize(attrs []XesAttribute) int64 {
+	size := int64(32 * cap(attrs))
+	for _, a := range attrs {
+		size += int64(len(a.Key) + len(a.Value))
+	}
+	return size
+}
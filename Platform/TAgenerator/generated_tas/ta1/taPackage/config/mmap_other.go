@@ -0,0 +1,14 @@
+//go:build !linux && !darwin
+
+package config
+
+import "os"
+
+// mapFile senza mmap: lettura completa del file
+func mapFile(path string) ([]byte, func() error, error) {
+	data, err := os.ReadFile(path)
+	if err != nil {
+		return nil, nil, err
+	}
+	return data, func() error { return nil }, nil
+}
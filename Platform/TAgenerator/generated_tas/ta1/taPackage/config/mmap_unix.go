@@ -0,0 +1,37 @@
+//go:build linux || darwin
+
+package config
+
+import (
+	"os"
+	"syscall"
+)
+
+// mapFile mappa il file in sola lettura; se mmap non è disponibile (es. alcuni
+// filesystem host montati nell'enclave) ripiega sulla lettura completa.
+func mapFile(path string) ([]byte, func() error, error) {
+	f, err := os.Open(path)
+	if err != nil {
+		return nil, nil, err
+	}
+	defer f.Close()
+
+	info, err := f.Stat()
+	if err != nil {
+		return nil, nil, err
+	}
+	size := int(info.Size())
+	if size == 0 {
+		return []byte{}, func() error { return nil }, nil
+	}
+
+	data, err := syscall.Mmap(int(f.Fd()), 0, size, syscall.PROT_READ, syscall.MAP_SHARED)
+	if err != nil {
+		data, err = os.ReadFile(path)
+		if err != nil {
+			return nil, nil, err
+		}
+		return data, func() error { return nil }, nil
+	}
+	return data, func() error { return syscall.Munmap(data) }, nil
+}
@@ -7,6 +7,7 @@ import (
 	"fmt"
 	"os"
 	"path/filepath"
+	"sync"
 	"time"
 )
 
@@ -99,10 +100,36 @@ type Policies struct {
 	Policies []Policy `json:"policies"`
 }
 
-// LoadPolicy carica e deserializza la policy da configs/<config_id>/policy_config.json
+// Cache delle policy già decodificate, per percorso. Una voce resta valida finché il
+// file è lo stesso (inode) con la stessa mtime e dimensione: la piattaforma riscrive
+// policy_config.json con un rename atomico, quindi ogni nuova versione viene riletta.
+type policyCacheEntry struct {
+	info   os.FileInfo
+	policy *Policy
+}
+
+var (
+	policyCacheMu sync.RWMutex
+	policyCache   = map[string]policyCacheEntry{}
+)
+
+// LoadPolicy carica e deserializza la policy da configs/<config_id>/policy_config.json.
+// La policy restituita è condivisa tra le richieste e va trattata in sola lettura.
 func LoadPolicy(configDir string) (*Policy, error) {
 	policyPath := filepath.Join(configDir, "policy_config.json")
 
+	// Stat prima della lettura: se il file cambia nel mezzo la voce risulta già vecchia
+	info, err := os.Stat(policyPath)
+	if err != nil {
+		return nil, fmt.Errorf("failed to read policy_config.json: %w", err)
+	}
+	policyCacheMu.RLock()
+	entry, ok := policyCache[policyPath]
+	policyCacheMu.RUnlock()
+	if ok && os.SameFile(entry.info, info) && entry.info.ModTime().Equal(info.ModTime()) && entry.info.Size() == info.Size() {
+		return entry.policy, nil
+	}
+
 	file, err := os.ReadFile(policyPath)
 	if err != nil {
 		return nil, fmt.Errorf("failed to read policy_config.json: %w", err)
@@ -118,5 +145,9 @@ func LoadPolicy(configDir string) (*Policy, error) {
 	}
 
 	// Prendiamo la prima policy (modificabile in futuro)
-	return &policies.Policies[0], nil
+	policy := &policies.Policies[0]
+	policyCacheMu.Lock()
+	policyCache[policyPath] = policyCacheEntry{info: info, policy: policy}
+	policyCacheMu.Unlock()
+	return policy, nil
 }
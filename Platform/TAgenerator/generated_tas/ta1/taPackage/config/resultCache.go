@@ -0,0 +1,204 @@
+package config
+
+import (
+	"crypto/sha256"
+	"encoding/hex"
+	"encoding/json"
+	"fmt"
+	"io"
+	"os"
+	"path/filepath"
+	"sort"
+	"sync"
+	"time"
+)
+
+// Cache persistente dei risultati di /process: il mining è deterministico dato il log,
+// le logUsageRules e il codice dell'algoritmo, quindi il modello (e la sua firma) si
+// riusano finché nessuno di questi cambia. Ogni outputs/<configID>/<algoritmo>/cache/
+// contiene i modelli e un index.json chiave -> voce; la chiave è lo SHA-256 di log hash,
+// logUsageRules in forma canonica, algoritmo e hash del file dell'algoritmo, quindi un
+// input diverso non trova più la vecchia voce.
+
+// AlgorithmManifestPath è il manifest scritto dalla piattaforma alla generazione della TA
+var AlgorithmManifestPath = filepath.Join("algorithms", "algorithm_manifest.json")
+
+// Voci conservate per config e algoritmo (le più vecchie vengono rimosse)
+var ResultCacheEntries = 4
+
+type ResultCacheEntry struct {
+	File      string    `json:"file"`   // nome dell'output prodotto dall'algoritmo
+	Stored    string    `json:"stored"` // file dentro cache/
+	SHA256    string    `json:"sha256"`
+	Signature []byte    `json:"signature"`
+	Created   time.Time `json:"created"`
+}
+
+type algorithmManifestEntry struct {
+	Algorithm string `json:"algorithm"`
+	Hash      string `json:"hash"`
+}
+
+var (
+	resultCacheMu sync.Mutex
+
+	executableHashOnce sync.Once
+	executableHash     string
+)
+
+func getResultCacheDir(configID, algorithm string) string {
+	return filepath.Join("outputs", configID, algorithm, "cache")
+}
+
+// AlgorithmHash restituisce l'hash del file dell'algoritmo da algorithm_manifest.json. Le
+// TA senza manifest (algoritmi compilati nel binario) usano l'hash dell'eseguibile.
+func AlgorithmHash(algorithm string) (string, bool) {
+	data, err := os.ReadFile(AlgorithmManifestPath)
+	if os.IsNotExist(err) {
+		executableHashOnce.Do(func() {
+			executableHash, _ = hashExecutable()
+		})
+		return executableHash, executableHash != ""
+	}
+	if err != nil {
+		return "", false
+	}
+	var manifest []algorithmManifestEntry
+	if err := json.Unmarshal(data, &manifest); err != nil {
+		return "", false
+	}
+	for _, entry := range manifest {
+		if entry.Algorithm == algorithm && entry.Hash != "" {
+			return entry.Hash, true
+		}
+	}
+	return "", false
+}
+
+func hashExecutable() (string, error) {
+	path, err := os.Executable()
+	if err != nil {
+		return "", err
+	}
+	file, err := os.Open(path)
+	if err != nil {
+		return "", err
+	}
+	defer file.Close()
+	h := sha256.New()
+	if _, err := io.Copy(h, file); err != nil {
+		return "", err
+	}
+	return hex.EncodeToString(h.Sum(nil)), nil
+}
+
+// LogUsageRulesHash è lo SHA-256 delle logUsageRules in forma canonica: identifica la
+// versione delle regole anche quando due aggiornamenti cadono nello stesso secondo
+func LogUsageRulesHash(rules LogUsageRules) (string, error) {
+	canonicalRules, err := json.Marshal(rules)
+	if err != nil {
+		return "", err
+	}
+	rulesHash := sha256.Sum256(canonicalRules)
+	return hex.EncodeToString(rulesHash[:]), nil
+}
+
+// ResultCacheKey combina gli input da cui dipende il modello
+func ResultCacheKey(logHash string, rulesHash string, algorithm string, algorithmHash string) string {
+	key := sha256.Sum256([]byte(fmt.Sprintf("%s\x00%s\x00%s\x00%s", logHash, rulesHash, algorithm, algorithmHash)))
+	return hex.EncodeToString(key[:])
+}
+
+func readResultIndex(dir string) map[string]ResultCacheEntry {
+	index := map[string]ResultCacheEntry{}
+	data, err := os.ReadFile(filepath.Join(dir, "index.json"))
+	if err != nil {
+		return index
+	}
+	if err := json.Unmarshal(data, &index); err != nil {
+		return map[string]ResultCacheEntry{}
+	}
+	return index
+}
+
+// LookupResult restituisce il modello salvato per key, se presente e integro
+func LookupResult(configID, algorithm, key string) (*ResultCacheEntry, []byte, bool) {
+	dir := getResultCacheDir(configID, algorithm)
+	resultCacheMu.Lock()
+	entry, ok := readResultIndex(dir)[key]
+	resultCacheMu.Unlock()
+	if !ok {
+		return nil, nil, false
+	}
+	data, err := os.ReadFile(filepath.Join(dir, entry.Stored))
+	if err != nil {
+		return nil, nil, false
+	}
+	if sum := sha256.Sum256(data); hex.EncodeToString(sum[:]) != entry.SHA256 {
+		fmt.Println("[DEBUG] cache risultati: hash non corrispondente per", entry.Stored)
+		return nil, nil, false
+	}
+	return &entry, data, true
+}
+
+// StoreResult salva il modello e la sua firma e aggiorna l'indice
+func StoreResult(configID, algorithm, key, file string, data []byte, signature []byte) error {
+	dir := getResultCacheDir(configID, algorithm)
+	if err := os.MkdirAll(dir, os.ModePerm); err != nil {
+		return err
+	}
+	sum := sha256.Sum256(data)
+	entry := ResultCacheEntry{
+		File:      file,
+		Stored:    key + filepath.Ext(file),
+		SHA256:    hex.EncodeToString(sum[:]),
+		Signature: signature,
+		Created:   time.Now(),
+	}
+
+	resultCacheMu.Lock()
+	defer resultCacheMu.Unlock()
+
+	if err := writeFileAtomic(filepath.Join(dir, entry.Stored), data); err != nil {
+		return err
+	}
+	index := readResultIndex(dir)
+	index[key] = entry
+	if len(index) > ResultCacheEntries {
+		keys := make([]string, 0, len(index))
+		for k := range index {
+			keys = append(keys, k)
+		}
+		sort.Slice(keys, func(i, j int) bool { return index[keys[i]].Created.Before(index[keys[j]].Created) })
+		for _, k := range keys[:len(keys)-ResultCacheEntries] {
+			_ = os.Remove(filepath.Join(dir, index[k].Stored))
+			delete(index, k)
+		}
+	}
+	indexData, err := json.MarshalIndent(index, "", "  ")
+	if err != nil {
+		return err
+	}
+	return writeFileAtomic(filepath.Join(dir, "index.json"), indexData)
+}
+
+// writeFileAtomic scrive su un file temporaneo, fsync e rename
+func writeFileAtomic(path string, data []byte) error {
+	tmp := path + ".tmp"
+	f, err := os.OpenFile(tmp, os.O_WRONLY|os.O_CREATE|os.O_TRUNC, 0644)
+	if err != nil {
+		return err
+	}
+	if _, err := f.Write(data); err != nil {
+		f.Close()
+		return err
+	}
+	if err := f.Sync(); err != nil {
+		f.Close()
+		return err
+	}
+	if err := f.Close(); err != nil {
+		return err
+	}
+	return os.Rename(tmp, path)
+}
@@ -0,0 +1,220 @@
+package config
+
+import (
+	"bytes"
+	"encoding/hex"
+	"errors"
+	"fmt"
+	"math"
+	"path/filepath"
+	"sort"
+	"strings"
+	"time"
+)
+
+// Indice temporale per traccia prodotto dalla piattaforma all'ingestione
+// (data/<id>/artifacts/time_bounds.bin): minimo e massimo di time:timestamp di ogni
+// traccia, numero di eventi senza timestamp valido e timestamp ordinati con la posizione
+// dell'evento. allowedTimeRange viene deciso dai limiti per le tracce interamente dentro
+// o fuori dall'intervallo; per quelle a cavallo basta una ricerca binaria.
+
+const (
+	TimeIndexFileName   = "time_bounds.bin"
+	timeIndexMagic      = "PMTIMEIX"
+	timeIndexVersion    = 1
+	timeIndexHeader     = 128
+	timeIndexAttribute  = "time:timestamp"
+	timeIndexFlagUnsure = 1
+)
+
+type TimeIndex struct {
+	data    []byte
+	release func() error
+
+	NumTraces  int
+	NumTimed   int
+	SourceHash string
+
+	offMins, offMaxs, offUntimed, offFlags uint64
+	offSortedOffsets, offSortedTs          uint64
+	offSortedPos                           uint64
+}
+
+func OpenTimeIndex(path string, expectedHash string) (*TimeIndex, error) {
+	data, release, err := mapFile(path)
+	if err != nil {
+		return nil, err
+	}
+	x, err := parseTimeIndex(data, release)
+	if err != nil {
+		release()
+		return nil, fmt.Errorf("indice temporale non valido %s: %w", path, err)
+	}
+	if expectedHash != "" && x.SourceHash != expectedHash {
+		x.Close()
+		return nil, fmt.Errorf("indice temporale %s non corrisponde al log (%s)", path, expectedHash)
+	}
+	return x, nil
+}
+
+func parseTimeIndex(data []byte, release func() error) (*TimeIndex, error) {
+	if len(data) < timeIndexHeader || !bytes.Equal(data[:8], []byte(timeIndexMagic)) {
+		return nil, errors.New("magic errato")
+	}
+	if le.Uint32(data[8:]) != timeIndexVersion {
+		return nil, errors.New("versione non supportata")
+	}
+	size := uint64(len(data))
+	if le.Uint64(data[120:]) != size {
+		return nil, errors.New("dimensione del file inattesa")
+	}
+	numTraces := le.Uint64(data[16:])
+	numTimed := le.Uint64(data[24:])
+	if numTraces > size/8 || numTimed > size/8 {
+		return nil, errors.New("dimensioni incoerenti")
+	}
+	x := &TimeIndex{
+		data:             data,
+		release:          release,
+		NumTraces:        int(numTraces),
+		NumTimed:         int(numTimed),
+		SourceHash:       hex.EncodeToString(data[32:64]),
+		offMins:          le.Uint64(data[64:]),
+		offMaxs:          le.Uint64(data[72:]),
+		offUntimed:       le.Uint64(data[80:]),
+		offFlags:         le.Uint64(data[88:]),
+		offSortedOffsets: le.Uint64(data[96:]),
+		offSortedTs:      le.Uint64(data[104:]),
+		offSortedPos:     le.Uint64(data[112:]),
+	}
+	checks := []struct{ off, length uint64 }{
+		{x.offMins, 8 * numTraces},
+		{x.offMaxs, 8 * numTraces},
+		{x.offUntimed, 4 * numTraces},
+		{x.offFlags, 4 * numTraces},
+		{x.offSortedOffsets, 8 * (numTraces + 1)},
+		{x.offSortedTs, 8 * numTimed},
+		{x.offSortedPos, 4 * numTimed},
+	}
+	for _, chk := range checks {
+		if chk.off > size || chk.length > size-chk.off {
+			return nil, errors.New("sezione fuori dai limiti")
+		}
+	}
+	// Offset monotoni: da qui in poi gli accessi per indice non escono dal file
+	for t := 0; t < x.NumTraces; t++ {
+		if x.sortedOffset(t) > x.sortedOffset(t+1) {
+			return nil, errors.New("offset dei timestamp corrotti")
+		}
+	}
+	if x.sortedOffset(0) != 0 || x.sortedOffset(x.NumTraces) != numTimed {
+		return nil, errors.New("offset dei timestamp incoerenti")
+	}
+	return x, nil
+}
+
+func (x *TimeIndex) Close() error {
+	x.data = nil
+	if x.release != nil {
+		return x.release()
+	}
+	return nil
+}
+
+func (x *TimeIndex) sortedOffset(t int) uint64 {
+	return le.Uint64(x.data[x.offSortedOffsets+8*uint64(t):])
+}
+
+func (x *TimeIndex) sortedTs(i uint64) int64 {
+	return int64(le.Uint64(x.data[x.offSortedTs+8*i:]))
+}
+
+// TimeWindow è allowedTimeRange in ns Unix, inclusivo agli estremi come Before/After
+type TimeWindow struct {
+	Start, End int64
+}
+
+// NewTimeWindow converte l'intervallo della policy; gli estremi oltre il range di
+// UnixNano vengono portati al limite, dove non escludono nessun timestamp indicizzato.
+func NewTimeWindow(r TimeRange) TimeWindow {
+	return TimeWindow{Start: clampUnixNano(r.StartDate), End: clampUnixNano(r.EndDate)}
+}
+
+func clampUnixNano(t time.Time) int64 {
+	if t.Before(time.Unix(0, math.MinInt64)) {
+		return math.MinInt64
+	}
+	if t.After(time.Unix(0, math.MaxInt64)) {
+		return math.MaxInt64
+	}
+	return t.UnixNano()
+}
+
+// Esito della valutazione di una traccia rispetto all'intervallo
+const (
+	TraceTimeUnknown = iota // valutare evento per evento (time.Parse)
+	TraceTimeInside         // nessun evento scartato dal filtro temporale
+	TraceTimeOutside        // tutti gli eventi scartati: la traccia non sopravvive
+	TraceTimePartial        // usare la maschera di DroppedEvents
+)
+
+// Classify decide la traccia t dai soli limiti
+func (x *TimeIndex) Classify(t int, w TimeWindow) int {
+	if t >= x.NumTraces || le.Uint32(x.data[x.offFlags+4*uint64(t):])&timeIndexFlagUnsure != 0 {
+		return TraceTimeUnknown
+	}
+	lo, hi := x.sortedOffset(t), x.sortedOffset(t+1)
+	if lo == hi {
+		return TraceTimeInside
+	}
+	min := int64(le.Uint64(x.data[x.offMins+8*uint64(t):]))
+	max := int64(le.Uint64(x.data[x.offMaxs+8*uint64(t):]))
+	if min >= w.Start && max <= w.End {
+		return TraceTimeInside
+	}
+	if (max < w.Start || min > w.End) && le.Uint32(x.data[x.offUntimed+4*uint64(t):]) == 0 {
+		return TraceTimeOutside
+	}
+	return TraceTimePartial
+}
+
+// DroppedEvents restituisce, per una traccia di numEvents eventi, quali sono fuori
+// dall'intervallo: i timestamp ordinati prima di Start e dopo End, trovati con due
+// ricerche binarie. ok=false se la traccia non corrisponde all'indice.
+func (x *TimeIndex) DroppedEvents(t int, numEvents int, w TimeWindow) ([]bool, bool) {
+	lo, hi := x.sortedOffset(t), x.sortedOffset(t+1)
+	timed := int(hi - lo)
+	if timed+int(le.Uint32(x.data[x.offUntimed+4*uint64(t):])) != numEvents {
+		return nil, false
+	}
+	first := sort.Search(timed, func(i int) bool { return x.sortedTs(lo+uint64(i)) >= w.Start })
+	last := sort.Search(timed, func(i int) bool { return x.sortedTs(lo+uint64(i)) > w.End })
+	if last < first { // End prima di Start: tutti fuori
+		last = first
+	}
+	dropped := make([]bool, numEvents)
+	for _, r := range [2][2]int{{0, first}, {last, timed}} {
+		for i := r[0]; i < r[1]; i++ {
+			pos := int(le.Uint32(x.data[x.offSortedPos+4*(lo+uint64(i)):]))
+			if pos >= numEvents {
+				return nil, false
+			}
+			dropped[pos] = true
+		}
+	}
+	return dropped, true
+}
+
+// LoadTimeIndex apre l'indice temporale se è applicabile alle regole: il filtro deve
+// usare time:timestamp, l'attributo indicizzato. nil se manca o non è valido.
+func LoadTimeIndex(dataPath string, logHash string, rules LogUsageRules) *TimeIndex {
+	if strings.ToLower(rules.AllowedTimeRange.EventAttribute) != timeIndexAttribute {
+		return nil
+	}
+	x, err := OpenTimeIndex(filepath.Join(dataPath, "artifacts", TimeIndexFileName), logHash)
+	if err != nil {
+		fmt.Println("[DEBUG] LoadTimeIndex -> indice non disponibile:", err)
+		return nil
+	}
+	return x
+}
@@ -0,0 +1,68 @@
+package config
+
+import (
+	"encoding/json"
+	"fmt"
+	"os"
+	"path/filepath"
+	"strings"
+)
+
+// Varianti del log calcolate dalla piattaforma all'ingestione
+// (data/<id>/artifacts/variants.json): ogni sequenza di attività distinta compare
+// una volta sola con il numero di tracce che la seguono, così gli algoritmi lavorano
+// su len(varianti) sequenze invece che su tutte le tracce.
+
+const VariantsFileName = "variants.json"
+
+type TraceVariant struct {
+	Activities []string `json:"activities"`
+	Count      int      `json:"count"`
+	Cases      []string `json:"cases,omitempty"`
+}
+
+type variantsFile struct {
+	Version      int            `json:"version"`
+	SourceSHA256 string         `json:"source_sha256"`
+	Traces       int            `json:"traces"`
+	Variants     []TraceVariant `json:"variants"`
+}
+
+// LoadVariants legge le varianti della configurazione, verificando che siano state
+// calcolate dal log atteso. ok=false se il file manca o non è valido.
+func LoadVariants(dataPath string, logHash string) ([]TraceVariant, bool) {
+	path := filepath.Join(dataPath, "artifacts", VariantsFileName)
+	f, err := os.Open(path)
+	if err != nil {
+		fmt.Println("[DEBUG] LoadVariants -> artefatto non disponibile:", err)
+		return nil, false
+	}
+	defer f.Close()
+
+	var vf variantsFile
+	if err := json.NewDecoder(f).Decode(&vf); err != nil {
+		fmt.Println("[DEBUG] LoadVariants -> artefatto non valido:", err)
+		return nil, false
+	}
+	if vf.Version != 1 || (logHash != "" && vf.SourceSHA256 != logHash) {
+		fmt.Println("[DEBUG] LoadVariants -> artefatto non corrispondente al log", logHash)
+		return nil, false
+	}
+	return vf.Variants, true
+}
+
+// GroupVariants raggruppa una matrice eventi in varianti, nell'ordine di prima occorrenza
+func GroupVariants(eventMatrix [][]string) []TraceVariant {
+	index := make(map[string]int)
+	var variants []TraceVariant
+	for _, trace := range eventMatrix {
+		key := strings.Join(trace, "\x00")
+		if i, ok := index[key]; ok {
+			variants[i].Count++
+			continue
+		}
+		index[key] = len(variants)
+		variants = append(variants, TraceVariant{Activities: trace, Count: 1})
+	}
+	return variants
+}
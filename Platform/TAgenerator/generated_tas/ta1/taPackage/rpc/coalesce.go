@@ -0,0 +1,64 @@
+// taPackage/rpc/coalesce.go
+
+package rpc
+
+import (
+	"fmt"
+	"sync"
+	"time"
+)
+
+// Richieste /process identiche (stessa config, algoritmo, tecnica, log e logUsageRules)
+// che arrivano mentre un'esecuzione è in corso ne attendono il risultato invece
+// di rilanciare parsing e mining. Autorizzazione, audit e firma restano per richiesta.
+
+type processResult struct {
+	outputFilePath string
+	data           []byte
+	ran            bool // algoritmo eseguito (anche se poi la lettura dell'output è fallita)
+
+	errMsg   string // risposta 500 se non vuota
+	errAudit string // riga di audit dell'errore, se prevista
+
+	busy      bool          // coda dei worker piena, nulla è stato eseguito
+	queueWait time.Duration // attesa in coda prima dell'esecuzione
+}
+
+type processCall struct {
+	done chan struct{}
+	res  processResult
+}
+
+var (
+	processMu    sync.Mutex
+	processCalls = map[string]*processCall{}
+)
+
+func processKey(configID, algorithm, technique, logHash, rulesHash string) string {
+	return fmt.Sprintf("%s\x00%s\x00%s\x00%s\x00%s", configID, algorithm, technique, logHash, rulesHash)
+}
+
+// coalesceProcessing esegue run una sola volta per le richieste concorrenti con la stessa
+// chiave; shared indica che il risultato è arrivato da un'altra richiesta
+func coalesceProcessing(key string, run func() processResult) (res processResult, shared bool) {
+	processMu.Lock()
+	if call, ok := processCalls[key]; ok {
+		processMu.Unlock()
+		<-call.done
+		return call.res, true
+	}
+	call := &processCall{done: make(chan struct{})}
+	processCalls[key] = call
+	processMu.Unlock()
+
+	// Anche se run va in panic chi attende riceve una risposta
+	call.res = processResult{errMsg: "Errore esecuzione algoritmo: esecuzione interrotta"}
+	defer func() {
+		processMu.Lock()
+		delete(processCalls, key)
+		processMu.Unlock()
+		close(call.done)
+	}()
+	call.res = run()
+	return call.res, false
+}
@@ -6,6 +6,7 @@ import (
 	"crypto/sha256"
 	"encoding/base64"
 	"encoding/json"
+	"errors"
 	"fmt"
 	"runtime"
 	"runtime/debug"
@@ -16,6 +17,7 @@ import (
 	"net/http"
 	"os"
 	"path/filepath"
+	"strconv"
 	"ta1/taPackage/algorithms"
 	"ta1/taPackage/config"
 	"ta1/taPackage/enforcement"
@@ -91,17 +93,13 @@ func HandleLogAccess(w http.ResponseWriter, r *http.Request) {
 
 	fmt.Println("[DEBUG] Accesso log consentito")
 
-	if !config.CheckLogAccessLimit(payload.ConfigID, policy.LogUsageRules.MaxAccessCount) {
+	// Verifica del limite e incremento degli accessi log in un'unica operazione
+	if err := config.TryIncrementLogAccess(payload.ConfigID, policy.LogUsageRules.MaxAccessCount); errors.Is(err, config.ErrAccessLimit) {
 		fmt.Println("[DEBUG] Superato limite accessi log")
 		http.Error(w, "Superato limite accessi log", http.StatusForbidden)
 		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Superato limite accessi log")
 		return
-	}
-
-	fmt.Println("[DEBUG]  Limite accessi log non superato")
-
-	// Incrementa accessi log
-	if err := config.IncrementLogAccess(payload.ConfigID); err != nil {
+	} else if err != nil {
 		fmt.Println("[DEBUG] Errore incremento accessi log:", err)
 		http.Error(w, "Errore incremento accessi log", http.StatusInternalServerError)
 		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Errore incremento accessi log")
@@ -115,8 +113,10 @@ func HandleLogAccess(w http.ResponseWriter, r *http.Request) {
 
 	fmt.Println("[DEBUG]  Path file log:", logFilePath)
 
-	// Carica e filtra il log XES in base alle regole della policy
-	filteredLog, err := config.LoadAndFilterXesLog(logFilePath, policy.LogUsageRules)
+	// Filtra il log XES in base alle regole della policy: il log decodificato è condiviso
+	// (cache per hash del log) e gli indici generati all'ingestione scartano le tracce
+	// senza attività di mustInclude o fuori da allowedTimeRange
+	filteredLog, err := config.LoadAndFilterXesLogWithIndex(logFilePath, policy.LogUsageRules, mapping.DataPath, config.LogHashFromDedupKey(mapping.DedupKey))
 	if err != nil {
 		fmt.Println("[DEBUG] Errore caricamento o filtro log:", err)
 		http.Error(w, "Errore caricamento o filtro log", http.StatusInternalServerError)
@@ -165,7 +165,10 @@ func cleanMemory() {
 }
 
 func HandleProcessing(w http.ResponseWriter, r *http.Request) {
-	cleanMemory()
+	// Solo per le misure di RAM (-clean-memory): la pausa non deve pesare su ogni richiesta
+	if test.CLEANMEMORY {
+		cleanMemory()
+	}
 	test.STOPMONITORING = false
 	go test.PrintRamUsage()
 	if r.Method != http.MethodPost {
@@ -200,68 +203,61 @@ func HandleProcessing(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
-	// Costruisci i path input/output
-	inputPath := filepath.Join(mapping.DataPath, policy.LogFile)
-
-	// Timestamp per filename univoco
-	timestamp := fmt.Sprintf("%d", time.Now().Unix())
-
-	// Path output: output/<configID>/<algoritmo>/model_<timestamp>.json
-	outputDir := filepath.Join("outputs", payload.ConfigID, payload.Algorithm)
-	if err := os.MkdirAll(outputDir, os.ModePerm); err != nil {
-		http.Error(w, "Errore creazione cartella output", http.StatusInternalServerError)
-		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Errore creazione cartella output")
-		return
+	// Modello già calcolato con gli stessi log, logUsageRules e algoritmo: si restituisce
+	// con la firma salvata senza rieseguire il mining
+	logHash := config.LogHashFromDedupKey(mapping.DedupKey)
+	rulesHash, rulesErr := config.LogUsageRulesHash(policy.LogUsageRules)
+	cacheKey := ""
+	if algorithmHash, ok := config.AlgorithmHash(payload.Algorithm); ok && logHash != "" && rulesErr == nil {
+		cacheKey = config.ResultCacheKey(logHash, rulesHash, payload.Algorithm, algorithmHash)
 	}
-	outputFilename := fmt.Sprintf("model_%s.json", timestamp)
-	outputPath := filepath.Join(outputDir, outputFilename)
-
-	// Solo se serve, crea la matrice eventi
-	var eventMatrix [][]string
-	if payload.Algorithm == "HeuristicMiner" {
-		//filteredLog, err := config.LoadAndFilterXesLog(inputPath, policy.LogUsageRules)
-		filteredLog, err := config.LoadFullXesLog(inputPath)
-		if err != nil {
-			http.Error(w, "Errore filtro log: "+err.Error(), http.StatusInternalServerError)
+	if cacheKey != "" {
+		if entry, _, ok := config.LookupResult(payload.ConfigID, payload.Algorithm, cacheKey); ok && (!test.TEE || len(entry.Signature) > 0) {
+			_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Output restituito dalla cache: "+entry.File)
+			writeProcessingResponse(w, payload.Algorithm, entry.Signature)
 			return
 		}
-		for _, trace := range filteredLog.Traces {
-			var eventSeq []string
-			for _, event := range trace.Events {
-				name := config.GetAttributeValue(event.Attributes, "concept:name")
-				if name != "" {
-					eventSeq = append(eventSeq, name)
-				}
-			}
-			if len(eventSeq) > 0 {
-				eventMatrix = append(eventMatrix, eventSeq)
-			}
-		}
 	}
 
-	// Chiamata centralizzata
-	outputF, err := algorithms.RunAlgorithm(payload.Algorithm, inputPath, outputPath, eventMatrix, payload.ConfigID)
-	if err != nil {
-		http.Error(w, "Errore esecuzione algoritmo: "+err.Error(), http.StatusInternalServerError)
+	// Parsing e mining sono condivisi tra le richieste identiche concorrenti; ognuna
+	// registra comunque il proprio audit e firma la propria risposta
+	run := func() processResult {
+		res, wait, busy := submitProcessing(func() processResult {
+			return runProcessing(payload, mapping, policy, logHash)
+		})
+		res.busy, res.queueWait = busy, wait
+		return res
+	}
+	var res processResult
+	shared := false
+	if rulesErr == nil {
+		res, shared = coalesceProcessing(processKey(payload.ConfigID, payload.Algorithm, payload.Technique, logHash, rulesHash), run)
+	} else {
+		res = run()
+	}
+	if shared {
+		fmt.Println("[DEBUG] /process: risultato condiviso per", payload.ConfigID, payload.Algorithm)
+	}
+	if res.busy {
+		writeProcessBusy(w)
+		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Processing rifiutato: coda piena")
 		return
 	}
+	w.Header().Set("X-Queue-Wait-Ms", strconv.FormatInt(res.queueWait.Milliseconds(), 10))
 
-	_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, fmt.Sprintf("Processing eseguito con algoritmo %s", payload.Algorithm))
-
-	//Calculate output Report
-	// Leggi e restituisci il contenuto del file
-	outputFilePath := outputDir + "/" + outputF
-	fmt.Println(outputFilePath)
-
-	data, err := os.ReadFile(outputFilePath)
-	if err != nil {
-		http.Error(w, "Errore lettura file di output", http.StatusInternalServerError)
-		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Errore lettura file di output")
+	if res.ran {
+		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, fmt.Sprintf("Processing eseguito con algoritmo %s", payload.Algorithm))
+	}
+	if res.errMsg != "" {
+		http.Error(w, res.errMsg, http.StatusInternalServerError)
+		if res.errAudit != "" {
+			_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, res.errAudit)
+		}
 		return
 	}
+	data := res.data
 
-	_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Output restituito: "+filepath.Base(outputFilePath))
-
+	_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Output restituito: "+filepath.Base(res.outputFilePath))
 	var teeSignedLog []byte
 	filteredByteArrayhash := sha256.Sum256(data)
 	if !test.TEE {
@@ -275,12 +271,22 @@ func HandleProcessing(w http.ResponseWriter, r *http.Request) {
 		}
 	}
 
+	if cacheKey != "" && !shared {
+		if err := config.StoreResult(payload.ConfigID, payload.Algorithm, cacheKey, filepath.Base(res.outputFilePath), data, teeSignedLog); err != nil {
+			fmt.Println("[DEBUG] Errore salvataggio cache risultati:", err)
+		}
+	}
+
+	writeProcessingResponse(w, payload.Algorithm, teeSignedLog)
+}
+
+func writeProcessingResponse(w http.ResponseWriter, algorithm string, teeSignedLog []byte) {
 	encodedTeeSignedOutput := base64.StdEncoding.EncodeToString(teeSignedLog)
 	//encodedOutput := base64.StdEncoding.EncodeToString(data)
 
 	//Rispondi alla richiesta con il file di ouput e encodedTeeSignedOutput
 	response := map[string]string{
-		"message":          fmt.Sprintf("Processing eseguito con algoritmo %s", payload.Algorithm),
+		"message":          fmt.Sprintf("Processing eseguito con algoritmo %s", algorithm),
 		"output_signature": encodedTeeSignedOutput,
 	}
 	test.STOPMONITORING = true
@@ -291,6 +297,77 @@ func HandleProcessing(w http.ResponseWriter, r *http.Request) {
 	}
 }
 
+// runProcessing esegue la parte costosa di /process (matrici e algoritmo) e legge
+// l'output prodotto
+func runProcessing(payload RequestPayload, mapping config.Mapping, policy *config.Policy, logHash string) processResult {
+	// Costruisci i path input/output
+	inputPath := filepath.Join(mapping.DataPath, policy.LogFile)
+
+	// Timestamp per filename univoco
+	timestamp := fmt.Sprintf("%d", time.Now().Unix())
+
+	// Path output: output/<configID>/<algoritmo>/model_<timestamp>.json
+	outputDir := filepath.Join("outputs", payload.ConfigID, payload.Algorithm)
+	if err := os.MkdirAll(outputDir, os.ModePerm); err != nil {
+		return processResult{errMsg: "Errore creazione cartella output", errAudit: "Errore creazione cartella output"}
+	}
+	outputFilename := fmt.Sprintf("model_%s.json", timestamp)
+	outputPath := filepath.Join(outputDir, outputFilename)
+
+	// Solo se serve, carica le matrici di conteggio generate all'ingestione; se mancano le
+	// calcola dalle varianti (artefatto delle varianti, poi colonnare, poi parsing dell'XES)
+	var matrices *config.FollowsMatrices
+	if algorithms.IsSupported(payload.Algorithm) {
+		var variants []config.TraceVariant
+		if m, ok := config.LoadFollowsMatrices(mapping.DataPath, logHash); ok {
+			matrices = m
+		} else if v, ok := config.LoadVariants(mapping.DataPath, logHash); ok {
+			variants = v
+		} else if matrix, ok := config.LoadEventMatrix(mapping.DataPath, logHash); ok {
+			variants = config.GroupVariants(matrix)
+		} else {
+			//filteredLog, err := config.LoadAndFilterXesLog(inputPath, policy.LogUsageRules)
+			filteredLog, err := config.LoadFullXesLog(inputPath, logHash)
+			if err != nil {
+				return processResult{errMsg: "Errore filtro log: " + err.Error()}
+			}
+			var eventMatrix [][]string
+			for _, trace := range filteredLog.Traces {
+				var eventSeq []string
+				for _, event := range trace.Events {
+					name := config.GetAttributeValue(event.Attributes, "concept:name")
+					if name != "" {
+						eventSeq = append(eventSeq, name)
+					}
+				}
+				if len(eventSeq) > 0 {
+					eventMatrix = append(eventMatrix, eventSeq)
+				}
+			}
+			variants = config.GroupVariants(eventMatrix)
+		}
+		if matrices == nil {
+			matrices = config.BuildFollowsMatrices(variants, config.LongDistance)
+		}
+	}
+
+	// Chiamata centralizzata
+	outputF, err := algorithms.RunAlgorithm(payload.Algorithm, inputPath, outputPath, matrices, payload.ConfigID)
+	if err != nil {
+		return processResult{errMsg: "Errore esecuzione algoritmo: " + err.Error()}
+	}
+
+	//Calculate output Report
+	// Leggi e restituisci il contenuto del file
+	outputFilePath := outputDir + "/" + outputF
+	fmt.Println(outputFilePath)
+
+	data, err := os.ReadFile(outputFilePath)
+	if err != nil {
+		return processResult{outputFilePath: outputFilePath, ran: true, errMsg: "Errore lettura file di output", errAudit: "Errore lettura file di output"}
+	}
+	return processResult{outputFilePath: outputFilePath, data: data, ran: true}
+}
 func HandleOutputAccess(w http.ResponseWriter, r *http.Request) {
 	if r.Method != http.MethodPost {
 		http.Error(w, "Metodo non consentito", http.StatusMethodNotAllowed)
@@ -325,14 +402,16 @@ func HandleOutputAccess(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
-	if !config.CheckOutputAccessLimit(payload.ConfigID, policy.OutputRules.MaxAccessCount) {
+	if err := config.TryIncrementOutputAccess(payload.ConfigID, policy.OutputRules.MaxAccessCount); errors.Is(err, config.ErrAccessLimit) {
 		http.Error(w, "Superato limite accessi output", http.StatusForbidden)
 		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Superato limite accessi output")
 		return
+	} else if err != nil {
+		http.Error(w, "Errore incremento accessi output", http.StatusInternalServerError)
+		_ = config.WriteAuditLogFromRequest(payload.ConfigID, r, "Errore incremento accessi output")
+		return
 	}
 
-	_ = config.IncrementOutputAccess(payload.ConfigID)
-
 	// Path alla cartella output dell’algoritmo
 	outputDir := filepath.Join("outputs", payload.ConfigID, payload.Algorithm)
 
@@ -443,6 +522,10 @@ func HandleMonitoring(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
+	// Le righe ancora in coda vengono scritte prima della lettura
+	if err := config.FlushAuditLog(configID); err != nil {
+		fmt.Println("[DEBUG] flush audit fallito:", err)
+	}
 	auditPath := filepath.Join("configs", configID, "audit.txt")
 	data, err := os.ReadFile(auditPath)
 	if err != nil {
@@ -0,0 +1,175 @@
+// taPackage/rpc/workerPool.go
+
+package rpc
+
+import (
+	"encoding/json"
+	"fmt"
+	"net/http"
+	"runtime"
+	"strconv"
+	"sync"
+	"time"
+)
+
+// Il mining di /process gira su un numero fisso di worker con una coda limitata: oltre la
+// coda la richiesta riceve 429 con Retry-After invece di contendersi CPU e heap
+// dell'enclave con tutte le altre. Valori impostati da main prima di servire richieste.
+var (
+	ProcessWorkers   = runtime.NumCPU()
+	ProcessQueueSize = 32
+)
+
+type processJob struct {
+	run      func() processResult
+	res      processResult
+	enqueued time.Time
+	wait     time.Duration
+	done     chan struct{}
+}
+
+type processPoolStats struct {
+	Workers       int     `json:"workers"`
+	QueueCapacity int     `json:"queue_capacity"`
+	Queued        int     `json:"queued"`
+	Running       int     `json:"running"`
+	Completed     int64   `json:"completed"`
+	Rejected      int64   `json:"rejected"`
+	AvgWaitMs     float64 `json:"avg_wait_ms"`
+	MaxWaitMs     float64 `json:"max_wait_ms"`
+	AvgRunMs      float64 `json:"avg_run_ms"`
+}
+
+var (
+	processPoolOnce sync.Once
+	processJobs     chan *processJob
+
+	processStatsMu sync.Mutex
+	processWorkerN int
+	processQueueN  int
+	processPending int // in coda o in esecuzione
+	processRunning int
+	processDone    int64
+	processReject  int64
+	processWaitSum time.Duration
+	processWaitMax time.Duration
+	processRunSum  time.Duration
+)
+
+func startProcessPool() {
+	workers := ProcessWorkers
+	if workers < 1 {
+		workers = 1
+	}
+	queue := ProcessQueueSize
+	if queue < 0 {
+		queue = 0
+	}
+	processWorkerN, processQueueN = workers, queue
+	// Il canale contiene tutte le richieste ammesse, quindi l'invio non blocca mai
+	processJobs = make(chan *processJob, workers+queue)
+	for i := 0; i < workers; i++ {
+		go processWorker()
+	}
+	fmt.Printf("[DEBUG] pool /process: %d worker, coda %d\n", workers, queue)
+}
+
+func processWorker() {
+	for job := range processJobs {
+		job.wait = time.Since(job.enqueued)
+		processStatsMu.Lock()
+		processRunning++
+		processStatsMu.Unlock()
+
+		start := time.Now()
+		runProcessJob(job)
+		elapsed := time.Since(start)
+
+		processStatsMu.Lock()
+		processRunning--
+		processPending--
+		processDone++
+		processWaitSum += job.wait
+		if job.wait > processWaitMax {
+			processWaitMax = job.wait
+		}
+		processRunSum += elapsed
+		processStatsMu.Unlock()
+		close(job.done)
+	}
+}
+
+// Un panic dell'algoritmo non deve fermare il worker (né la TA)
+func runProcessJob(job *processJob) {
+	defer func() {
+		if rec := recover(); rec != nil {
+			fmt.Println("[DEBUG] panic durante il processing:", rec)
+			job.res = processResult{errMsg: fmt.Sprintf("Errore esecuzione algoritmo: %v", rec)}
+		}
+	}()
+	job.res = job.run()
+}
+
+// submitProcessing accoda run e ne attende il risultato; busy indica che la coda è piena
+// e run non è stata eseguita
+func submitProcessing(run func() processResult) (res processResult, wait time.Duration, busy bool) {
+	processPoolOnce.Do(startProcessPool)
+	processStatsMu.Lock()
+	if processPending >= processWorkerN+processQueueN {
+		processReject++
+		processStatsMu.Unlock()
+		return processResult{}, 0, true
+	}
+	processPending++
+	processStatsMu.Unlock()
+
+	job := &processJob{run: run, enqueued: time.Now(), done: make(chan struct{})}
+	processJobs <- job
+	<-job.done
+	return job.res, job.wait, false
+}
+
+func getProcessPoolStats() processPoolStats {
+	processPoolOnce.Do(startProcessPool)
+	processStatsMu.Lock()
+	defer processStatsMu.Unlock()
+	stats := processPoolStats{
+		Workers:       processWorkerN,
+		QueueCapacity: processQueueN,
+		Queued:        processPending - processRunning,
+		Running:       processRunning,
+		Completed:     processDone,
+		Rejected:      processReject,
+		MaxWaitMs:     float64(processWaitMax) / float64(time.Millisecond),
+	}
+	if processDone > 0 {
+		stats.AvgWaitMs = float64(processWaitSum) / float64(processDone) / float64(time.Millisecond)
+		stats.AvgRunMs = float64(processRunSum) / float64(processDone) / float64(time.Millisecond)
+	}
+	return stats
+}
+
+// processRetryAfter stima in secondi quando si libererà un posto in coda
+func processRetryAfter() int {
+	stats := getProcessPoolStats()
+	seconds := int(stats.AvgRunMs*float64(stats.Queued/stats.Workers+1)/1000) + 1
+	if seconds > 60 {
+		seconds = 60
+	}
+	return seconds
+}
+
+func writeProcessBusy(w http.ResponseWriter) {
+	w.Header().Set("Retry-After", strconv.Itoa(processRetryAfter()))
+	http.Error(w, "Troppe richieste di processing in coda, riprovare più tardi", http.StatusTooManyRequests)
+}
+
+// HandleProcessQueue riporta lo stato del pool di /process (profondità della coda e attese)
+func HandleProcessQueue(w http.ResponseWriter, r *http.Request) {
+	if r.Method != http.MethodGet {
+		http.Error(w, "Metodo non consentito", http.StatusMethodNotAllowed)
+		return
+	}
+	w.Header().Set("Content-Type", "application/json")
+	json.NewEncoder(w).Encode(getProcessPoolStats())
+}
@@ -13,6 +13,9 @@ import (
 var STOPMONITORING = false
 var TEE = true
 
+// GC, FreeOSMemory e pausa di 3s prima di ogni /process, per partire da una RAM pulita
+var CLEANMEMORY = false
+
 func PrintRamUsage() {
 	var ramList = []int{}
 	var timestampList = []int{}
@@ -24,6 +27,10 @@ func PrintRamUsage() {
 		//change ms for more pints
 		time.Sleep(10 * time.Millisecond)
 	}
+	// Richiesta terminata prima del primo campione (es. risultato dalla cache)
+	if len(ramList) == 0 {
+		return
+	}
 	// Save RAM usage and timestamp to CSV file
 	err := saveToCSV(ramList, timestampList)
 	if err != nil {
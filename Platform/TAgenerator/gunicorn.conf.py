@@ -0,0 +1,7 @@
+# Configurazione di gunicorn, letta automaticamente se avviato da questa directory:
+#   gunicorn -w 8 -b 127.0.0.1:5000 app:app
+
+
+def post_worker_init(worker):
+    from app import start_platform
+    start_platform()
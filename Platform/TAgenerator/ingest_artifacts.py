@@ -0,0 +1,601 @@
+import calendar
+import gzip
+import json
+import os
+import re
+import struct
+import tempfile
+from array import array
+from datetime import datetime
+from pathlib import Path
+import xml.etree.ElementTree as ET
+
+try:
+    import numpy as np
+except ImportError:  # senza NumPy le matrici non vengono generate (il TA le calcola dalle varianti)
+    np = None
+
+# Artefatti derivati dal log, calcolati una volta sola all'ingestione (per SHA-256 del log)
+# e letti dal TA al posto del parsing XML a ogni richiesta.
+# Il log viene letto in streaming (iterparse), con la stessa semantica del decoder Go dei TA:
+# tracce figlie dirette della radice, eventi figli diretti della traccia, attributi
+# <string>/<date> figli diretti (namespace ignorati).
+
+GZIP_MAGIC = b"\x1f\x8b"
+INGEST_ENABLED = os.environ.get("PROMISE_INGEST_ARTIFACTS", "1") != "0"
+
+# ---------------------------------------------------------------------------
+# Formato colonnare (events.pcol), little-endian, sezioni allineate a 8 byte:
+#   header (128 byte)
+#     0   magic "PMCOLUMN"
+#     8   u32 versione, u32 numero colonne attributo
+#     16  u64 tracce, u64 eventi, u64 stringhe
+#     40  [32]byte SHA-256 del log sorgente
+#     72  u64 offset: offset stringhe, dati stringhe, offset tracce, attività,
+#         timestamp, descrittori colonne
+#     120 u64 dimensione del file
+#   dizionario: u64[stringhe+1] offset nel blob UTF-8, seguito dal blob
+#   offset tracce: u64[tracce+1] (indice del primo evento di ogni traccia)
+#   attività: u32[eventi] id della stringa concept:name dell'evento (NONE se assente)
+#   timestamp: i64[eventi] time:timestamp in nanosecondi Unix (MIN_INT64 se assente o non RFC3339)
+#   descrittori colonne: (u32 scope, u32 tipo, u32 id chiave, u32 riservato, u64 offset valori)
+#     scope 0 = evento (u32[eventi]), 1 = traccia (u32[tracce]); tipo 0 = string, 1 = date
+# ---------------------------------------------------------------------------
+
+COLUMNAR_FILE = "events.pcol"
+COLUMNAR_MAGIC = b"PMCOLUMN"
+COLUMNAR_VERSION = 1
+HEADER_FMT = "<8sIIQQQ32sQQQQQQQ"
+HEADER_SIZE = 128
+NONE_ID = 0xFFFFFFFF
+MISSING_TS = -(1 << 63)
+
+SCOPE_EVENT, SCOPE_TRACE = 0, 1
+KIND_STRING, KIND_DATE = 0, 1
+
+# time.RFC3339 di Go: frazione di secondo opzionale ('.' o ','), offset Z o ±hh:mm
+RFC3339_RE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?(?:(Z)|([+-])(\d{2}):(\d{2}))\Z"
+)
+
+
+# Ritorna i nanosecondi Unix, None se time.Parse(time.RFC3339) di Go rifiuterebbe il valore,
+# OverflowError se Go lo accetta ma non è rappresentabile in int64 (anno 0, anni fuori da
+# ~1678-2262)
+def rfc3339_ns(value):
+    m = RFC3339_RE.match(value)
+    if m is None:
+        return None
+    year, month, day, hour, minute, second = (int(g) for g in m.group(1, 2, 3, 4, 5, 6))
+    if year == 0:
+        raise OverflowError(value)
+    try:
+        datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return None
+    frac = m.group(7) or ""
+    nanos = int((frac[:9]).ljust(9, "0")) if frac else 0
+    offset = 0
+    if not m.group(8):
+        # Come Go: l'offset non viene validato (anche +25:00 è accettato)
+        offset = (int(m.group(10)) * 3600 + int(m.group(11)) * 60) * (1 if m.group(9) == "+" else -1)
+    seconds = calendar.timegm((year, month, day, hour, minute, second)) - offset
+    ns = seconds * 1_000_000_000 + nanos
+    if not MISSING_TS < ns < (1 << 63):
+        raise OverflowError(value)
+    return ns
+
+
+def parse_rfc3339_ns(value):
+    try:
+        return rfc3339_ns(value)
+    except OverflowError:
+        return None
+
+
+def open_log(path):
+    with open(path, "rb") as f:
+        compressed = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+# Ritorna, per ogni traccia: (attributi string della traccia, [(strings, dates) per evento]),
+# dove strings/dates sono liste di coppie (chiave, valore) nell'ordine del documento.
+def iter_traces(log_path):
+    with open_log(log_path) as f:
+        depth = 0
+        root = None
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = elem
+                continue
+            depth -= 1
+            if depth != 1 or local_name(elem.tag) != "trace":
+                continue
+            trace_attrs = []
+            events = []
+            for child in elem:
+                tag = local_name(child.tag)
+                if tag == "string":
+                    trace_attrs.append((child.get("key", ""), child.get("value", "")))
+                elif tag == "event":
+                    strings, dates = [], []
+                    for attr in child:
+                        attr_tag = local_name(attr.tag)
+                        if attr_tag == "string":
+                            strings.append((attr.get("key", ""), attr.get("value", "")))
+                        elif attr_tag == "date":
+                            dates.append((attr.get("key", ""), attr.get("value", "")))
+                    events.append((strings, dates))
+            yield trace_attrs, events
+            # Libera la traccia già elaborata: la memoria resta proporzionale a una traccia
+            elem.clear()
+            if root is not None:
+                root.clear()
+
+
+def activity_of(strings, dates):
+    # Come config.GetAttributeValue su append(Strings, Dates...): prima occorrenza,
+    # chiave confrontata senza distinzione tra maiuscole e minuscole
+    for key, value in strings:
+        if key.lower() == "concept:name":
+            return value
+    for key, value in dates:
+        if key.lower() == "concept:name":
+            return value
+    return None
+
+
+def timestamp_of(dates):
+    for key, value in dates:
+        if key == "time:timestamp":
+            return parse_rfc3339_ns(value)
+    return None
+
+
+class ColumnarBuilder:
+
+    def __init__(self):
+        self.string_ids = {}
+        self.strings = []
+        self.trace_offsets = array("Q", [0])
+        self.activity = array("I")
+        self.timestamps = array("q")
+        self.event_columns = {}
+        self.trace_columns = {}
+        self.num_traces = 0
+
+    def intern(self, value):
+        sid = self.string_ids.get(value)
+        if sid is None:
+            sid = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return sid
+
+    def _fill(self, columns, values, size):
+        for column_key, column in columns.items():
+            column.append(values.pop(column_key, NONE_ID))
+        for column_key, value_id in values.items():
+            column = columns[column_key] = array("I", [NONE_ID]) * size
+            column.append(value_id)
+
+    def add_trace(self, trace_attrs, events):
+        trace_values = {}
+        for key, value in trace_attrs:
+            trace_values.setdefault((KIND_STRING, key), self.intern(value))
+        self._fill(self.trace_columns, trace_values, self.num_traces)
+        self.num_traces += 1
+
+        for strings, dates in events:
+            activity = activity_of(strings, dates)
+            self.activity.append(NONE_ID if activity is None else self.intern(activity))
+            ts = timestamp_of(dates)
+            self.timestamps.append(MISSING_TS if ts is None else ts)
+
+            values = {}
+            for key, value in strings:
+                if key != "concept:name":
+                    values.setdefault((KIND_STRING, key), self.intern(value))
+            for key, value in dates:
+                if key != "time:timestamp":
+                    values.setdefault((KIND_DATE, key), self.intern(value))
+            self._fill(self.event_columns, values, len(self.activity) - 1)
+        self.trace_offsets.append(len(self.activity))
+
+    def write(self, path, source_hash):
+        encoded = [s.encode("utf-8") for s in self.strings]
+        string_offsets = array("Q", [0])
+        for data in encoded:
+            string_offsets.append(string_offsets[-1] + len(data))
+        columns = (
+            [(SCOPE_EVENT, kind, key, values) for (kind, key), values in self.event_columns.items()]
+            + [(SCOPE_TRACE, kind, key, values) for (kind, key), values in self.trace_columns.items()]
+        )
+        key_ids = [self.intern(key) for _, _, key, _ in columns]
+        # intern() può aver aggiunto chiavi nuove al dizionario
+        for data in self.strings[len(encoded):]:
+            encoded.append(data.encode("utf-8"))
+            string_offsets.append(string_offsets[-1] + len(encoded[-1]))
+
+        sections = []
+        offset = HEADER_SIZE
+
+        def place(payload):
+            nonlocal offset
+            start = offset
+            pad = (-len(payload)) % 8
+            sections.append(payload + b"\0" * pad)
+            offset += len(payload) + pad
+            return start
+
+        off_string_offsets = place(string_offsets.tobytes())
+        off_string_data = place(b"".join(encoded))
+        off_trace_offsets = place(self.trace_offsets.tobytes())
+        off_activity = place(self.activity.tobytes())
+        off_timestamps = place(self.timestamps.tobytes())
+        descriptors_size = 24 * len(columns)
+        off_columns = offset
+        offset += descriptors_size
+        column_offsets = []
+        for _, _, _, values in columns:
+            column_offsets.append(offset)
+            payload = values.tobytes()
+            offset += len(payload) + ((-len(payload)) % 8)
+        descriptors = b"".join(
+            struct.pack("<IIIIQ", scope, kind, key_id, 0, column_offset)
+            for (scope, kind, _, _), key_id, column_offset in zip(columns, key_ids, column_offsets)
+        )
+        header = struct.pack(
+            HEADER_FMT, COLUMNAR_MAGIC, COLUMNAR_VERSION, len(columns),
+            self.num_traces, len(self.activity), len(self.strings), bytes.fromhex(source_hash),
+            off_string_offsets, off_string_data, off_trace_offsets, off_activity, off_timestamps,
+            off_columns, offset
+        )
+        assert len(header) == HEADER_SIZE
+
+        with open(path, "wb") as out:
+            out.write(header)
+            for section in sections:
+                out.write(section)
+            out.write(descriptors)
+            for _, _, _, values in columns:
+                payload = values.tobytes()
+                out.write(payload + b"\0" * ((-len(payload)) % 8))
+
+
+# ---------------------------------------------------------------------------
+# Varianti (variants.json): sequenze di attività distinte con il numero di tracce che
+# le seguono e alcuni case id rappresentativi (concept:name della traccia), nell'ordine
+# di prima occorrenza. Stessa semantica della matrice eventi del TA: eventi senza
+# concept:name e tracce vuote esclusi.
+# ---------------------------------------------------------------------------
+
+VARIANTS_FILE = "variants.json"
+VARIANTS_VERSION = 1
+MAX_VARIANT_CASES = 5
+
+# ---------------------------------------------------------------------------
+# Matrici di conteggio (follows.npy + follows.json), calcolate dalle varianti pesate:
+#   follows.npy: int64 di forma (3, n, n) in formato .npy, con n = numero di attività
+#     [0] directly-follows: a seguita immediatamente da b
+#     [1] loop di lunghezza 2: occorrenze del pattern a b a
+#     [2] dipendenze a distanza LONG_DISTANCE (longDistance di HeuristicMiner)
+#   follows.json: indice delle attività (ordine di prima occorrenza, lo stesso con cui
+#     HeuristicMiner numera gli eventi) e SHA-256 del log sorgente
+# ---------------------------------------------------------------------------
+
+FOLLOWS_MATRIX_FILE = "follows.npy"
+FOLLOWS_INDEX_FILE = "follows.json"
+FOLLOWS_VERSION = 1
+FOLLOWS_LAYERS = ("directly_follows", "length2_loops", "long_distance")
+LONG_DISTANCE = 2
+
+
+class FollowsMatrices:
+
+    def __init__(self, variants):
+        self.variants = variants
+        self.activities = []
+        self.matrices = None
+
+    def compute(self):
+        index = {}
+        ids, variant_ids, weights = [], [], []
+        for v, variant in enumerate(self.variants.variants.values()):
+            for activity in variant["activities"]:
+                if activity not in index:
+                    index[activity] = len(self.activities)
+                    self.activities.append(activity)
+                ids.append(index[activity])
+            variant_ids.extend([v] * len(variant["activities"]))
+            weights.extend([variant["count"]] * len(variant["activities"]))
+        n = len(self.activities)
+        ids = np.asarray(ids, dtype=np.int64)
+        variant_ids = np.asarray(variant_ids, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.int64)
+
+        def count(src, dst, mask):
+            flat = np.bincount(src[mask] * n + dst[mask], weights=weights[:len(mask)][mask], minlength=n * n)
+            return flat.astype(np.int64).reshape(n, n)
+
+        def same_variant(k):
+            return variant_ids[:-k] == variant_ids[k:] if len(ids) > k else np.zeros(0, dtype=bool)
+
+        self.matrices = np.zeros((len(FOLLOWS_LAYERS), n, n), dtype=np.int64)
+        if n == 0:
+            return self
+        same = same_variant(1)
+        self.matrices[0] = count(ids[:-1], ids[1:], same)
+        same = same_variant(2)
+        self.matrices[1] = count(ids[:-2], ids[1:-1], same & (ids[:-2] == ids[2:]))
+        same = same_variant(LONG_DISTANCE)
+        self.matrices[2] = count(ids[:-LONG_DISTANCE], ids[LONG_DISTANCE:], same)
+        return self
+
+    def write_matrices(self, path, source_hash):
+        with open(path, "wb") as out:
+            np.save(out, np.ascontiguousarray(self.matrices, dtype="<i8"))
+
+    def write_index(self, path, source_hash):
+        payload = {
+            "version": FOLLOWS_VERSION,
+            "source_sha256": source_hash,
+            "activities": self.activities,
+            "layers": list(FOLLOWS_LAYERS),
+            "long_distance": LONG_DISTANCE
+        }
+        with open(path, "w", encoding="utf-8") as out:
+            json.dump(payload, out, ensure_ascii=False, separators=(",", ":"))
+
+
+# ---------------------------------------------------------------------------
+# Indice invertito attività -> tracce (activity_bitmaps.bin), per selezionare le tracce
+# di semanticLogConstraints (mustInclude/mustExclude) con operazioni OR/ANDNOT su bitmap
+# invece di scorrere tutti gli eventi. Little-endian, sezioni allineate a 8 byte:
+#   header (104 byte)
+#     0   magic "PMBITMAP"
+#     8   u32 versione, u32 flag (FLAG_AMBIGUOUS)
+#     16  u64 attività, u64 tracce, u64 parole da 64 bit per bitmap
+#     40  [32]byte SHA-256 del log sorgente
+#     72  u64 offset: offset nomi, dati nomi, bitmap
+#     96  u64 dimensione del file
+#   nomi: u64[attività+1] offset nel blob UTF-8, seguito dal blob
+#   bitmap: u64[attività][parole], bit t = la traccia t contiene l'attività
+# L'attività di un evento è il valore di ogni <string key="concept:name"> (semantica dei
+# TA generati). FLAG_AMBIGUOUS segnala eventi in cui questa non coincide con il primo
+# concept:name senza distinzione di maiuscole tra string e date (semantica di
+# config.GetAttributeValue): in quel caso il TA di riferimento non usa l'indice.
+# ---------------------------------------------------------------------------
+
+ACTIVITY_INDEX_FILE = "activity_bitmaps.bin"
+ACTIVITY_INDEX_MAGIC = b"PMBITMAP"
+ACTIVITY_INDEX_VERSION = 1
+ACTIVITY_INDEX_HEADER_FMT = "<8sIIQQQ32sQQQQ"
+ACTIVITY_INDEX_HEADER_SIZE = 104
+FLAG_AMBIGUOUS = 1
+
+
+class ActivityIndexBuilder:
+
+    def __init__(self):
+        self.traces_by_activity = {}
+        self.num_traces = 0
+        self.ambiguous = False
+
+    def add_trace(self, trace_attrs, events):
+        t = self.num_traces
+        self.num_traces += 1
+        for strings, dates in events:
+            names = {value for key, value in strings if key == "concept:name"}
+            first = activity_of(strings, dates)
+            if names != (set() if first is None else {first}):
+                self.ambiguous = True
+            for name in names:
+                traces = self.traces_by_activity.get(name)
+                if traces is None:
+                    traces = self.traces_by_activity[name] = array("I")
+                if not traces or traces[-1] != t:
+                    traces.append(t)
+
+    def write(self, path, source_hash):
+        names = [name.encode("utf-8") for name in self.traces_by_activity]
+        name_offsets = array("Q", [0])
+        for data in names:
+            name_offsets.append(name_offsets[-1] + len(data))
+        name_data = b"".join(names)
+        name_data += b"\0" * ((-len(name_data)) % 8)
+        words = (self.num_traces + 63) // 64
+
+        off_name_offsets = ACTIVITY_INDEX_HEADER_SIZE
+        off_name_data = off_name_offsets + len(name_offsets) * 8
+        off_bitmaps = off_name_data + len(name_data)
+        size = off_bitmaps + len(names) * words * 8
+        header = struct.pack(
+            ACTIVITY_INDEX_HEADER_FMT, ACTIVITY_INDEX_MAGIC, ACTIVITY_INDEX_VERSION,
+            FLAG_AMBIGUOUS if self.ambiguous else 0, len(names), self.num_traces, words,
+            bytes.fromhex(source_hash), off_name_offsets, off_name_data, off_bitmaps, size
+        )
+        assert len(header) == ACTIVITY_INDEX_HEADER_SIZE
+
+        with open(path, "wb") as out:
+            out.write(header)
+            out.write(name_offsets.tobytes())
+            out.write(name_data)
+            for traces in self.traces_by_activity.values():
+                bitmap = bytearray(words * 8)
+                for t in traces:
+                    bitmap[t >> 3] |= 1 << (t & 7)
+                out.write(bitmap)
+
+
+# ---------------------------------------------------------------------------
+# Indice temporale per traccia (time_bounds.bin), per allowedTimeRange di
+# LoadAndFilterXesLog: il timestamp di un evento è il primo attributo time:timestamp
+# (chiave senza distinzione di maiuscole, prima string poi date) interpretato come
+# time.RFC3339; gli eventi senza timestamp valido non vengono mai scartati dal filtro.
+# Little-endian, sezioni allineate a 8 byte:
+#   header (128 byte)
+#     0   magic "PMTIMEIX"
+#     8   u32 versione, u32 riservato
+#     16  u64 tracce, u64 eventi con timestamp
+#     32  [32]byte SHA-256 del log sorgente
+#     64  u64 offset: minimi, massimi, eventi senza timestamp, flag, offset ordinati,
+#         timestamp ordinati, posizioni ordinate
+#     120 u64 dimensione del file
+#   minimi/massimi: i64[tracce] (MAX/MIN se la traccia non ha timestamp)
+#   eventi senza timestamp: u32[tracce]; flag: u32[tracce] (TIME_UNSURE: timestamp accettato
+#     da Go ma non rappresentabile, la traccia va valutata evento per evento)
+#   offset ordinati: u64[tracce+1] nelle due sezioni seguenti
+#   timestamp ordinati: i64[eventi con timestamp], posizioni: u32 (indice dell'evento
+#     nella traccia), ordinati per (timestamp, posizione) all'interno di ogni traccia
+# ---------------------------------------------------------------------------
+
+TIME_INDEX_FILE = "time_bounds.bin"
+TIME_INDEX_MAGIC = b"PMTIMEIX"
+TIME_INDEX_VERSION = 1
+TIME_INDEX_KEY = "time:timestamp"
+TIME_INDEX_HEADER_FMT = "<8sIIQQ32sQQQQQQQQ"
+TIME_INDEX_HEADER_SIZE = 128
+TIME_UNSURE = 1
+MAX_TS = (1 << 63) - 1
+
+
+class TimeIndexBuilder:
+
+    def __init__(self):
+        self.mins = array("q")
+        self.maxs = array("q")
+        self.untimed = array("I")
+        self.flags = array("I")
+        self.sorted_offsets = array("Q", [0])
+        self.sorted_ts = array("q")
+        self.sorted_pos = array("I")
+
+    def add_trace(self, trace_attrs, events):
+        timed = []
+        untimed = 0
+        flags = 0
+        for pos, (strings, dates) in enumerate(events):
+            value = next((v for k, v in strings + dates if k.lower() == TIME_INDEX_KEY), "")
+            try:
+                ts = rfc3339_ns(value) if value else None
+            except OverflowError:
+                ts = None
+                flags |= TIME_UNSURE
+            if ts is None:
+                untimed += 1
+            else:
+                timed.append((ts, pos))
+        timed.sort()
+        self.mins.append(timed[0][0] if timed else MAX_TS)
+        self.maxs.append(timed[-1][0] if timed else MISSING_TS)
+        self.untimed.append(untimed)
+        self.flags.append(flags)
+        self.sorted_ts.extend(ts for ts, _ in timed)
+        self.sorted_pos.extend(pos for _, pos in timed)
+        self.sorted_offsets.append(len(self.sorted_ts))
+
+    def write(self, path, source_hash):
+        sections = [self.mins, self.maxs, self.untimed, self.flags,
+                    self.sorted_offsets, self.sorted_ts, self.sorted_pos]
+        offsets = []
+        offset = TIME_INDEX_HEADER_SIZE
+        for section in sections:
+            offsets.append(offset)
+            size = len(section) * section.itemsize
+            offset += size + ((-size) % 8)
+        header = struct.pack(
+            TIME_INDEX_HEADER_FMT, TIME_INDEX_MAGIC, TIME_INDEX_VERSION, 0,
+            len(self.mins), len(self.sorted_ts), bytes.fromhex(source_hash), *offsets, offset
+        )
+        assert len(header) == TIME_INDEX_HEADER_SIZE
+
+        with open(path, "wb") as out:
+            out.write(header)
+            for section in sections:
+                payload = section.tobytes()
+                out.write(payload + b"\0" * ((-len(payload)) % 8))
+
+
+# Artefatti attesi per ogni log: se ne manca uno (es. log ingerito da una versione
+# precedente) vengono ricostruiti tutti
+ARTIFACT_FILES = (COLUMNAR_FILE, VARIANTS_FILE, ACTIVITY_INDEX_FILE, TIME_INDEX_FILE)
+if np is not None:
+    ARTIFACT_FILES += (FOLLOWS_MATRIX_FILE, FOLLOWS_INDEX_FILE)
+
+
+class VariantsBuilder:
+
+    def __init__(self):
+        self.variants = {}
+        self.num_traces = 0
+
+    def add_trace(self, trace_attrs, events):
+        activities = tuple(a for a in (activity_of(s, d) for s, d in events) if a)
+        if not activities:
+            return
+        self.num_traces += 1
+        variant = self.variants.get(activities)
+        if variant is None:
+            variant = self.variants[activities] = {"activities": list(activities), "count": 0, "cases": []}
+        variant["count"] += 1
+        if len(variant["cases"]) < MAX_VARIANT_CASES:
+            case_id = next((value for key, value in trace_attrs if key == "concept:name"), None)
+            if case_id is not None:
+                variant["cases"].append(case_id)
+
+    def write(self, path, source_hash):
+        payload = {
+            "version": VARIANTS_VERSION,
+            "source_sha256": source_hash,
+            "traces": self.num_traces,
+            "variants": list(self.variants.values())
+        }
+        with open(path, "w", encoding="utf-8") as out:
+            json.dump(payload, out, ensure_ascii=False, separators=(",", ":"))
+
+
+# Costruisce gli artefatti del log in out_dir (scrittura atomica file per file).
+# Ritorna l'elenco dei file prodotti.
+def build_artifacts(log_path, log_hash, out_dir):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    columnar = ColumnarBuilder()
+    variants = VariantsBuilder()
+    activity_index = ActivityIndexBuilder()
+    time_index = TimeIndexBuilder()
+    for trace_attrs, events in iter_traces(log_path):
+        columnar.add_trace(trace_attrs, events)
+        variants.add_trace(trace_attrs, events)
+        activity_index.add_trace(trace_attrs, events)
+        time_index.add_trace(trace_attrs, events)
+
+    writers = [
+        (COLUMNAR_FILE, columnar.write),
+        (VARIANTS_FILE, variants.write),
+        (ACTIVITY_INDEX_FILE, activity_index.write),
+        (TIME_INDEX_FILE, time_index.write)
+    ]
+    if np is not None:
+        follows = FollowsMatrices(variants).compute()
+        # L'indice per ultimo: il TA lo legge per primo e ne verifica l'hash
+        writers += [(FOLLOWS_MATRIX_FILE, follows.write_matrices), (FOLLOWS_INDEX_FILE, follows.write_index)]
+
+    produced = []
+    for name, write in writers:
+        fd, tmp_name = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_name, log_hash)
+            os.replace(tmp_name, out_dir / name)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        produced.append(name)
+    return produced
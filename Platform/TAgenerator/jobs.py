@@ -0,0 +1,168 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import registry
+
+# Esecuzione asincrona della pipeline di /setup.
+# Il pool è limitato (PROMISE_SETUP_WORKERS thread per processo) e la coda delle richieste
+# in attesa anche (PROMISE_SETUP_MAX_PENDING, sull'intera piattaforma): oltre il limite
+# submit_job rifiuta il job e il chiamante risponde 503.
+# Lo stato dei job è nella tabella jobs del registro SQLite, condiviso da tutti i worker
+# (gunicorn -w N): /jobs/<id> risponde da qualunque worker. Il job gira nel processo che
+# lo ha accettato, che ne rinnova il lease (lease_until) ogni JOB_LEASE_SECONDS / 3: un
+# job attivo con il lease scaduto appartiene a un processo terminato e viene segnato come
+# fallito, con il suo spool rimosso (recover_orphaned_jobs all'avvio, get_job alla lettura).
+# Lo stato resta disponibile per JOB_RETENTION_SECONDS dopo la fine.
+
+SETUP_WORKERS = int(os.environ.get("PROMISE_SETUP_WORKERS", 4))
+MAX_PENDING_JOBS = int(os.environ.get("PROMISE_SETUP_MAX_PENDING", 64))
+JOB_RETENTION_SECONDS = int(os.environ.get("PROMISE_JOB_RETENTION_SECONDS", 3600))
+JOB_LEASE_SECONDS = int(os.environ.get("PROMISE_JOB_LEASE_SECONDS", 60))
+# Spool non referenziati da job attivi e fermi da più di così sono residui di processi terminati
+SPOOL_ORPHAN_SECONDS = int(os.environ.get("PROMISE_SPOOL_ORPHAN_SECONDS", 3600))
+
+JOB_FIELDS = ("id", "status", "created_at", "started_at", "finished_at", "result", "error")
+ACTIVE = ("queued", "running")
+
+# Pool, heartbeat e identità sono per processo: i worker di gunicorn nascono da fork
+_state_lock = threading.Lock()
+_pool_pid = None
+_executor = None
+_worker_ids = {}
+
+
+def _worker_id():
+    pid = os.getpid()
+    if pid not in _worker_ids:
+        _worker_ids[pid] = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}"
+    return _worker_ids[pid]
+
+
+def _pool():
+    global _pool_pid, _executor
+    with _state_lock:
+        if _pool_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=SETUP_WORKERS, thread_name_prefix="setup-job")
+            threading.Thread(target=_heartbeat, name="setup-job-lease", daemon=True).start()
+            _pool_pid = os.getpid()
+        return _executor
+
+
+def _heartbeat():
+    worker = _worker_id()
+    while True:
+        time.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            conn = registry.connect()
+            with registry.transaction(conn):
+                conn.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE worker = ? AND status IN (?, ?)",
+                    (time.time() + JOB_LEASE_SECONDS, worker, *ACTIVE)
+                )
+        except sqlite3.Error as exc:
+            print(f"[warn] rinnovo del lease dei job non riuscito: {exc}")
+
+
+def _update(job_id, **fields):
+    conn = registry.connect()
+    with registry.transaction(conn):
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+            (*fields.values(), job_id)
+        )
+
+
+def _run(job_id, fn, args):
+    _update(job_id, status="running", started_at=time.time(), lease_until=time.time() + JOB_LEASE_SECONDS)
+    try:
+        result = fn(*args)
+        update = {"status": "done", "result": json.dumps(result)}
+    except Exception as exc:
+        traceback.print_exc()
+        update = {"status": "failed", "error": str(exc)}
+    _update(job_id, finished_at=time.time(), **update)
+
+
+# Accoda fn(*args); ritorna l'id del job oppure None se la coda è piena.
+# spool_path è il file temporaneo del job, da rimuovere se il processo termina prima.
+def submit_job(fn, *args, spool_path=None):
+    executor = _pool()
+    now = time.time()
+    conn = registry.connect()
+    with registry.transaction(conn):
+        conn.execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - JOB_RETENTION_SECONDS,)
+        )
+        pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", ACTIVE).fetchone()[0]
+        if pending >= MAX_PENDING_JOBS:
+            return None
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO jobs (id, status, worker, spool_path, created_at, lease_until) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, _worker_id(), str(spool_path) if spool_path is not None else None, now, now + JOB_LEASE_SECONDS)
+        )
+    executor.submit(_run, job_id, fn, args)
+    return job_id
+
+
+def _read_job(job_id):
+    return registry.connect().execute(
+        f"SELECT {', '.join(JOB_FIELDS)}, lease_until FROM jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+
+
+def get_job(job_id):
+    row = _read_job(job_id)
+    if row is None:
+        return None
+    if row["status"] in ACTIVE and row["lease_until"] < time.time():
+        _fail_expired_jobs()
+        row = _read_job(job_id)
+    job = {field: row[field] for field in JOB_FIELDS}
+    if job["result"] is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+# Segna come falliti i job attivi con il lease scaduto e ne rimuove gli spool.
+# Ritorna gli spool dei job ancora attivi.
+def _fail_expired_jobs():
+    now = time.time()
+    conn = registry.connect()
+    with registry.transaction(conn):
+        active = conn.execute("SELECT id, spool_path, lease_until FROM jobs WHERE status IN (?, ?)", ACTIVE).fetchall()
+        orphaned = [job for job in active if job["lease_until"] is None or job["lease_until"] < now]
+        conn.executemany(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            [("Job interrotto: il worker che lo eseguiva è terminato.", now, job["id"]) for job in orphaned]
+        )
+    for job in orphaned:
+        if job["spool_path"]:
+            Path(job["spool_path"]).unlink(missing_ok=True)
+    if orphaned:
+        print(f"[warn] {len(orphaned)} job asincroni interrotti segnati come falliti")
+    orphaned_ids = {job["id"] for job in orphaned}
+    return {job["spool_path"] for job in active if job["id"] not in orphaned_ids and job["spool_path"]}
+
+
+# Da chiamare all'avvio di ogni worker (vedi app.start_platform): job di processi terminati
+# e spool rimasti senza job né upload in corso.
+def recover_orphaned_jobs(spool_dir):
+    in_use = _fail_expired_jobs()
+    now = time.time()
+    # ctime e non mtime: lo spool di un log già presente è un hard link al blob, con il suo mtime
+    for spool in Path(spool_dir).glob("*.part"):
+        try:
+            idle = now - spool.stat().st_ctime
+        except FileNotFoundError:
+            continue
+        if str(spool) not in in_use and idle > SPOOL_ORPHAN_SECONDS:
+            spool.unlink(missing_ok=True)
@@ -0,0 +1,195 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Cache delle policy già parsate, indirizzata per contenuto (SHA-256 dei byte TTL).
+# Ogni voce contiene il JSON della policy senza il campo volatile "last_updated" e
+# lo structure hash calcolato da compute_policy_structure_hash.
+# Livello in memoria LRU limitato in byte, più un livello opzionale su disco
+# (generated_tas/.cache/policies) condiviso tra processi e riavvii.
+# L'occupazione del livello su disco è tenuta come totale progressivo (una sola scansione
+# al primo uso): la directory viene riletta solo quando il limite è superato, e la
+# scansione riallinea il totale con quanto scritto dagli altri processi.
+
+VOLATILE_FIELDS = ("last_updated",)
+
+DEFAULT_MAX_BYTES = int(os.environ.get("PROMISE_POLICY_CACHE_BYTES", 16 * 1024 * 1024))
+DEFAULT_DISK_MAX_BYTES = int(os.environ.get("PROMISE_POLICY_CACHE_DISK_BYTES", 256 * 1024 * 1024))
+DISK_CACHE_ENABLED = os.environ.get("PROMISE_POLICY_CACHE_DISK", "0") == "1"
+DISK_CACHE_DIR = Path("generated_tas") / ".cache" / "policies"
+# L'eviction su disco scende sotto questa frazione del limite, così non si ripete a ogni put
+DISK_EVICT_TARGET = 0.9
+# File temporanei più vecchi di così sono residui di scritture interrotte
+DISK_TMP_MAX_AGE = 300
+
+
+def strip_volatile(policy_json):
+    return {
+        "policies": [
+            {k: v for k, v in pol.items() if k not in VOLATILE_FIELDS}
+            for pol in policy_json["policies"]
+        ]
+    }
+
+
+class PolicyCache:
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, disk_dir=None, disk_max_bytes=DEFAULT_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    # Ritorna (policy_json senza campi volatili, structure_hash) oppure None
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._decode(payload)
+
+        payload = self._disk_read(key)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, payload)
+        return self._decode(payload)
+
+    def put(self, key, policy_json, structure_hash):
+        payload = json.dumps({
+            "policy": strip_volatile(policy_json),
+            "structure_hash": structure_hash
+        }, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._insert(key, payload)
+        self._disk_write(key, payload)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "disk_bytes": self._disk_bytes,
+                "disk_enabled": self.disk_dir is not None
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @staticmethod
+    def _decode(payload):
+        entry = json.loads(payload)
+        return entry["policy"], entry["structure_hash"]
+
+    # Da chiamare con il lock acquisito
+    def _insert(self, key, payload):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        if len(payload) > self.max_bytes:
+            return
+        self._entries[key] = payload
+        self._bytes += len(payload)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_read(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            payload = path.read_bytes()
+            os.utime(path)  # mtime = ultimo accesso, usato per l'LRU su disco
+            return payload
+        except OSError:
+            return None
+
+    def _disk_write(self, key, payload):
+        if self.disk_dir is None or len(payload) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._disk_scan()[0]
+        try:
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(payload)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        with self._disk_lock:
+            self._disk_bytes += len(payload) - replaced
+            if self._disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+
+    # Ritorna (byte occupati, voci ordinate per ultimo accesso); rimuove i .tmp abbandonati
+    def _disk_scan(self):
+        now = time.time()
+        files = []
+        total = 0
+        for path in self.disk_dir.glob("*/*"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if path.suffix == ".tmp":
+                if now - st.st_mtime > DISK_TMP_MAX_AGE:
+                    path.unlink(missing_ok=True)
+                continue
+            if path.suffix == ".json":
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files.sort()
+        return total, files
+
+    # Da chiamare con _disk_lock acquisito
+    def _disk_evict(self):
+        total, files = self._disk_scan()
+        target = self.disk_max_bytes * DISK_EVICT_TARGET
+        for _, size, path in files:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.disk_evictions += 1
+        self._disk_bytes = total
+
+
+POLICY_CACHE = PolicyCache(disk_dir=DISK_CACHE_DIR if DISK_CACHE_ENABLED else None)
@@ -2,17 +2,43 @@ from rdflib import Graph, Namespace, RDF, URIRef, Literal
 from rdflib.collection import Collection
 from datetime import datetime
 import hashlib
+import hmac
 import json
 import os
 from pathlib import Path
 import shutil
+import tempfile
+import uuid
+import gzip
+import zlib
+import xml.etree.ElementTree as ET
 from generate_main_go import generate_main_go, generate_go_mod
+from turtle_fastpath import parse_turtle_fast, UnsupportedTurtle
+from policy_cache import POLICY_CACHE
+from file_lock import exclusive_lock, write_json_atomic
+import registry
+import blob_store
+import ingest_artifacts
+import policy_views
 
 UCON = Namespace("http://example.org/ucon#")
 EVENTLOG = Namespace("http://example.org/eventLog#")
 PMT = Namespace("http://example.org/pmt#")
 LOC = Namespace("http://id.loc.gov/vocabulary/countries/")
 
+# Upload del log: letto a blocchi e scritto su disco, mai tenuto tutto in RAM
+SPOOL_CHUNK_SIZE = 1024 * 1024
+SPOOL_DIR = Path("generated_tas") / ".spool"
+
+# Compressione dei log a riposo: "none" (default) oppure "gzip".
+# I TA riconoscono il formato dal magic number e decomprimono in streaming.
+LOG_COMPRESSION = os.environ.get("PROMISE_LOG_COMPRESSION", "none").lower()
+LOG_COMPRESSION_LEVEL = int(os.environ.get("PROMISE_LOG_COMPRESSION_LEVEL", 6))
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Validità dei nonce emessi da /logs/challenge per le prove di possesso dei log
+LOG_CHALLENGE_TTL = int(os.environ.get("PROMISE_LOG_CHALLENGE_TTL", 300))
+
 def node_to_str(val):
     if isinstance(val, URIRef):
         return val.split('#')[-1]
@@ -44,6 +70,127 @@ def compute_policy_structure_hash(policy_json):
     structure_str = json.dumps(structure_only, sort_keys=True)
     return hashlib.sha256(structure_str.encode('utf-8')).hexdigest()
 
+# Copia lo stream del log in un file temporaneo calcolando lo SHA-256 al volo.
+# Lo spool vive sotto generated_tas/ così il rename finale in data/<id>/ è atomico
+# (stesso filesystem). Ritorna (path dello spool, hash esadecimale).
+# L'hash è sempre quello del contenuto XES decompresso, così deduplica e precheck
+# non dipendono dal formato di memorizzazione:
+# - upload già gzip (.xes.gz): salvato così com'è, hash calcolato decomprimendo in streaming
+# - upload in chiaro con compression="gzip": compresso durante lo spool
+def spool_log_upload(stream, spool_dir=SPOOL_DIR, compression=None):
+    compression = compression or LOG_COMPRESSION
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(dir=spool_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            chunk = stream.read(SPOOL_CHUNK_SIZE)
+            if chunk.startswith(GZIP_MAGIC):
+                gunzip = GzipDigest(digest)
+                while chunk:
+                    gunzip.update(chunk)
+                    out.write(chunk)
+                    chunk = stream.read(SPOOL_CHUNK_SIZE)
+                gunzip.finish()
+            elif compression == "gzip":
+                with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=LOG_COMPRESSION_LEVEL, mtime=0) as gz:
+                    while chunk:
+                        digest.update(chunk)
+                        gz.write(chunk)
+                        chunk = stream.read(SPOOL_CHUNK_SIZE)
+            else:
+                while chunk:
+                    digest.update(chunk)
+                    out.write(chunk)
+                    chunk = stream.read(SPOOL_CHUNK_SIZE)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return Path(tmp_name), digest.hexdigest()
+
+# Aggiorna lo SHA-256 con il contenuto decompresso di uno stream gzip (anche multi-member),
+# senza mai tenere in memoria più di SPOOL_CHUNK_SIZE byte decompressi.
+class GzipDigest:
+
+    def __init__(self, digest):
+        self.digest = digest
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.in_member = False
+
+    def update(self, data):
+        try:
+            while data:
+                self.in_member = True
+                self.digest.update(self.decompressor.decompress(data, SPOOL_CHUNK_SIZE))
+                if self.decompressor.eof:
+                    # Fine del member corrente; eventuali byte residui iniziano il successivo
+                    self.in_member = False
+                    data = self.decompressor.unused_data
+                    self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                else:
+                    data = self.decompressor.unconsumed_tail
+        except zlib.error as exc:
+            raise ValueError(f"log gzip non valido: {exc}") from exc
+
+    def finish(self):
+        if self.in_member:
+            raise ValueError("log gzip troncato")
+
+def discard_spool(spool_path):
+    if spool_path is not None:
+        Path(spool_path).unlink(missing_ok=True)
+
+# Path di un log già presente sulla piattaforma con il dato SHA-256 (blob store, poi
+# configurazioni registrate prima dello store), oppure None.
+def find_log_by_hash(log_hash):
+    blob = blob_store.blob_path(log_hash)
+    if blob.is_file():
+        return blob
+    return registry.find_log_by_hash(log_hash)
+
+# Prova di possesso di un log: HMAC-SHA256 del contenuto XES decompresso (lo stesso su
+# cui è calcolato lo SHA-256) con chiave il nonce emesso dalla piattaforma. Conoscere lo
+# SHA-256 non basta a calcolarla: serve il log.
+def log_proof(log_path, nonce):
+    mac = hmac.new(nonce.encode(), digestmod=hashlib.sha256)
+    with open(log_path, "rb") as raw:
+        compressed = raw.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    with (gzip.open(log_path, "rb") if compressed else open(log_path, "rb")) as f:
+        for chunk in iter(lambda: f.read(SPOOL_CHUNK_SIZE), b""):
+            mac.update(chunk)
+    return mac.hexdigest()
+
+# Path del log con il dato SHA-256 se la prova di possesso per il nonce è valida,
+# altrimenti None (log assente e prova errata non sono distinguibili).
+# La validità del nonce è verificata dal chiamante.
+def find_proven_log(log_hash, nonce, proof):
+    if not nonce or not proof:
+        return None
+    log_path = find_log_by_hash(log_hash)
+    if log_path is None or not hmac.compare_digest(log_proof(log_path, nonce), proof.lower()):
+        return None
+    return log_path
+
+# Crea uno spool a partire da un log già presente di cui il client ha provato il possesso,
+# così /setup può procedere senza ricevere il file. Dal blob store basta un hard link; il
+# log di una configurazione precedente allo store va copiato, perché lo spool diventa un
+# blob in sola lettura e il chmod cambierebbe anche il file della configurazione.
+# Ritorna il path dello spool oppure None.
+def spool_existing_log(log_hash, nonce, proof, spool_dir=SPOOL_DIR):
+    source = find_proven_log(log_hash, nonce, proof)
+    if source is None:
+        return None
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    spool_path = spool_dir / f"{uuid.uuid4().hex}.part"
+    if source == blob_store.blob_path(log_hash):
+        try:
+            os.link(source, spool_path)
+            return spool_path
+        except OSError:
+            pass
+    shutil.copyfile(source, spool_path)
+    return spool_path
+
 def parse_policy_turtle(g):
     policies = []
     for policy in g.subjects(RDF.type, UCON.Authorization):
@@ -192,74 +339,168 @@ def parse_policy_turtle(g):
 
     return {"policies": policies}
 
-def save_policy_instance(graph, policy_json, policy_bytes, log_filename, log_bytes):
+# Parsing della policy TTL: prima la cache indirizzata per contenuto (SHA-256 dei byte),
+# poi il parser veloce per il sottoinsieme emesso dai client DataOwner, infine rdflib
+# per tutto ciò che il parser veloce non riconosce.
+# Ritorna (grafo, policy_json, structure_hash); il grafo è None se la policy arriva dalla cache.
+def load_policy(policy_bytes, cache=POLICY_CACHE):
+    key = hashlib.sha256(policy_bytes).hexdigest()
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        policy_json, hash_val = cached
+        now = datetime.now().isoformat(timespec='seconds')
+        for pol in policy_json["policies"]:
+            pol["last_updated"] = now
+        return None, policy_json, hash_val
+
+    try:
+        g = parse_turtle_fast(policy_bytes)
+    except UnsupportedTurtle as exc:
+        print(f"[info] fast-path Turtle non applicabile ({exc}), uso rdflib")
+        g = Graph()
+        g.parse(data=policy_bytes, format="ttl")
+    policy_json = parse_policy_turtle(g)
     hash_val = compute_policy_structure_hash(policy_json)
+    if cache is not None:
+        cache.put(key, policy_json, hash_val)
+    return g, policy_json, hash_val
+
+def save_policy_instance(graph, policy_json, policy_bytes, log_filename, log_spool_path, log_hash, structure_hash=None):
+    hash_val = structure_hash or compute_policy_structure_hash(policy_json)
     base_dir = Path("generated_tas") / hash_val
     configs_dir = base_dir / "configs"
     data_dir = base_dir / "data"
     configs_dir.mkdir(parents=True, exist_ok=True)
     data_dir.mkdir(parents=True, exist_ok=True)
-
-    # Carica mapping esistente o inizializza
     mapping_path = base_dir / "mapping.json"
-    mapping = json.loads(mapping_path.read_text()) if mapping_path.exists() else {}
 
-    # Calcolo hash del log e owner
+    # Owner e chiave di deduplica (hash del log già calcolato durante lo spool)
     owner = policy_json["policies"][0].get("owner", "owner")
-    log_hash = hashlib.sha256(log_bytes).hexdigest()
     dedup_key = f"{owner}:{hash_val}:{log_hash}"
 
-    # Verifica duplicati
-    for entry_id, entry in mapping.items():
-        if entry.get("dedup_key") == dedup_key:
-            return {
-                "duplicate": True,
-                "existing_id": entry_id,
-                "config_path": entry["config_path"],
-                "data_path": entry["data_path"],
-                "log_filename": entry["log_file"]
-            }
-
-    # Non duplicato, crea nuova istanza
-    existing_ids = [int(p.name) for p in configs_dir.iterdir() if p.is_dir() and p.name.isdigit()]
-    next_id = f"{(max(existing_ids) + 1) if existing_ids else 1:02}"
-    config_subdir = configs_dir / next_id
-    data_subdir = data_dir / next_id
-    config_subdir.mkdir()
-    data_subdir.mkdir()
+    # Deduplica e allocazione dell'id sono una sezione critica: con più worker due upload
+    # sullo stesso TA potrebbero ottenere lo stesso id. Il lock è per TA (structure hash) e
+    # copre solo questa parte: le directory create sotto lock prenotano l'id, il resto del
+    # salvataggio gira in parallelo con gli altri upload.
+    with exclusive_lock(base_dir / ".mapping.lock"):
+        # Verifica duplicati (lookup su indice nel registro)
+        duplicate = registry.find_duplicate(hash_val, dedup_key)
+        if duplicate is not None:
+            discard_spool(log_spool_path)
+            return _duplicate_result(duplicate)
+
+        # Non duplicato, crea nuova istanza
+        next_id = registry.next_config_id(hash_val, configs_dir)
+        while (configs_dir / next_id).exists() or (data_dir / next_id).exists():
+            # id prenotati da salvataggi in corso
+            next_id = f"{int(next_id) + 1:02}"
+        config_subdir = configs_dir / next_id
+        data_subdir = data_dir / next_id
+        config_subdir.mkdir()
+        data_subdir.mkdir()
+
+    try:
+        # Salva policy TTL
+        (config_subdir / "policy.ttl").write_bytes(policy_bytes)
+        # Salva JSON config (rename atomico: il TA riconosce ogni nuova versione dal file)
+        write_json_atomic(config_subdir / "policy_config.json", policy_json)
+        # Il log va nel blob store (se non c'è già) e data/<id>/ ne riceve un hard link
+        log_filename = blob_store.store_and_link(log_spool_path, log_hash, data_subdir, log_filename,
+                                                 lambda h: registry.add_blob_ref(hash_val, next_id, h))
+        # Artefatti precalcolati (formato colonnare, ...) accanto al log
+        prepare_log_artifacts(log_hash, data_subdir)
+        # Log già filtrato secondo logUsageRules, servito dal TA al posto del filtro dal vivo
+        prepare_policy_view(log_hash, policy_json["policies"][0].get("logUsageRules"), data_subdir)
+
+        # CREA QUI IL FILE audit.log VUOTO
+        (config_subdir / "audit.txt").write_text("")
+
+        # Autorizzazioni per fase
+        auth = policy_json["policies"][0]
+        authorized_users = {
+            "logUsage": auth.get("logUsageRules", {}).get("accessControlRules", []),
+            "output": auth.get("outputRules", {}).get("accessControlRules", []),
+            "processing": auth.get("processingRules", {}).get("accessControlRules", [])
+        }
+        if owner:
+            for phase in authorized_users:
+                if owner not in authorized_users[phase]:
+                    authorized_users[phase].append(owner)
+
+        # main.go, go.mod e algoritmi sono del TA, condivisi dalle sue configurazioni:
+        # un lock a parte, così non si attende il salvataggio dei log degli altri upload
+        with exclusive_lock(base_dir / ".generate.lock"):
+            prepare_ta_sources(base_dir, hash_val, policy_json)
+
+        # Seconda sezione critica, breve: un upload concorrente con la stessa dedup_key
+        # potrebbe aver registrato nel frattempo; altrimenti aggiungi voce al mapping
+        with exclusive_lock(base_dir / ".mapping.lock"):
+            duplicate = registry.find_duplicate(hash_val, dedup_key)
+            if duplicate is None:
+                registry.register_config(hash_val, next_id, {
+                    "log_file": log_filename,
+                    "config_path": str(config_subdir),
+                    "data_path": str(data_subdir),
+                    "authorized_users": authorized_users,
+                    "owner": owner,
+                    "dedup_key": dedup_key
+                }, log_hash, mapping_path)
+    except BaseException:
+        discard_policy_instance(hash_val, next_id, config_subdir, data_subdir)
+        raise
+
+    if duplicate is not None:
+        discard_policy_instance(hash_val, next_id, config_subdir, data_subdir)
+        return _duplicate_result(duplicate)
 
-    # Salva policy TTL
-    (config_subdir / "policy.ttl").write_bytes(policy_bytes)
-    # Salva JSON config
-    (config_subdir / "policy_config.json").write_text(json.dumps(policy_json, indent=2))
-    # Salva file di log
-    (data_subdir / log_filename).write_bytes(log_bytes)
+    return {
+        "duplicate": False,
+        "hash": hash_val,
+        "id": next_id,
+        "config_path": str(config_subdir),
+        "data_path": str(data_subdir),
+        "log_filename": log_filename
+    }
 
-    # CREA QUI IL FILE audit.log VUOTO
-    (config_subdir / "audit.txt").write_text("")
+def _duplicate_result(duplicate):
+    entry_id, entry = duplicate
+    return {
+        "duplicate": True,
+        "existing_id": entry_id,
+        "config_path": entry["config_path"],
+        "data_path": entry["data_path"],
+        "log_filename": entry["log_file"]
+    }
 
+# Annulla un salvataggio non registrato: rilascia il riferimento al blob e rimuove le
+# directory che prenotavano l'id
+def discard_policy_instance(ta_hash, config_id, config_subdir, data_subdir):
+    unreferenced = registry.release_blob_ref(ta_hash, config_id)
+    shutil.rmtree(config_subdir, ignore_errors=True)
+    shutil.rmtree(data_subdir, ignore_errors=True)
+    if unreferenced:
+        reclaim_blobs([unreferenced])
+
+# Rimuove dal blob store i log che nessuna configurazione usa (tutti se log_hashes è None)
+def reclaim_blobs(log_hashes=None):
+    removed = blob_store.collect_garbage(lambda h: registry.blob_refcount(h) > 0, log_hashes)
+    if removed:
+        print(f"[info] {len(removed)} blob senza riferimenti rimossi dallo store")
+    return removed
+
+# Genera main.go e go.mod (la prima volta) e copia gli algoritmi richiesti con il loro
+# manifest. Da chiamare con il lock .generate.lock del TA.
+def prepare_ta_sources(base_dir, hash_val, policy_json):
     main_go_path = base_dir / "main.go"
     if not main_go_path.exists():
-        generate_main_go(ta_hash=hash_val)
+        generate_main_go(ta_hash=hash_val, policy_json=policy_json)
         generate_go_mod(ta_hash=hash_val)
 
-    # Autorizzazioni per fase
-    auth = policy_json["policies"][0]
-    authorized_users = {
-        "logUsage": auth.get("logUsageRules", {}).get("accessControlRules", []),
-        "output": auth.get("outputRules", {}).get("accessControlRules", []),
-        "processing": auth.get("processingRules", {}).get("accessControlRules", [])
-    }
-    if owner:
-        for phase in authorized_users:
-            if owner not in authorized_users[phase]:
-                authorized_users[phase].append(owner)
-
     # Copia algoritmi richiesti e crea manifest
     algorithm_subdir = base_dir / "algorithms"
     algorithm_subdir.mkdir(exist_ok=True)
 
-    techniques = auth.get("processingRules", {}).get("allowedTechniques", [])
+    techniques = policy_json["policies"][0].get("processingRules", {}).get("allowedTechniques", [])
     algorithm_manifest = []
 
     for tech in techniques:
@@ -293,25 +534,40 @@ def save_policy_instance(graph, policy_json, policy_bytes, log_filename, log_byt
     manifest_path = algorithm_subdir / "algorithm_manifest.json"
     manifest_path.write_text(json.dumps(algorithm_manifest, indent=2))
 
-    # Aggiungi voce al mapping
-    mapping[next_id] = {
-        "log_file": log_filename,
-        "config_path": str(config_subdir),
-        "data_path": str(data_subdir),
-        "authorized_users": authorized_users,
-        "owner": owner,
-        "dedup_key": dedup_key
-    }
-    mapping_path.write_text(json.dumps(mapping, indent=2))
-
-    return {
-        "duplicate": False,
-        "hash": hash_val,
-        "id": next_id,
-        "config_path": str(config_subdir),
-        "data_path": str(data_subdir),
-        "log_filename": log_filename
-    }
-
-
-
+# Costruisce (una volta per contenuto) gli artefatti derivati dal log e li collega in
+# data/<id>/artifacts/. Un errore qui non blocca il setup: il TA ripiega sul parsing dell'XES.
+def prepare_log_artifacts(log_hash, data_subdir):
+    if not ingest_artifacts.INGEST_ENABLED:
+        return []
+    out_dir = blob_store.artifact_dir(log_hash)
+    try:
+        if not all((out_dir / name).exists() for name in ingest_artifacts.ARTIFACT_FILES):
+            ingest_artifacts.build_artifacts(blob_store.blob_path(log_hash), log_hash, out_dir)
+        return blob_store.link_artifacts(log_hash, data_subdir / "artifacts")
+    except (ET.ParseError, OSError, ValueError) as exc:
+        print(f"[warn] artefatti del log {log_hash} non generati: {exc}")
+        return []
+
+# Materializza (una volta per log e regole) la vista filtrata della policy e la collega in
+# data/<id>/views/<hash regole>/. Come per gli artefatti, un errore non blocca il setup.
+def prepare_policy_view(log_hash, log_rules, data_subdir):
+    if not policy_views.VIEWS_ENABLED:
+        return None
+    rules = policy_views.view_rules(log_rules)
+    if rules is None:
+        print("[info] vista della policy non generata: logUsageRules non supportate dal TA")
+        return None
+    rules_hash = policy_views.rules_hash(rules)
+    out_dir = blob_store.view_dir(log_hash, rules_hash)
+    try:
+        if not (out_dir / policy_views.VIEW_MANIFEST).exists():
+            try:
+                policy_views.build_view(blob_store.blob_path(log_hash), log_hash, rules, out_dir)
+            except (ET.ParseError, ValueError):
+                shutil.rmtree(out_dir, ignore_errors=True)
+                raise
+        blob_store.link_view(log_hash, rules_hash, data_subdir / "views" / rules_hash)
+        return rules_hash
+    except (ET.ParseError, OSError, ValueError) as exc:
+        print(f"[info] vista della policy per il log {log_hash} non generata: {exc}")
+        return None
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+import xml.etree.ElementTree as ET
+
+from ingest_artifacts import RFC3339_RE, VariantsBuilder, local_name, open_log
+
+# Viste materializzate delle policy: il filtro di /access_log del TA generato è una
+# funzione pura di (byte del log, logUsageRules), quindi al setup viene calcolato una volta
+# per coppia (SHA-256 del log, hash canonico delle regole) e il TA serve il risultato.
+# La vista contiene:
+#   access_log.xml  corpo esatto della risposta di /access_log (xml.MarshalIndent di Go)
+#   variants.json   tracce selezionate da semanticLogConstraints nel formato delle varianti
+#                   (lo stesso di artifacts/variants.json), per /process
+#   view.json       manifest scritto per ultimo: hash del log e delle regole, tracce
+# Quando il comportamento del TA non è riproducibile con certezza (regole che farebbero
+# fallire il handler, date non accettate da Go, XML che il decoder Go legge diversamente)
+# la vista non viene generata e il TA filtra dal vivo.
+
+VIEWS_ENABLED = os.environ.get("PROMISE_POLICY_VIEWS", "1") != "0"
+
+VIEW_VERSION = 1
+VIEW_MANIFEST = "view.json"
+VIEW_ACCESS_LOG = "access_log.xml"
+VIEW_VARIANTS = "variants.json"
+VIEW_KEY_PREFIX = b"promise-view-v1\n"
+TIME_KEY = "time:timestamp"
+ACTIVITY_KEY = "concept:name"
+
+RAW_CHUNK = 1 << 20
+# Valori di attributo con tab/a capo letterali: expat li normalizza in spazi, Go no
+ATTR_WHITESPACE_RE = re.compile(rb"=\s*(?:\"[^\"<]*[\t\n\r][^\"<]*\"|'[^'<]*[\t\n\r][^'<]*')")
+# Entità di un DTD interno (Go non le espande) e dichiarazioni xmlns:key / xmlns:value
+# (per Go sono attributi con nome locale key/value)
+UNSUPPORTED_RAW_RE = re.compile(rb"<!DOCTYPE|xmlns:(?:key|value)\s*=")
+XML_ENCODING_RE = re.compile(rb"<\?xml[^>]*?encoding\s*=\s*[\"']([^\"']*)[\"']")
+
+_ESCAPES = {'"': "&#34;", "'": "&#39;", "&": "&amp;", "<": "&lt;", ">": "&gt;",
+            "\t": "&#x9;", "\n": "&#xA;", "\r": "&#xD;"}
+# Come EscapeString di Go: caratteri fuori dal range XML sostituiti da U+FFFD
+_ESCAPE_RE = re.compile("[\"'&<>\t\n\r]|[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+
+
+class ViewNotSupported(ValueError):
+    pass
+
+
+def days_from_civil(year, month, day):
+    # Giorni dal 1970-01-01 nel calendario gregoriano prolettico (anche per l'anno 0)
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def days_in_month(year, month):
+    if month == 2:
+        return 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28
+    return 30 if month in (4, 6, 9, 11) else 31
+
+
+ZERO_TIME = days_from_civil(1, 1, 1) * 86400 * 1_000_000_000  # time.Time{} di Go
+
+
+# time.Parse(time.RFC3339) di Go. Ritorna (istante in ns Unix senza limiti di range,
+# valore riformattato come time.RFC3339Nano, ore dell'offset) oppure None se Go lo rifiuta.
+def go_time(value):
+    m = RFC3339_RE.match(value)
+    if m is None:
+        return None
+    year, month, day, hour, minute, second = (int(g) for g in m.group(1, 2, 3, 4, 5, 6))
+    if not 1 <= month <= 12 or not 1 <= day <= days_in_month(year, month) or hour > 23 or minute > 59 or second > 59:
+        return None
+    frac = (m.group(7) or "")[:9]
+    nanos = int(frac.ljust(9, "0")) if frac else 0
+    offset = 0
+    if not m.group(8):
+        offset = (int(m.group(10)) * 3600 + int(m.group(11)) * 60) * (1 if m.group(9) == "+" else -1)
+    seconds = days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second - offset
+    text = f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:{second:02d}"
+    if nanos:
+        text += "." + f"{nanos:09d}".rstrip("0")
+    if offset == 0:
+        text += "Z"
+    else:
+        zone = abs(offset) // 60
+        text += f"{'-' if offset < 0 else '+'}{zone // 60:02d}:{zone % 60:02d}"
+    return seconds * 1_000_000_000 + nanos, text, abs(offset) // 3600
+
+
+def escape_attr(value):
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES.get(m.group(0), "\ufffd"), value)
+
+
+# Regole di filtro di /access_log nella forma letta dal handler generato. None se il
+# TA rifiuterebbe la policy (tipi inattesi).
+def view_rules(log_rules):
+    if not isinstance(log_rules, dict):
+        return None
+    # Stessa lettura delle strutture tipizzate del TA: campi assenti o null sono vuoti,
+    # un tipo diverso rende la policy non valida (e quindi nessuna vista)
+    sem = _or_default(log_rules.get("semanticLogConstraints"), {})
+    if not isinstance(sem, dict):
+        return None
+    include = _or_default(sem.get("mustInclude"), [])
+    exclude = _or_default(sem.get("mustExclude"), [])
+    if not isinstance(include, list) or not isinstance(exclude, list):
+        return None
+    if not all(isinstance(v, str) for v in include + exclude):
+        return None
+    required, excluded = set(include), set(exclude)
+
+    trange = _or_default(log_rules.get("allowedTimeRange"), {})
+    if not isinstance(trange, dict):
+        return None
+    start_date = _or_default(trange.get("startDate"), "")
+    end_date = _or_default(trange.get("endDate"), "")
+    if not isinstance(start_date, str) or not isinstance(end_date, str):
+        return None
+    # Date non valide o uguali a time.Time{} disattivano il limite
+    start, end = go_time(start_date), go_time(end_date)
+    start = start if start is not None and start[0] != ZERO_TIME else None
+    end = end if end is not None and end[0] != ZERO_TIME else None
+
+    excluded_attrs = set()
+    excl = log_rules.get("attributeExclusionRules")
+    if isinstance(excl, dict) and isinstance(excl.get("excludedAttributes"), dict):
+        key = excl["excludedAttributes"].get("attributeKey")
+        if isinstance(key, str):
+            excluded_attrs.add(key)
+
+    return {"required": required, "excluded": excluded, "excluded_attrs": excluded_attrs,
+            "start": start, "end": end}
+
+
+def _or_default(value, default):
+    return default if value is None else value
+
+
+# Hash canonico delle regole (policyViewKey nel TA generato): insiemi ordinati per byte,
+# ogni valore preceduto dalla sua lunghezza in byte, estremi dell'intervallo in RFC3339Nano
+def rules_hash(rules):
+    h = hashlib.sha256(VIEW_KEY_PREFIX)
+    for name in ("required", "excluded", "excluded_attrs"):
+        values = sorted(v.encode("utf-8") for v in rules[name])
+        h.update(b"%d\n" % len(values))
+        for v in values:
+            h.update(b"%d:%s\n" % (len(v), v))
+    for name in ("start", "end"):
+        v = rules[name][1].encode("utf-8") if rules[name] is not None else b""
+        h.update(b"%d:%s\n" % (len(v), v))
+    return h.hexdigest()
+
+
+# Rifiuta i log che il decoder Go leggerebbe in modo diverso da expat
+def check_raw_log(log_path):
+    with open_log(log_path) as f:
+        carry = b""
+        first = True
+        while True:
+            chunk = f.read(RAW_CHUNK)
+            buf = carry + chunk
+            if first:
+                m = XML_ENCODING_RE.search(buf[:1024])
+                if m and m.group(1).lower() != b"utf-8":
+                    raise ViewNotSupported(f"encoding {m.group(1).decode('ascii', 'replace')} non supportato dal TA")
+                first = False
+            cut = len(buf) if not chunk else buf.rfind(b"<")
+            if cut <= 0 and chunk:
+                carry = buf
+                continue
+            part, carry = buf[:cut], buf[cut:]
+            if ATTR_WHITESPACE_RE.search(part) or UNSUPPORTED_RAW_RE.search(part):
+                raise ViewNotSupported("XML non riproducibile (attributi con spazi letterali o DTD)")
+            if not chunk:
+                return
+
+
+# Come encoding/xml di Go: attributi confrontati per nome locale, vince l'ultimo
+def _go_attrs(elem):
+    key = value = None
+    for name, v in elem.attrib.items():
+        local = local_name(name)
+        if local == "key":
+            key = v
+        elif local == "value":
+            value = v
+    return key or "", value
+
+
+# Ritorna, per ogni <trace> figlia di <log>: (attributi string della traccia,
+# [(strings, dates)]) con dates = [(chiave, valore originale, go_time)]
+def iter_go_traces(log_path):
+    with open_log(log_path) as f:
+        depth = 0
+        root = None
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = elem
+                    if local_name(elem.tag) != "log":
+                        raise ViewNotSupported(f"radice <{local_name(elem.tag)}> invece di <log>")
+                continue
+            depth -= 1
+            if depth != 1 or local_name(elem.tag) != "trace":
+                continue
+            trace_attrs = []
+            events = []
+            for child in elem:
+                tag = local_name(child.tag)
+                if tag == "string":
+                    key, value = _go_attrs(child)
+                    trace_attrs.append((key, value or ""))
+                elif tag == "event":
+                    strings, dates = [], []
+                    for attr in child:
+                        attr_tag = local_name(attr.tag)
+                        key, value = _go_attrs(attr)
+                        if attr_tag == "string":
+                            strings.append((key, value or ""))
+                        elif attr_tag == "date":
+                            if value is None:
+                                parsed = (ZERO_TIME, "0001-01-01T00:00:00Z", 0)
+                            else:
+                                parsed = go_time(value)
+                                if parsed is None:
+                                    raise ViewNotSupported(f"data non RFC3339: {value!r}")
+                            dates.append((key, value or "", parsed))
+                    events.append((strings, dates))
+            yield trace_attrs, events
+            elem.clear()
+            if root is not None:
+                root.clear()
+
+
+class AccessLogWriter:
+    # Scrive il log filtrato con lo stesso formato di xml.MarshalIndent(XES{...}, "", "  ")
+
+    def __init__(self, out):
+        self.out = out
+        self.traces = 0
+
+    def add_trace(self, events):
+        w = self.out.write
+        w("\n  <trace>" if self.traces else "<log>\n  <trace>")
+        self.traces += 1
+        for strings, dates in events:
+            w("\n    <event>")
+            for key, value in strings:
+                w(f'\n      <string key="{escape_attr(key)}" value="{escape_attr(value)}"></string>')
+            for key, _, parsed in dates:
+                if parsed[2] > 23:
+                    # Time.MarshalText rifiuta offset oltre le 23 ore: il TA risponde con errore
+                    raise ViewNotSupported("offset orario non serializzabile")
+                w(f'\n      <date key="{escape_attr(key)}" value="{parsed[1]}"></date>')
+            w("\n    </event>" if strings or dates else "</event>")
+        w("\n  </trace>" if events else "</trace>")
+
+    def close(self):
+        self.out.write("\n</log>" if self.traces else "<log></log>")
+
+
+# Costruisce la vista in out_dir (file temporanei poi rinominati, manifest per ultimo).
+# Solleva ViewNotSupported se il risultato del TA non è riproducibile.
+def build_view(log_path, log_hash, rules, out_dir):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    check_raw_log(log_path)
+    key = rules_hash(rules)
+    required, excluded = rules["required"], rules["excluded"]
+    excluded_attrs = rules["excluded_attrs"]
+    start = rules["start"][0] if rules["start"] is not None else None
+    end = rules["end"][0] if rules["end"] is not None else None
+
+    tmp_files = []
+
+    def tmp_path():
+        fd, name = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+        os.close(fd)
+        tmp_files.append(name)
+        return name
+
+    try:
+        access_tmp = tmp_path()
+        variants = VariantsBuilder()
+        selected = 0
+        with open(access_tmp, "w", encoding="utf-8", newline="") as out:
+            writer = AccessLogWriter(out)
+            for trace_attrs, events in iter_go_traces(log_path):
+                names = {v for strings, _ in events for k, v in strings if k == ACTIVITY_KEY}
+                if (required and not names & required) or names & excluded:
+                    continue
+                selected += 1
+                variants.add_trace(trace_attrs, [(s, [(k, v) for k, v, _ in d]) for s, d in events])
+                kept = []
+                for strings, dates in events:
+                    stamps = [p[0] for k, _, p in dates if k == TIME_KEY]
+                    if start is not None and any(ts < start for ts in stamps):
+                        continue
+                    if end is not None and any(ts > end for ts in stamps):
+                        continue
+                    kept.append(([(k, v) for k, v in strings if k not in excluded_attrs], dates))
+                writer.add_trace(kept)
+            writer.close()
+
+        variants_tmp = tmp_path()
+        variants.write(variants_tmp, log_hash)
+        manifest_tmp = tmp_path()
+        with open(manifest_tmp, "w", encoding="utf-8") as out:
+            json.dump({"version": VIEW_VERSION, "source_sha256": log_hash, "rules_sha256": key,
+                       "traces": selected}, out)
+
+        os.replace(access_tmp, out_dir / VIEW_ACCESS_LOG)
+        os.replace(variants_tmp, out_dir / VIEW_VARIANTS)
+        os.replace(manifest_tmp, out_dir / VIEW_MANIFEST)
+    except UnicodeEncodeError as exc:
+        raise ViewNotSupported(f"valore non codificabile in UTF-8: {exc}")
+    finally:
+        for name in tmp_files:
+            Path(name).unlink(missing_ok=True)
+    return key
@@ -0,0 +1,362 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from file_lock import write_json_atomic
+
+# Registro delle configurazioni dei TA su SQLite (generated_tas/registry.sqlite3).
+# Sostituisce le scansioni lineari di mapping.json: deduplica per dedup_key, allocazione
+# degli id e ricerca dei log per hash sono lookup su indice.
+# mapping.json resta il formato letto dai TA (config.LoadMappings) e viene riesportato
+# dal registro, nella stessa transazione, a ogni nuova configurazione.
+# Al primo utilizzo i mapping.json già presenti vengono importati.
+# La tabella jobs contiene lo stato dei job asincroni di /setup (vedi jobs.py), così
+# ogni worker della piattaforma può rispondere a /jobs/<id>; log_challenges i nonce
+# emessi per le prove di possesso dei log (vedi policy_utils.find_proven_log).
+
+REGISTRY_ROOT = Path("generated_tas")
+REGISTRY_PATH = REGISTRY_ROOT / "registry.sqlite3"
+
+PHASES = ("logUsage", "output", "processing")
+MAPPING_FIELDS = ("log_file", "config_path", "data_path", "authorized_users", "owner", "dedup_key")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tas (
+    ta_hash TEXT PRIMARY KEY,
+    last_config_num INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS configs (
+    ta_hash TEXT NOT NULL,
+    config_id TEXT NOT NULL,
+    config_num INTEGER NOT NULL,
+    log_file TEXT NOT NULL,
+    log_hash TEXT,
+    config_path TEXT NOT NULL,
+    data_path TEXT NOT NULL,
+    owner TEXT,
+    dedup_key TEXT,
+    extra TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (ta_hash, config_id)
+);
+CREATE INDEX IF NOT EXISTS idx_configs_dedup_key ON configs (dedup_key);
+CREATE INDEX IF NOT EXISTS idx_configs_owner ON configs (owner);
+CREATE INDEX IF NOT EXISTS idx_configs_log_hash ON configs (log_hash);
+CREATE TABLE IF NOT EXISTS authorized_users (
+    ta_hash TEXT NOT NULL,
+    config_id TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (ta_hash, config_id, phase, position)
+);
+CREATE INDEX IF NOT EXISTS idx_authorized_users_user ON authorized_users (user_id, phase);
+CREATE TABLE IF NOT EXISTS blobs (
+    log_hash TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS config_blobs (
+    ta_hash TEXT NOT NULL,
+    config_id TEXT NOT NULL,
+    log_hash TEXT NOT NULL,
+    PRIMARY KEY (ta_hash, config_id)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    spool_path TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS log_challenges (
+    nonce TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+_imported = set()
+_import_lock = threading.Lock()
+
+
+def connect(path=REGISTRY_PATH):
+    # Una connessione per thread e per file di registro
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    path = Path(path)
+    conn = conns.get(path)
+    if conn is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _migrate(conn)
+        conns[path] = conn
+        import_mappings(conn, path.parent)
+    return conn
+
+
+# Colonne aggiunte a tabelle già esistenti nei registri creati in precedenza
+MIGRATIONS = (("jobs", "lease_until", "REAL"),)
+
+
+def _migrate(conn):
+    for table, column, decl in MIGRATIONS:
+        if column in {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}:
+            continue
+        try:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        except sqlite3.OperationalError:
+            pass  # aggiunta nel frattempo da un altro processo
+
+
+# BEGIN IMMEDIATE: il lock di scrittura è preso subito, così due processi non
+# leggono lo stesso stato per poi scontrarsi al commit.
+@contextmanager
+def transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _config_num(config_id):
+    return int(config_id) if config_id.isdigit() else 0
+
+
+def _insert_config(conn, ta_hash, config_id, entry, log_hash):
+    extra = {k: v for k, v in entry.items() if k not in MAPPING_FIELDS}
+    conn.execute(
+        "INSERT INTO configs (ta_hash, config_id, config_num, log_file, log_hash, config_path, data_path,"
+        " owner, dedup_key, extra, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (ta_hash, config_id, _config_num(config_id), entry["log_file"], log_hash, entry["config_path"],
+         entry["data_path"], entry.get("owner"), entry.get("dedup_key"),
+         json.dumps(extra) if extra else None, time.time())
+    )
+    conn.executemany(
+        "INSERT INTO authorized_users (ta_hash, config_id, phase, position, user_id) VALUES (?, ?, ?, ?, ?)",
+        [
+            (ta_hash, config_id, phase, position, user_id)
+            for phase, users in entry.get("authorized_users", {}).items()
+            for position, user_id in enumerate(users)
+        ]
+    )
+    conn.execute(
+        "INSERT INTO tas (ta_hash, last_config_num) VALUES (?, ?) "
+        "ON CONFLICT(ta_hash) DO UPDATE SET last_config_num = MAX(last_config_num, excluded.last_config_num)",
+        (ta_hash, _config_num(config_id))
+    )
+
+
+# Importa i mapping.json dei TA non ancora presenti nel registro (una volta per processo)
+def import_mappings(conn, root=REGISTRY_ROOT):
+    root = Path(root)
+    with _import_lock:
+        if root in _imported:
+            return
+        with transaction(conn):
+            known = {row["ta_hash"] for row in conn.execute("SELECT ta_hash FROM tas")}
+            for mapping_path in sorted(root.glob("*/mapping.json")):
+                ta_hash = mapping_path.parent.name
+                if ta_hash in known:
+                    continue
+                try:
+                    mapping = json.loads(mapping_path.read_text())
+                except (OSError, ValueError):
+                    print(f"[warn] mapping non leggibile, ignorato: {mapping_path}")
+                    continue
+                conn.execute("INSERT INTO tas (ta_hash, last_config_num) VALUES (?, 0)", (ta_hash,))
+                for config_id, entry in mapping.items():
+                    log_hash = entry.get("dedup_key", "").rsplit(":", 1)[-1] or None
+                    _insert_config(conn, ta_hash, config_id, entry, log_hash)
+            _backfill_blob_refs(conn)
+        _imported.add(root)
+
+
+# Ogni configurazione con un log_hash conta come riferimento al blob, anche se è stata
+# importata da mapping.json o il suo log è una copia precedente allo store: una voce in
+# più tiene in vita il blob, una in meno permetterebbe di rimuoverlo mentre è in uso.
+# I contatori vengono poi ricalcolati da config_blobs (righe dei setup in corso comprese).
+def _backfill_blob_refs(conn):
+    conn.execute(
+        "INSERT OR IGNORE INTO config_blobs (ta_hash, config_id, log_hash) "
+        "SELECT ta_hash, config_id, log_hash FROM configs WHERE log_hash IS NOT NULL"
+    )
+    conn.execute("DELETE FROM blobs")
+    conn.execute(
+        "INSERT INTO blobs (log_hash, refcount) SELECT log_hash, COUNT(*) FROM config_blobs GROUP BY log_hash"
+    )
+
+
+def _entry_from_row(conn, row):
+    entry = {
+        "log_file": row["log_file"],
+        "config_path": row["config_path"],
+        "data_path": row["data_path"],
+    }
+    if row["extra"]:
+        entry.update(json.loads(row["extra"]))
+    users = {phase: [] for phase in PHASES}
+    for user in conn.execute(
+        "SELECT phase, user_id FROM authorized_users WHERE ta_hash = ? AND config_id = ? "
+        "ORDER BY phase, position", (row["ta_hash"], row["config_id"])
+    ):
+        users.setdefault(user["phase"], []).append(user["user_id"])
+    entry["authorized_users"] = users
+    entry["owner"] = row["owner"]
+    entry["dedup_key"] = row["dedup_key"]
+    return entry
+
+
+def get_config(ta_hash, config_id, conn=None):
+    conn = conn or connect()
+    row = conn.execute(
+        "SELECT * FROM configs WHERE ta_hash = ? AND config_id = ?", (ta_hash, config_id)
+    ).fetchone()
+    return _entry_from_row(conn, row) if row else None
+
+
+def find_duplicate(ta_hash, dedup_key, conn=None):
+    conn = conn or connect()
+    row = conn.execute(
+        "SELECT * FROM configs WHERE dedup_key = ? AND ta_hash = ? LIMIT 1", (dedup_key, ta_hash)
+    ).fetchone()
+    if row is None:
+        return None
+    return row["config_id"], _entry_from_row(conn, row)
+
+
+def configs_by_owner(owner, conn=None):
+    conn = conn or connect()
+    return [
+        (row["ta_hash"], row["config_id"])
+        for row in conn.execute(
+            "SELECT ta_hash, config_id FROM configs WHERE owner = ? ORDER BY ta_hash, config_num", (owner,)
+        )
+    ]
+
+
+# Path del log con il dato SHA-256, se ancora presente su disco
+def find_log_by_hash(log_hash, conn=None, root=REGISTRY_ROOT):
+    conn = conn or connect()
+    for row in conn.execute(
+        "SELECT ta_hash, data_path, log_file FROM configs WHERE log_hash = ?", (log_hash,)
+    ):
+        # data_path è relativo alla cwd della piattaforma oppure, nei TA scritti a mano, alla directory del TA
+        for candidate in (Path(row["data_path"]) / row["log_file"],
+                          Path(root) / row["ta_hash"] / row["data_path"] / row["log_file"]):
+            if candidate.is_file():
+                return candidate
+    return None
+
+
+# Nonce per la prova di possesso di un log, valido per ttl secondi
+def issue_log_challenge(ttl, conn=None):
+    conn = conn or connect()
+    nonce = secrets.token_hex(32)
+    now = time.time()
+    with transaction(conn):
+        conn.execute("DELETE FROM log_challenges WHERE expires_at < ?", (now,))
+        conn.execute("INSERT INTO log_challenges (nonce, expires_at) VALUES (?, ?)", (nonce, now + ttl))
+    return nonce
+
+
+def log_challenge_valid(nonce, conn=None):
+    conn = conn or connect()
+    row = conn.execute(
+        "SELECT 1 FROM log_challenges WHERE nonce = ? AND expires_at >= ?", (nonce, time.time())
+    ).fetchone()
+    return row is not None
+
+
+# Il nonce usato da /setup vale una volta sola: una prova intercettata non si può riusare
+def consume_log_challenge(nonce, conn=None):
+    conn = conn or connect()
+    with transaction(conn):
+        cur = conn.execute(
+            "DELETE FROM log_challenges WHERE nonce = ? AND expires_at >= ?", (nonce, time.time())
+        )
+    return cur.rowcount == 1
+
+
+# Prossimo id libero per il TA: il massimo tra registro e directory già presenti su disco
+def next_config_id(ta_hash, configs_dir, conn=None):
+    conn = conn or connect()
+    row = conn.execute("SELECT last_config_num FROM tas WHERE ta_hash = ?", (ta_hash,)).fetchone()
+    last = row["last_config_num"] if row else 0
+    if row is None and Path(configs_dir).exists():
+        existing = [int(p.name) for p in Path(configs_dir).iterdir() if p.is_dir() and p.name.isdigit()]
+        last = max(existing, default=0)
+    return f"{last + 1:02}"
+
+
+def export_mapping(ta_hash, mapping_path, conn=None):
+    conn = conn or connect()
+    mapping = {
+        row["config_id"]: _entry_from_row(conn, row)
+        for row in conn.execute("SELECT * FROM configs WHERE ta_hash = ? ORDER BY config_num, config_id", (ta_hash,))
+    }
+    write_json_atomic(mapping_path, mapping)
+
+
+# Registra una nuova configurazione e riesporta mapping.json nella stessa transazione.
+# Il riferimento al blob del log è già stato preso da add_blob_ref durante il collegamento.
+def register_config(ta_hash, config_id, entry, log_hash, mapping_path, conn=None):
+    conn = conn or connect()
+    with transaction(conn):
+        _insert_config(conn, ta_hash, config_id, entry, log_hash)
+        export_mapping(ta_hash, mapping_path, conn)
+
+
+# Riferimento di data/<id>/ al blob del log. Chiamata da blob_store.store_and_link
+# sotto BLOB_LOCK, così nessuno vede il blob collegato ma ancora senza riferimenti.
+def add_blob_ref(ta_hash, config_id, log_hash, conn=None):
+    conn = conn or connect()
+    with transaction(conn):
+        conn.execute(
+            "INSERT INTO config_blobs (ta_hash, config_id, log_hash) VALUES (?, ?, ?)",
+            (ta_hash, config_id, log_hash)
+        )
+        conn.execute(
+            "INSERT INTO blobs (log_hash, refcount) VALUES (?, 1) "
+            "ON CONFLICT(log_hash) DO UPDATE SET refcount = refcount + 1",
+            (log_hash,)
+        )
+
+
+# Rilascia il riferimento di una configurazione il cui salvataggio non è andato a buon fine.
+# Ritorna l'hash del blob se era l'ultimo riferimento (il blob va raccolto), altrimenti None.
+def release_blob_ref(ta_hash, config_id, conn=None):
+    conn = conn or connect()
+    with transaction(conn):
+        ref = conn.execute(
+            "SELECT log_hash FROM config_blobs WHERE ta_hash = ? AND config_id = ?", (ta_hash, config_id)
+        ).fetchone()
+        if ref is None:
+            return None
+        conn.execute("DELETE FROM config_blobs WHERE ta_hash = ? AND config_id = ?", (ta_hash, config_id))
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE log_hash = ?", (ref["log_hash"],))
+        cur = conn.execute("DELETE FROM blobs WHERE log_hash = ? AND refcount <= 0", (ref["log_hash"],))
+    return ref["log_hash"] if cur.rowcount else None
+
+
+def blob_refcount(log_hash, conn=None):
+    conn = conn or connect()
+    row = conn.execute("SELECT refcount FROM blobs WHERE log_hash = ?", (log_hash,)).fetchone()
+    return row["refcount"] if row else 0
@@ -0,0 +1,319 @@
+import re
+from rdflib import RDF, XSD, BNode, Literal, URIRef
+
+# Parser Turtle "veloce" per il sottoinsieme emesso dai client DataOwner
+# (template di PolicyAssignment_client3.py): @prefix, blocchi [ ... ] di blank node,
+# liste RDF ( ... ), literal stringa/tipizzati, interi e IRI.
+# Produce un grafo minimale con la stessa interfaccia usata da parse_policy_turtle
+# (subjects/objects/value/items) e gli stessi termini rdflib, così il dict risultante
+# è identico a quello ottenuto passando da rdflib.Graph.
+# Qualsiasi costrutto non riconosciuto solleva UnsupportedTurtle: il chiamante
+# ricade sul parser completo di rdflib.
+
+
+class UnsupportedTurtle(Exception):
+    pass
+
+
+# Datatype di cui sappiamo replicare la normalizzazione dei literal fatta da rdflib
+SUPPORTED_DATATYPES = {XSD.string, XSD.integer, XSD.dateTime}
+
+STRING_ESCAPES = {
+    "t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f",
+    '"': '"', "'": "'", "\\": "\\",
+}
+
+TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+|\#[^\n]*)
+  | (?P<iri><[^<>"{}|^`\\\x00-\x20]*>)
+  | (?P<longstring>\"\"\"|''')
+  | (?P<string>"(?:[^"\\\n\r]|\\.)*"|'(?:[^'\\\n\r]|\\.)*')
+  | (?P<directive>@prefix\b|@base\b)
+  | (?P<langtag>@[A-Za-z]+(?:-[A-Za-z0-9]+)*)
+  | (?P<datatype>\^\^)
+  | (?P<number>[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<pname>(?:[A-Za-z][A-Za-z0-9_\-]*)?:(?:[A-Za-z0-9_](?:[A-Za-z0-9_\-.]*[A-Za-z0-9_\-])?)?)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_\-]*)
+  | (?P<blanklabel>_:)
+  | (?P<punct>[\[\]();,.])
+""", re.VERBOSE)
+
+ABSOLUTE_IRI_RE = re.compile(r"[A-Za-z][A-Za-z0-9+.\-]*:")
+
+
+def tokenize(text):
+    pos = 0
+    for m in TOKEN_RE.finditer(text):
+        if m.start() != pos:
+            break
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == "ws":
+            continue
+        if kind in ("longstring", "blanklabel"):
+            raise UnsupportedTurtle(f"costrutto non supportato: {m.group()}")
+        yield kind, m.group()
+    if pos != len(text):
+        raise UnsupportedTurtle(f"carattere non riconosciuto in posizione {pos}")
+    yield "eof", ""
+
+
+def unescape_string(raw):
+    body = raw[1:-1]
+    if "\\" not in body:
+        return body
+    out = []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch != "\\":
+            out.append(ch)
+            i += 1
+            continue
+        esc = body[i + 1]
+        if esc in STRING_ESCAPES:
+            out.append(STRING_ESCAPES[esc])
+            i += 2
+        elif esc in "uU":
+            width = 4 if esc == "u" else 8
+            hex_digits = body[i + 2:i + 2 + width]
+            if len(hex_digits) != width:
+                raise UnsupportedTurtle("escape unicode incompleto")
+            out.append(chr(int(hex_digits, 16)))
+            i += 2 + width
+        else:
+            raise UnsupportedTurtle(f"escape non supportato: \\{esc}")
+    return "".join(out)
+
+
+class PolicyGraph:
+    # Triple store minimale: stessi indici (s -> p -> o e p -> o -> s) e stesso
+    # ordine di inserimento del Memory store di rdflib.
+
+    def __init__(self):
+        self._spo = {}
+        self._pos = {}
+
+    def add(self, triple):
+        s, p, o = triple
+        objects = self._spo.setdefault(s, {}).setdefault(p, {})
+        if o in objects:
+            return
+        objects[o] = None
+        self._pos.setdefault(p, {}).setdefault(o, {})[s] = None
+
+    def objects(self, subject, predicate):
+        return iter(list(self._spo.get(subject, {}).get(predicate, ())))
+
+    def subjects(self, predicate, object):
+        return iter(list(self._pos.get(predicate, {}).get(object, ())))
+
+    def value(self, subject, predicate=RDF.value):
+        return next(self.objects(subject, predicate), None)
+
+    def items(self, list):
+        chain = {list}
+        while list:
+            item = self.value(list, RDF.first)
+            if item is not None:
+                yield item
+            list = self.value(list, RDF.rest)
+            if list in chain:
+                raise ValueError("List contains a recursive rdf:rest reference")
+            chain.add(list)
+
+    def __len__(self):
+        return sum(len(objs) for preds in self._spo.values() for objs in preds.values())
+
+
+class FastTurtleParser:
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.kind, self.value = next(self.tokens)
+        self.prefixes = {}
+        self.graph = PolicyGraph()
+        # I termini rdflib sono immutabili: IRI e literal ripetuti vengono riusati
+        self.iri_cache = {}
+        self.literal_cache = {}
+
+    def advance(self):
+        self.kind, self.value = next(self.tokens)
+
+    def expect_punct(self, char):
+        if self.kind != "punct" or self.value != char:
+            raise UnsupportedTurtle(f"atteso '{char}', trovato '{self.value}'")
+        self.advance()
+
+    def at_punct(self, char):
+        return self.kind == "punct" and self.value == char
+
+    def parse(self):
+        while self.kind != "eof":
+            if self.kind == "directive" or (self.kind == "name" and self.value.upper() in ("PREFIX", "BASE")):
+                self.parse_directive()
+            else:
+                self.parse_triples()
+                self.expect_punct(".")
+        return self.graph
+
+    def parse_directive(self):
+        keyword = self.value.lstrip("@").lower()
+        sparql_style = not self.value.startswith("@")
+        if keyword != "prefix":
+            raise UnsupportedTurtle("direttiva base non supportata")
+        self.advance()
+        if self.kind != "pname" or not self.value.endswith(":"):
+            raise UnsupportedTurtle("prefisso non valido")
+        prefix = self.value[:-1]
+        self.advance()
+        if self.kind != "iri":
+            raise UnsupportedTurtle("IRI del prefisso mancante")
+        self.prefixes[prefix] = self.resolve_iri(self.value)
+        self.advance()
+        if not sparql_style:
+            self.expect_punct(".")
+
+    def parse_triples(self):
+        if self.at_punct("["):
+            subject = self.parse_blank_node_property_list()
+            if self.at_punct("."):
+                return
+        else:
+            subject = self.parse_subject()
+        self.parse_predicate_object_list(subject)
+
+    def parse_subject(self):
+        if self.kind in ("iri", "pname"):
+            return self.parse_iri()
+        if self.at_punct("("):
+            return self.parse_collection()
+        raise UnsupportedTurtle(f"soggetto non supportato: {self.value}")
+
+    def parse_predicate_object_list(self, subject):
+        self.parse_verb_object_list(subject)
+        while self.at_punct(";"):
+            self.advance()
+            while self.at_punct(";"):
+                self.advance()
+            if self.at_punct(".") or self.at_punct("]"):
+                return
+            self.parse_verb_object_list(subject)
+
+    def parse_verb_object_list(self, subject):
+        if self.kind == "name" and self.value == "a":
+            predicate = RDF.type
+            self.advance()
+        elif self.kind in ("iri", "pname"):
+            predicate = self.parse_iri()
+        else:
+            raise UnsupportedTurtle(f"predicato non supportato: {self.value}")
+        self.graph.add((subject, predicate, self.parse_object()))
+        while self.at_punct(","):
+            self.advance()
+            self.graph.add((subject, predicate, self.parse_object()))
+
+    def parse_object(self):
+        if self.kind in ("iri", "pname"):
+            return self.parse_iri()
+        if self.kind == "string":
+            return self.parse_literal()
+        if self.kind == "number":
+            return self.parse_number()
+        if self.at_punct("["):
+            return self.parse_blank_node_property_list()
+        if self.at_punct("("):
+            return self.parse_collection()
+        raise UnsupportedTurtle(f"oggetto non supportato: {self.value}")
+
+    def parse_blank_node_property_list(self):
+        self.expect_punct("[")
+        node = BNode()
+        if not self.at_punct("]"):
+            self.parse_predicate_object_list(node)
+        self.expect_punct("]")
+        return node
+
+    def parse_collection(self):
+        self.expect_punct("(")
+        items = []
+        while not self.at_punct(")"):
+            items.append(self.parse_object())
+        self.advance()
+        if not items:
+            return RDF.nil
+        head = BNode()
+        node = head
+        for i, item in enumerate(items):
+            self.graph.add((node, RDF.first, item))
+            rest = BNode() if i < len(items) - 1 else RDF.nil
+            self.graph.add((node, RDF.rest, rest))
+            node = rest
+        return head
+
+    def parse_iri(self):
+        token = self.value
+        self.advance()
+        iri = self.iri_cache.get(token)
+        if iri is None:
+            if token.startswith("<"):
+                iri = URIRef(self.resolve_iri(token))
+            else:
+                prefix, _, local = token.partition(":")
+                if prefix not in self.prefixes:
+                    raise UnsupportedTurtle(f"prefisso non dichiarato: {prefix}")
+                iri = URIRef(self.prefixes[prefix] + local)
+            self.iri_cache[token] = iri
+        return iri
+
+    def resolve_iri(self, token):
+        iri = token[1:-1]
+        if "\\" in iri or not ABSOLUTE_IRI_RE.match(iri):
+            raise UnsupportedTurtle(f"IRI relativo o con escape: {iri}")
+        return iri
+
+    def parse_literal(self):
+        raw = self.value
+        self.advance()
+        if self.kind == "langtag":
+            lang = self.value[1:]
+            self.advance()
+            return Literal(unescape_string(raw), lang=lang)
+        if self.kind == "datatype":
+            self.advance()
+            if self.kind not in ("iri", "pname"):
+                raise UnsupportedTurtle("datatype non valido")
+            datatype = self.parse_iri()
+            key = (raw, datatype)
+            if key not in self.literal_cache:
+                self.literal_cache[key] = self.typed_literal(unescape_string(raw), datatype)
+            return self.literal_cache[key]
+        return Literal(unescape_string(raw))
+
+    def typed_literal(self, lexical, datatype):
+        if datatype not in SUPPORTED_DATATYPES:
+            raise UnsupportedTurtle(f"datatype non supportato: {datatype}")
+        if datatype == XSD.integer and not re.fullmatch(r"[+-]?\d+", lexical):
+            raise UnsupportedTurtle(f"intero non valido: {lexical}")
+        literal = Literal(lexical, datatype=datatype)
+        if literal.ill_typed:
+            raise UnsupportedTurtle(f"literal non valido: {lexical}")
+        return literal
+
+    def parse_number(self):
+        token = self.value
+        if not re.fullmatch(r"[+-]?\d+", token):
+            raise UnsupportedTurtle(f"numero non intero: {token}")
+        self.advance()
+        return Literal(token, datatype=XSD.integer)
+
+
+def parse_turtle_fast(data):
+    if isinstance(data, bytes):
+        try:
+            data = data.decode("utf-8")
+        except UnicodeDecodeError as exc:
+            raise UnsupportedTurtle("policy non in UTF-8") from exc
+    if data.startswith("\ufeff"):
+        raise UnsupportedTurtle("BOM non supportato")
+    return FastTurtleParser(data).parse()
@@ -0,0 +1,106 @@
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import sys
+import uuid
+from collections import Counter
+
+import requests
+
+# Stress test di /setup con molte richieste parallele sullo stesso TA (stessa policy,
+# log tutti diversi). Da lanciare contro app.py avviato con più worker, es.:
+#   cd Platform/TAgenerator && gunicorn -w 8 -b 127.0.0.1:5000 app:app
+# Al termine verifica che:
+#   - ogni richiesta abbia creato una nuova istanza (201)
+#   - gli id assegnati siano tutti distinti
+#   - mapping.json contenga tutte le istanze create, ognuna con il proprio log in data/<id>/
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+DEFAULT_URL = "http://127.0.0.1:5000"
+DEFAULT_POLICY = os.path.join(ROOT, "DataOwner", "event_log_policyFixed.ttl")
+DEFAULT_GENERATED_TAS = os.path.join(ROOT, "Platform", "TAgenerator", "generated_tas")
+
+
+def make_log(index):
+    # Log XES minimale, reso unico da un commento così la deduplica non scatta
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f"<!-- stress {index} {uuid.uuid4().hex} -->\n"
+        '<log xes.version="1.0"><trace><string key="concept:name" value="t1"/>'
+        '<event><string key="concept:name" value="A"/></event></trace></log>\n'
+    ).encode("utf-8")
+
+
+def send_setup(url, policy_bytes, index):
+    files = {
+        "policy_file": ("policy.ttl", io.BytesIO(policy_bytes)),
+        "log_file": (f"stress_{index}.xes", io.BytesIO(make_log(index))),
+    }
+    try:
+        response = requests.post(f"{url}/setup", files=files, timeout=(30, 600))
+    except requests.exceptions.RequestException as e:
+        return index, None, {"error": str(e)}
+    try:
+        return index, response.status_code, response.json()
+    except ValueError:
+        return index, response.status_code, {"error": response.text[:200]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--policy", default=DEFAULT_POLICY)
+    parser.add_argument("--generated-tas", default=DEFAULT_GENERATED_TAS,
+                        help="directory generated_tas del server (per controllare mapping.json)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    with open(args.policy, "rb") as f:
+        policy_bytes = f.read()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda i: send_setup(args.url, policy_bytes, i), range(args.requests)))
+
+    errors = []
+    created = {}
+    for index, status, body in results:
+        if status != 201:
+            errors.append(f"richiesta {index}: status {status} -> {body}")
+            continue
+        details = body["details"]
+        created[index] = (details["hash"], details["id"], details["log_filename"])
+
+    ids = Counter((ta_hash, config_id) for ta_hash, config_id, _ in created.values())
+    for (ta_hash, config_id), count in ids.items():
+        if count > 1:
+            errors.append(f"id {config_id} assegnato {count} volte nel TA {ta_hash}")
+
+    mappings = {}
+    for ta_hash in {ta_hash for ta_hash, _, _ in created.values()}:
+        with open(os.path.join(args.generated_tas, ta_hash, "mapping.json")) as f:
+            mappings[ta_hash] = json.load(f)
+
+    for index, (ta_hash, config_id, log_filename) in created.items():
+        entry = mappings[ta_hash].get(config_id)
+        if entry is None:
+            errors.append(f"richiesta {index}: voce {config_id} assente da mapping.json")
+        elif entry["log_file"] != log_filename:
+            errors.append(f"richiesta {index}: voce {config_id} punta a {entry['log_file']} invece di {log_filename}")
+        elif not os.path.isfile(os.path.join(args.generated_tas, ta_hash, "data", config_id, log_filename)):
+            errors.append(f"richiesta {index}: log mancante in data/{config_id}")
+
+    print(f"Richieste: {len(results)}, istanze create: {len(created)}, id distinti: {len(ids)}")
+    if errors:
+        print(f"{len(errors)} problemi rilevati:")
+        for line in errors[:50]:
+            print(" -", line)
+        sys.exit(1)
+    print("OK: id univoci e nessuna voce persa in mapping.json")
+
+
+if __name__ == "__main__":
+    main()